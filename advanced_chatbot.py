@@ -1,27 +1,27 @@
-from openai import OpenAI
 import streamlit as st
+import streamlit.components.v1 as components
 from audio_recorder_streamlit import audio_recorder
-from gtts import gTTS
 import os
 from io import BytesIO
 from dotenv import load_dotenv
 # Load dotenv for picking up creds from .env
 load_dotenv()
-from advanced_chatbot import chat_llm
+from advanced_chatbot.clients import get_openai_client
+from advanced_chatbot import chat_llm, tracing
+from advanced_chatbot.memory import ConversationMemory
+from advanced_chatbot.audio_io import transcribe
+from advanced_chatbot.render import StreamRenderer
+from advanced_chatbot.voice import ReplyPlayer, SpeechPipeline
+from advanced_chatbot.answer_cache import ANSWER_CACHE
+from advanced_chatbot.llm import FOLLOW_UP_MODEL, shared_answer_cache
 import base64
 
 def encode_image(image):
     return base64.b64encode(image).decode('utf-8')
 
-TEMP_AUDIOFILENAME = 'audio_temp.mp3'
-
 ### Language - change for accuracy with ASR and TTS - you can change to automatic but you might have issues, especially with accents
 language='en'
 
-llm_client = OpenAI(
-    api_key= os.getenv("OPENAI_KEY")
-)
-
 
 st.title("💬 LLM, ASR & TTS Chatbot")
 st.caption("🚀 A chatbot powered by OpenAI LLM, OpenAI Whisper and OpenAI TTS - ADVANCED AI AGENT")
@@ -32,20 +32,28 @@ AI_MODEL = st.selectbox('Select an AI Model...', [
     'gpt-4',
 ])
 ### Function calling not supported with Vision Beta yet
+### With TRACING='true' in .env every turn is timed stage by stage - tick the box to see it under each answer
+SHOW_TRACE = tracing.enabled() and st.sidebar.checkbox("Show the latency trace of each answer")
+### With ANSWER_CACHE='true' in .env near-identical questions are answered from earlier answers - see how often that happens
+if ANSWER_CACHE:
+    CACHE_STATS = shared_answer_cache.stats()
+    st.sidebar.caption(f"Answer cache: {CACHE_STATS['hits']} hits, {CACHE_STATS['misses']} misses ({CACHE_STATS['hit_rate']:.0%}), {CACHE_STATS['size']} answers kept")
     
 if not os.getenv("OPENAI_KEY"): ## Check to see if we have the openai key set or else send back a message
     st.info("Please save your OpenAI API in the .env file in order to continue.")
     st.stop()
+### One client for the whole process - Streamlit reruns this script on every click, so it mustn't open a new connection pool each time
+llm_client = get_openai_client()
     
 ### Load the memory in the session state if it is not already there
 if "memory" not in st.session_state:
 ### Set some system and assistant prompts
-    st.session_state["memory"] = [
+    st.session_state["memory"] = ConversationMemory([
         {"role": "system", "content": "You have tools that add more up to date context to queries should they be required, otherwise act as a helpful assistant."},
-        ]
+        ])
 ### Display our messages in the memory
 for msg in st.session_state.memory:
-    if 'system' not in msg['role']: ### Hide the system messages because they will contain the skill prompts - you can remove this to check it out :)
+    if msg['role'] in ('user', 'assistant') and msg.get('content'): ### Hide the system and tool messages because they will contain the skill prompts - you can remove this to check it out :)
         st.chat_message(msg["role"]).write(msg["content"])
 
 ## Load our chat widget
@@ -54,20 +62,13 @@ AUDIO_INPUT = False
 
 ## Load our microphone recorder
 audio_bytes = audio_recorder(pause_threshold=180)
+TURN = tracing.start_span("turn", model=AI_MODEL, voice=bool(audio_bytes)) if CHAT_INPUT or audio_bytes else tracing.NOOP_SPAN
 if audio_bytes:
     st.audio(audio_bytes, format="audio/mp3")
-    # save audio file to mp3
-    with open(TEMP_AUDIOFILENAME, "wb") as f:
-        f.write(audio_bytes)
-    # load the file
-    audio_file = open(TEMP_AUDIOFILENAME, "rb")
-    # transcribe and set it as the chat input
+    # transcribe the recording straight from memory and set it as the chat input
     AUDIO_INPUT = True
-    CHAT_INPUT = llm_client.audio.transcriptions.create(
-        model="whisper-1",
-        file=audio_file,
-        language=language
-        ).text
+    with tracing.start_span("transcribe", parent=TURN, audio_bytes=len(audio_bytes)):
+        CHAT_INPUT = transcribe(llm_client, audio_bytes, language=language)
     
 
 ### Start processing...
@@ -79,32 +80,33 @@ if prompt := CHAT_INPUT: ## If we have an input
     st.chat_message("user").write(prompt)
     
     
-    ## Open a placeholder with a spinner
-    with st.chat_message("assistant"):
+    ## Open a placeholder with a spinner - everything in here is traced as part of this turn
+    with st.chat_message("assistant"), TURN:
         with st.spinner("Thinking..."):
             ## Call openai with the memory in order to get a response
-            PLACEHOLDER = st.empty() # create an empty placeholder to gather the tokens
-            FULL_RESPONSE = '' # create an empty string to keep the full response
-            counter = 0
-            for token in chat_llm(AI_MODEL, st.session_state.memory): # Get the tokens yielded from the LLM function - ADVANCED
-                    FULL_RESPONSE += str(token) ## Add the delta to the full response
-                    counter += 1
-                    if counter >= 30:
-                        PLACEHOLDER.markdown(FULL_RESPONSE) ## Add to the placeholder
-                        counter = 0
+            RENDER = StreamRenderer(st.empty()) # an empty placeholder that is redrawn a few times a second as the tokens arrive
+            SPEECH = SpeechPipeline(llm_client) if AUDIO_INPUT else None # speak each sentence as soon as it is written
+            PLAYER = ReplyPlayer(components.html) if AUDIO_INPUT else None # one audio element plays the sentences back to back
+            for token in chat_llm(AI_MODEL, st.session_state.memory.build_prompt(AI_MODEL, FOLLOW_UP_MODEL)): # Get the tokens yielded from the LLM function - ADVANCED - only the turns that fit the model's budget are sent
+                    RENDER.write(token) ## Add the delta to the full response
+                    if SPEECH:
+                        SPEECH.feed(str(token))
+                        for clip in SPEECH.poll(): ## clips that are ready, in sentence order - queued to play as soon as the last one ends
+                            PLAYER.add(clip)
                     
-            PLACEHOLDER.markdown(FULL_RESPONSE) ## Finally update one last time
+            FULL_RESPONSE = RENDER.close() ## Finally update one last time
+            TURN.set(first_paint_ms=round(RENDER.first_paint_seconds * 1000, 2), renders=RENDER.renders, history_tokens=st.session_state.memory.last_prompt_tokens)
+            st.caption(f"Prompt: {st.session_state.memory.last_prompt_tokens} tokens, {st.session_state.memory.last_dropped} older messages left out - first words after {RENDER.first_paint_seconds:.2f}s, {RENDER.renders} redraws") ## How big the request was and how it streamed
             
             # Add our bot response to the memory.
             st.session_state.memory.append({"role":"assistant","content": FULL_RESPONSE})
             
-            # Play back audio
-            if AUDIO_INPUT:
-                tts = llm_client.audio.speech.create(
-                    model='tts-1',
-                    voice='fable',
-                    input=FULL_RESPONSE
-                )
-                tts.stream_to_file(TEMP_AUDIOFILENAME)  # Stream to the temporary file
-                
-                st.audio(open(TEMP_AUDIOFILENAME,'rb').read(), format='audio/mp3')
\ No newline at end of file
+            # Play back the rest of the audio - the sentences still being synthesized, in order
+            if SPEECH:
+                for clip in SPEECH.close():
+                    PLAYER.add(clip)
+                st.audio(PLAYER.recording(), format='audio/mp3') # and the whole reply in a single player, to listen again
+
+    if SHOW_TRACE: ## the debug panel - one row per stage: transcription, completions, tools and speech
+        with st.expander("Latency trace"):
+            st.dataframe(tracing.tracer.trace(TURN.trace_id))
\ No newline at end of file
@@ -0,0 +1,157 @@
+# Semantic answer cache - a question that is close enough to one answered before gets the same answer back
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+### Opt-in: ANSWER_CACHE='true' in .env (or pass answer_cache= to chat_llm)
+ANSWER_CACHE = os.getenv('ANSWER_CACHE', 'false').lower() in ('1', 'true', 'yes')
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95')) ## cosine similarity needed for a hit
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+### The manifest written by `python -m advanced_chatbot.reindex` - when its version changes the cached answers are dropped
+KB_MANIFEST = os.getenv('KB_MANIFEST', './.cache/books_manifest.json')
+
+
+class ManifestVersion:
+    """
+    Reads the knowledge base version from the reindex manifest, only re-reading the file when it changes on disk.
+    """
+
+    def __init__(self, path=KB_MANIFEST):
+        self.path = path
+        self._stamp = None
+        self._version = None
+
+    def __call__(self):
+        try:
+            stat = os.stat(self.path)
+        except (OSError, TypeError):
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._stamp:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self._version = json.load(file).get('version')
+            except (OSError, ValueError):
+                self._version = None
+            self._stamp = stamp
+        return self._version
+
+
+class SemanticAnswerCache:
+    """
+    Previous answers indexed by the embedding of the question that produced them.
+
+    lookup() returns the answer whose question is the most similar to the new one, if the cosine similarity is at
+    least `threshold` and the entry hasn't expired. Vectors live in one preallocated matrix, so a lookup is a single
+    matrix-vector product. The least recently used answer makes room when the cache is full, and everything is
+    dropped when `version()` (by default the knowledge base manifest's version) changes.
+    """
+
+    def __init__(self, embed, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, maxsize=ANSWER_CACHE_SIZE,
+                 version=None, clock=time.monotonic):
+        self.embed_function = embed ## text -> embedding
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.version = version or ManifestVersion()
+        self.clock = clock
+        self.vectors = None ## (maxsize, dimensions) float32, created with the first answer
+        self.valid = np.zeros(maxsize, dtype=bool)
+        self.expires = np.zeros(maxsize) ## per slot, on the clock's scale
+        self.entries = OrderedDict() ## slot -> (question, answer, expires), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._known_version = self.version()
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        """
+        The normalised question vector, or None if it couldn't be embedded - the turn then simply isn't cached.
+        """
+        try:
+            vector = np.asarray(self.embed_function(text), dtype=np.float32)
+        except Exception:
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _check_version(self):
+        version = self.version()
+        if version != self._known_version:
+            self._known_version = version
+            self.clear()
+            self.invalidations += 1
+
+    def clear(self):
+        self.valid[:] = False
+        self.entries.clear()
+
+    def lookup(self, vector):
+        """
+        Returns (answer, similarity) for a hit, or None.
+        """
+        with self._lock:
+            self._check_version()
+            if vector is None or self.vectors is None or not self.entries:
+                self.misses += 1
+                return None
+            ### Free every expired slot first, so an old best match can't hide a live one that is also above the threshold
+            for slot in np.flatnonzero(self.valid & (self.expires <= self.clock())):
+                del self.entries[int(slot)]
+                self.valid[slot] = False
+            scores = self.vectors @ vector
+            scores[~self.valid] = -np.inf
+            slot = int(np.argmax(scores))
+            if not self.valid[slot] or scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+            question, answer, expires = self.entries[slot]
+            self.entries.move_to_end(slot)
+            self.hits += 1
+            return answer, float(scores[slot])
+
+    def store(self, vector, answer, question=None):
+        if vector is None or not answer:
+            return
+        with self._lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            free = np.flatnonzero(~self.valid)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot, _ = self.entries.popitem(last=False) ## reuse the least recently used slot
+                self.evictions += 1
+            self.vectors[slot] = vector
+            self.valid[slot] = True
+            self.expires[slot] = self.clock() + self.ttl
+            self.entries[slot] = (question, answer, self.expires[slot])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "size": len(self.entries),
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def replay(answer, words_per_chunk=3):
+    """
+    Stream a cached answer back a few words at a time, like a completion would.
+    """
+    words = answer.split(' ')
+    for start in range(0, len(words), words_per_chunk):
+        yield ' '.join(words[start:start + words_per_chunk]) + (' ' if start + words_per_chunk < len(words) else '')
@@ -0,0 +1,67 @@
+# Helpers for the OpenAI Assistants chatbot - look the assistant up once, and stream runs instead of polling them
+import time
+
+### A run in any of these states won't change any more
+FINISHED_RUN_STATES = {'completed', 'failed', 'cancelled', 'expired', 'incomplete', 'requires_action'}
+
+
+def find_or_create_assistant(llm_client, name, instructions, model="gpt-3.5-turbo-1106", tools=None):
+    """
+    The id of the assistant called `name`, creating it the first time.
+    """
+    for assistant in llm_client.beta.assistants.list():
+        if assistant.name == name:
+            return assistant.id
+    return llm_client.beta.assistants.create(
+        name=name,
+        instructions=instructions,
+        tools=tools or [],
+        model=model
+    ).id
+
+
+def stream_reply(llm_client, thread_id, assistant_id, prompt):
+    """
+    Add the user's message and run the assistant in a single request, yielding the answer as it is written.
+    The stream ends the moment the run does - there is nothing to poll.
+    """
+    with llm_client.beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        additional_messages=[{"role": "user", "content": prompt}]
+    ) as stream:
+        for text in stream.text_deltas:
+            yield text
+
+
+def wait_for_run(llm_client, thread_id, run_id, first_delay=0.1, max_delay=2.0, backoff=1.5, timeout=120):
+    """
+    Poll a run until it finishes, starting with short gaps and backing off - a quick run is picked up within
+    a fraction of a second, a slow one doesn't cost a request every 100ms.
+    """
+    deadline = time.monotonic() + timeout
+    delay = first_delay
+    while True:
+        run = llm_client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+        if run.status in FINISHED_RUN_STATES:
+            return run
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"run {run_id} is still {run.status} after {timeout}s")
+        time.sleep(delay)
+        delay = min(delay * backoff, max_delay)
+
+
+def poll_reply(llm_client, thread_id, assistant_id, prompt, **options):
+    """
+    The same turn as stream_reply() for when streaming isn't available: start the run with the user's message,
+    wait for it with wait_for_run() and fetch only the newest message.
+    """
+    run = llm_client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        additional_messages=[{"role": "user", "content": prompt}]
+    )
+    run = wait_for_run(llm_client, thread_id, run.id, **options)
+    if run.status != 'completed':
+        return f"The assistant run ended as {run.status}."
+    return llm_client.beta.threads.messages.list(thread_id=thread_id, limit=1).data[0].content[0].text.value
@@ -0,0 +1,221 @@
+# Async version of chat_llm and its skills - for the API server, where one event loop serves many users at once
+import asyncio
+import os
+from collections import Counter
+from contextlib import asynccontextmanager
+from .clients import HTTP_MAX_CONNECTIONS, get_async_openai_client
+from .answer_cache import ANSWER_CACHE, replay
+from .llm import (DEFAULT_TOOL_TIMEOUT, FOLLOW_UP_MODEL, TOOL_TIMEOUTS, add_tool_delta, cacheable_turn, get_tools, opening_question,
+                  parse_arguments, record_tool_failure, shared_answer_cache)
+from .search_internet import search_internet
+from .search_kb import kb_prompt, query_cache
+from dotenv import load_dotenv
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+### How many requests each worker may have open against every upstream service at the same time
+UPSTREAM_LIMITS = {
+    "openai": int(os.getenv('OPENAI_CONCURRENCY', str(HTTP_MAX_CONNECTIONS))), ## no point going past the connection pool
+    "search_kb": int(os.getenv('KB_CONCURRENCY', '8')),
+    "search_internet": int(os.getenv('SEARCH_CONCURRENCY', '4')), ## DuckDuckGo rate limits aggressively
+}
+
+
+class UpstreamLimits:
+    """
+    One semaphore per upstream service, so a burst of users queues up here instead of piling onto the API.
+
+        async with limits("openai"):
+            ...
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(UPSTREAM_LIMITS if limits is None else limits)
+        self._semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+        self.in_use = Counter()
+        self.waiting = Counter()
+        self.peak = Counter()
+
+    @asynccontextmanager
+    async def __call__(self, name):
+        self.waiting[name] += 1
+        try:
+            await self._semaphores[name].acquire()
+        finally:
+            self.waiting[name] -= 1
+        self.in_use[name] += 1
+        self.peak[name] = max(self.peak[name], self.in_use[name])
+        try:
+            yield
+        finally:
+            self.in_use[name] -= 1
+            self._semaphores[name].release()
+
+    def stats(self):
+        return {
+            name: {"limit": limit, "in_use": self.in_use[name], "waiting": self.waiting[name], "peak": self.peak[name]}
+            for name, limit in self.limits.items()
+        }
+
+
+async def asearch_kb(query, limits):
+    async with limits("openai"):
+        embeddings = await query_cache.aembed(get_async_openai_client(), query, model="text-embedding-ada-002")
+    async with limits("search_kb"):
+        return await asyncio.to_thread(kb_prompt, query, embeddings) ## the vector search is blocking (numpy or qdrant_client)
+
+
+async def asearch_internet(query, limits):
+    async with limits("search_internet"):
+        return await asyncio.to_thread(search_internet, query) ## duckduckgo_search has no async API
+
+
+### Same names as llm.available_functions
+async_functions = {
+    "search_internet": asearch_internet,
+    "search_kb": asearch_kb
+}
+
+
+def start_tool(call, limits):
+    """
+    Start one tool call as a task. Returns None if the tool doesn't exist or the arguments are broken.
+    """
+    function_to_call = async_functions.get(call["function"]["name"])
+    function_args = parse_arguments(call)
+    if function_to_call is None or function_args is None:
+        return None
+    return asyncio.create_task(function_to_call(limits=limits, **function_args))
+
+
+async def run_tools(tool_calls, tasks):
+    """
+    Wait for every tool (they are already running) and return one "tool" message per call plus the names of the tools
+    that failed, like llm.run_tools.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    tool_messages = []
+    failed = []
+    for call, task in zip(tool_calls, tasks):
+        name = call["function"]["name"]
+        if task is None:
+            content = f"The tool {name} is not available."
+            failed.append(name)
+        else:
+            timeout = TOOL_TIMEOUTS.get(name, DEFAULT_TOOL_TIMEOUT)
+            try:
+                content = (await asyncio.wait_for(task, max(0, started + timeout - loop.time())))["content"]
+            except asyncio.TimeoutError:
+                content = f"The tool {name} timed out. Please try again."
+                failed.append(name)
+            except Exception as err:
+                content = f"The tool {name} failed: {err}"
+                failed.append(name)
+        tool_messages.append({"role": "tool", "tool_call_id": call["id"], "content": content})
+    for name in failed:
+        record_tool_failure(name)
+    return tool_messages, failed
+
+
+async def achat_llm(aimodel, incoming_messages, limits, answer_cache=None):
+    """
+    chat_llm as an async generator: the same two streamed completions, tools started as soon as their arguments
+    are complete, errors handed back as tokens and the same opt-in answer cache. Every upstream call goes through
+    `limits`, and the tokens are only pulled from OpenAI as fast as the caller consumes them.
+    """
+    llm_client = get_async_openai_client()
+    cache = (shared_answer_cache if ANSWER_CACHE else None) if answer_cache is None else answer_cache
+    question_vector = None
+    if cache is not None:
+        question = opening_question(incoming_messages)
+        if question:
+            async with limits("openai"):
+                question_vector = await asyncio.to_thread(cache.embed, question)
+        hit = cache.lookup(question_vector) if question_vector is not None else None
+        if hit is not None:
+            for token in replay(hit[0]):
+                yield token
+            return
+    answer_parts = []
+
+    tools = list(get_tools())
+    messages = list(incoming_messages)
+    started_tools = {}
+    tasks = []
+    try:
+        tool_calls = {}
+        failed_tools = []
+        async with limits("openai"):
+            response_generator = await llm_client.chat.completions.create(
+                model=aimodel,
+                messages=messages,
+                temperature=0.7,
+                tools=tools,
+                tool_choice="auto",
+                stream=True,
+                max_tokens=300
+            )
+            async with response_generator:
+                async for response_chunk in response_generator:
+                    if not response_chunk.choices:
+                        continue
+                    deltas = response_chunk.choices[0].delta
+                    if deltas.tool_calls:
+                        for tool_delta in deltas.tool_calls:
+                            call = add_tool_delta(tool_calls, tool_delta)
+                            if tool_delta.index not in started_tools and call["function"]["arguments"] and parse_arguments(call) is not None:
+                                started_tools[tool_delta.index] = start_tool(call, limits)
+                    elif deltas.content and not tool_calls:
+                        answer_parts.append(deltas.content)
+                        yield deltas.content
+
+        if tool_calls:
+            indexes = sorted(tool_calls)
+            tasks = [started_tools[index] if index in started_tools else start_tool(tool_calls[index], limits) for index in indexes]
+            tool_calls = [tool_calls[index] for index in indexes]
+            messages.append({"role": "assistant", "content": None, "tool_calls": tool_calls})
+            tool_messages, failed_tools = await run_tools(tool_calls, tasks)
+            messages.extend(tool_messages)
+
+            async with limits("openai"):
+                final_response_generator = await llm_client.chat.completions.create(
+                    model=FOLLOW_UP_MODEL,
+                    messages=messages,
+                    temperature=0.7,
+                    stream=True
+                )
+                async with final_response_generator:
+                    async for final_chunk in final_response_generator:
+                        if final_chunk.choices and final_chunk.choices[0].delta.content:
+                            answer_parts.append(final_chunk.choices[0].delta.content)
+                            yield final_chunk.choices[0].delta.content
+
+        if question_vector is not None and cacheable_turn(tool_calls, failed_tools):
+            cache.store(question_vector, ''.join(answer_parts), question)
+    except Exception as err:
+        yield err
+    finally:
+        for task in list(started_tools.values()) + tasks: ### the user went away (or something failed) - stop the skills too
+            if task is not None and not task.done():
+                task.cancel()
+
+
+async def atranscribe(audio_bytes, limits, language='en', model='whisper-1', filename='speech.mp3'):
+    async with limits("openai"):
+        transcription = await get_async_openai_client().audio.transcriptions.create(
+            model=model, file=(filename, audio_bytes), language=language
+        )
+    return transcription.text
+
+
+async def asynthesize(text, limits, model='tts-1', voice='fable', chunk_size=16384):
+    """
+    Text to speech as an async iterator of mp3 chunks, passed on as they arrive rather than after the whole clip.
+    """
+    async with limits("openai"):
+        async with get_async_openai_client().audio.speech.with_streaming_response.create(
+            model=model, voice=voice, input=text, response_format='mp3'
+        ) as response:
+            async for chunk in response.iter_bytes(chunk_size):
+                yield chunk
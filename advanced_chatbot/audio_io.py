@@ -0,0 +1,32 @@
+# In-memory audio for the chat apps - recordings and replies never touch the disk, so sessions can't overwrite each other
+from io import BytesIO
+
+ASR_MODEL = 'whisper-1'
+
+
+def as_buffer(audio_bytes, name='speech.mp3'):
+    """
+    Wrap raw audio in a BytesIO. The name is only there so the API can tell the format from the extension.
+    """
+    buffer = BytesIO(audio_bytes)
+    buffer.name = name
+    return buffer
+
+
+def transcribe(llm_client, audio_bytes, language='en', model=ASR_MODEL):
+    """
+    Whisper transcription of a recording straight from memory.
+    """
+    return llm_client.audio.transcriptions.create(
+        model=model,
+        file=as_buffer(audio_bytes),
+        language=language
+    ).text
+
+
+def synthesize(llm_client, text, model='tts-1', voice='fable'):
+    """
+    Text to speech into a BytesIO that st.audio can play as it is.
+    """
+    response = llm_client.audio.speech.create(model=model, voice=voice, input=text, response_format='mp3')
+    return as_buffer(response.content)
@@ -0,0 +1,112 @@
+# Small caching helpers shared by the skills
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_query(text):
+    """
+    Make trivially different phrasings share a cache entry - case, extra whitespace and trailing punctuation are ignored.
+    """
+    text = re.sub(r'\s+', ' ', text.casefold()).strip()
+    return text.rstrip('?!.,;: ')
+
+
+class LRUCache:
+    """
+    Thread-safe dict with a size bound - the least recently used entry is dropped once it is full.
+    Keeps hit/miss counters so we can see whether the cache is earning its keep.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries also expire `ttl` seconds after they were stored.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            with self._lock:
+                if self._data.get(key) is entry: ## nobody refreshed it in the meantime
+                    del self._data[key]
+                self.hits -= 1 ## an expired entry is really a miss
+                self.misses += 1
+            return default
+        return value
+
+    def put(self, key, value):
+        super().put(key, (time.monotonic() + self.ttl, value))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key - the first caller does the work and everyone
+    else asking for that key meanwhile waits for, and shares, its result (or its exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.shared = 0 ## how many calls piggybacked on someone else's
+
+    def do(self, key, function):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(function())
+        except BaseException as err:
+            future.set_exception(err)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
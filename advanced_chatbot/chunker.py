@@ -0,0 +1,235 @@
+# Streaming text chunker - same chunks as the notebook's LangChain splitter without loading whole files
+#
+# 5-vector_rag.ipynb splits books with
+#     RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=1200, chunk_overlap=120)
+# which needs the whole book in one string and re-encodes the same pieces with tiktoken over and over while merging.
+# This module reproduces that splitter chunk for chunk, but reads files block by block, encodes every piece once
+# (a whole block's pieces in one tiktoken batch call) and can spread many files over a process pool.
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 120
+ENCODING_NAME = "gpt2" ## from_tiktoken_encoder's default, so the token counts match LangChain's
+SEPARATORS = ["\n\n", "\n", " ", ""]
+BLOCK_CHARS = 1 << 20 ## read files a million characters at a time
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name=ENCODING_NAME):
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens(pieces, encoding_name=ENCODING_NAME):
+    """
+    Token count for every piece in one batched call - same arguments as LangChain's length function.
+    """
+    encoded = get_encoding(encoding_name).encode_batch(pieces, allowed_special=set(), disallowed_special="all")
+    return [len(tokens) for tokens in encoded]
+
+
+def split_keep_separator(text, separator):
+    """
+    Split on `separator` and glue each separator onto the start of the piece after it (LangChain's keep_separator=True).
+    """
+    if not separator:
+        return list(text)
+    parts = re.split(f"({re.escape(separator)})", text)
+    pieces = [parts[0]] + [parts[i] + parts[i + 1] for i in range(1, len(parts), 2)]
+    return [piece for piece in pieces if piece]
+
+
+class _Merger:
+    """
+    Greedy merge of small pieces into chunks with overlap, fed one piece at a time.
+
+    Same rules as TextSplitter._merge_splits with the empty separator the recursive splitter uses,
+    but every piece carries its token count so nothing is encoded twice.
+    """
+
+    def __init__(self, chunk_size, chunk_overlap):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.current = []
+        self.lengths = []
+        self.total = 0
+
+    def _join(self):
+        text = "".join(self.current).strip()
+        return text or None
+
+    def add(self, piece, length):
+        """
+        Add a piece and return the chunk it completed, if any.
+        """
+        chunk = None
+        if self.total + length > self.chunk_size:
+            if self.current:
+                chunk = self._join()
+                ### Drop pieces from the front until only the overlap is left (or the new piece fits)
+                while self.total > self.chunk_overlap or (self.total + length > self.chunk_size and self.total > 0):
+                    self.total -= self.lengths.pop(0)
+                    self.current.pop(0)
+        self.current.append(piece)
+        self.lengths.append(length)
+        self.total += length
+        return chunk
+
+    def flush(self):
+        chunk = self._join() if self.current else None
+        self.current, self.lengths, self.total = [], [], 0
+        return chunk
+
+
+def _split_pieces(pieces, lengths, separators, merger, chunk_size, chunk_overlap, encoding_name):
+    """
+    The body of RecursiveCharacterTextSplitter._split_text for pieces that were already split and counted.
+    """
+    for piece, length in zip(pieces, lengths):
+        if length < chunk_size:
+            chunk = merger.add(piece, length)
+            if chunk:
+                yield chunk
+            continue
+        ### Too big - close the current run of small pieces, then split this one with the next separator down
+        chunk = merger.flush()
+        if chunk:
+            yield chunk
+        if not separators:
+            yield piece
+        else:
+            yield from split_text(piece, separators, chunk_size, chunk_overlap, encoding_name)
+
+
+def split_text(text, separators=SEPARATORS, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+               encoding_name=ENCODING_NAME):
+    """
+    Split a string held in memory. Yields exactly what the LangChain splitter would return.
+    """
+    separator, remaining = separators[-1], []
+    for i, candidate in enumerate(separators):
+        if not candidate:
+            separator = candidate
+            break
+        if candidate in text:
+            separator, remaining = candidate, separators[i + 1:]
+            break
+    pieces = split_keep_separator(text, separator)
+    merger = _Merger(chunk_size, chunk_overlap)
+    yield from _split_pieces(pieces, count_tokens(pieces, encoding_name), remaining, merger,
+                             chunk_size, chunk_overlap, encoding_name)
+    chunk = merger.flush()
+    if chunk:
+        yield chunk
+
+
+def iter_chunks(file, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, encoding_name=ENCODING_NAME,
+                block_chars=BLOCK_CHARS):
+    """
+    Stream chunks out of an open text file.
+
+    Paragraphs ("\\n\\n") are the top-level separator whenever the file contains one, so the file is read in blocks,
+    cut at the last paragraph break seen so far, and each block's paragraphs are counted and merged on the fly.
+    The unfinished paragraph at the end of a block is carried into the next one. A file with no blank line at
+    all has to be split as a whole, exactly as LangChain would.
+    """
+    top, remaining = SEPARATORS[0], SEPARATORS[1:]
+    merger = _Merger(chunk_size, chunk_overlap)
+    carry = ""
+    seen_separator = False
+    while True:
+        block = file.read(block_chars)
+        if not block:
+            break
+        buffer = carry + block
+        if not seen_separator:
+            if top not in buffer:
+                carry = buffer ## can't pick the top-level separator yet
+                continue
+            seen_separator = True
+        pieces = split_keep_separator(buffer, top)
+        ### The last piece may continue in the next block - keep it back
+        carry = pieces.pop() if pieces else ""
+        if pieces:
+            yield from _split_pieces(pieces, count_tokens(pieces, encoding_name), remaining, merger,
+                                     chunk_size, chunk_overlap, encoding_name)
+
+    if not seen_separator:
+        yield from split_text(carry, SEPARATORS, chunk_size, chunk_overlap, encoding_name)
+        return
+    if carry:
+        yield from _split_pieces([carry], count_tokens([carry], encoding_name), remaining, merger,
+                                 chunk_size, chunk_overlap, encoding_name)
+    chunk = merger.flush()
+    if chunk:
+        yield chunk
+
+
+def iter_file_chunks(path, **options):
+    with open(path, 'r', encoding='UTF-8') as file:
+        yield from iter_chunks(file, **options)
+
+
+def _spool_file_chunks(path, spool):
+    """
+    Worker side of chunk_files: write the file's chunks to `spool` one JSON line each as they come, instead of
+    building a list the size of the book and pickling it back to the parent.
+    """
+    with open(spool, 'w', encoding='UTF-8') as file:
+        for chunk in iter_file_chunks(path):
+            file.write(json.dumps(chunk) + '\n')
+    return spool
+
+
+def _read_spool(spool):
+    try:
+        with open(spool, 'r', encoding='UTF-8') as file:
+            for line in file:
+                yield json.loads(line)
+    finally:
+        os.remove(spool)
+
+
+def chunk_files(paths, max_workers=None):
+    """
+    Chunk several files in parallel, one file per worker process. Yields (path, chunks) in the order given, where
+    chunks is an iterator - read each file's chunks before moving on to the next one.
+    """
+    paths = list(paths)
+    if len(paths) <= 1 or max_workers == 1:
+        for path in paths:
+            yield path, iter_file_chunks(path)
+        return
+    with tempfile.TemporaryDirectory(prefix='chunks-') as spool_dir, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        spools = [os.path.join(spool_dir, f'{n}.jsonl') for n in range(len(paths))]
+        for path, spool in zip(paths, executor.map(_spool_file_chunks, paths, spools)):
+            yield path, _read_spool(spool)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Chunk text files the same way 5-vector_rag.ipynb does')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--workers', type=int, default=None, help='processes to use (default: one per core)')
+    parser.add_argument('--jsonl', action='store_true', help='print every chunk as a JSON line')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    total = 0
+    for path, chunks in chunk_files(args.paths, max_workers=args.workers):
+        for chunk in chunks:
+            total += 1
+            if args.jsonl:
+                print(json.dumps({"source": path, "text": chunk}))
+    print(f'{total} chunks from {len(args.paths)} files in {time.perf_counter() - start:.2f}s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Shared API clients - built once per process on first use, not on every import or Streamlit rerun
+#
+# Streamlit runs the app script from the top on every click, so a client created in the script is a new client
+# (and a new connection pool, with a fresh TLS handshake) each time. These functions hand out the same client to
+# the apps and to every skill, and only import the SDK behind them when it is first needed.
+import os
+import threading
+from functools import lru_cache
+from dotenv import load_dotenv
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+### Connections kept open to each API - enough for the skills, TTS sentences and users running at the same time
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '32'))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_KEEPALIVE_CONNECTIONS', '16'))
+
+_lock = threading.Lock()
+
+
+def _once(function):
+    """
+    lru_cache plus a lock, so two sessions starting at the same moment still end up sharing one client.
+    """
+    cached = lru_cache(maxsize=None)(function)
+
+    def wrapper():
+        with _lock:
+            return cached()
+    wrapper.cache_clear = cached.cache_clear
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+
+@_once
+def get_openai_client():
+    """
+    The OpenAI client for the whole process, with a pooled keep-alive HTTP connection.
+    OPENAI_BASE_URL is picked up by the SDK itself (the benchmarks point it at the local stub).
+    """
+    from openai import DefaultHttpxClient, OpenAI
+    import httpx
+    return OpenAI(
+        api_key=os.getenv('OPENAI_KEY'),
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS)
+        ),
+    )
+
+
+@_once
+def get_async_openai_client():
+    """
+    The AsyncOpenAI client for the async server. Like every httpx async client it belongs to one event loop,
+    which is fine there - each worker process runs a single loop.
+    """
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    import httpx
+    return AsyncOpenAI(
+        api_key=os.getenv('OPENAI_KEY'),
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS)
+        ),
+    )
+
+
+@_once
+def get_qdrant_client():
+    """
+    The Qdrant client for the "books" collection - qdrant_client is only imported when the Qdrant backend is used.
+    """
+    from qdrant_client import QdrantClient
+    return QdrantClient(
+        url=os.getenv('VECTORDB_ENDPOINT'),
+        api_key=os.getenv('VECTORDB_KEY'),
+    )
@@ -0,0 +1,101 @@
+# Two-tier cache for query embeddings - memory first, then a SQLite file that survives Streamlit restarts
+import os
+import sqlite3
+import threading
+import numpy as np
+from .cache_utils import LRUCache, normalize_query
+
+
+class EmbeddingCache:
+    """
+    Embedding cache keyed on (model, normalised text).
+
+    Lookups try the in-memory LRU first, then the SQLite store, and only then call the embeddings API.
+    Vectors are kept on disk as raw float32 bytes. Pass path=None for a memory-only cache.
+    The SQLite file is opened on first use, in the process that uses it - the API server forks its workers after import.
+    """
+
+    def __init__(self, path=None, maxsize=2048):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.path = path
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    @property
+    def _db(self):
+        if not self.path:
+            return None
+        if self._connection is None or self._pid != os.getpid():
+            with self._lock:
+                if self._connection is None or self._pid != os.getpid():
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    ### Streamlit runs every session on its own thread, so share one connection behind a lock
+                    connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                    connection.execute(
+                        'CREATE TABLE IF NOT EXISTS embeddings (model TEXT, query TEXT, vector BLOB, PRIMARY KEY (model, query))'
+                    )
+                    connection.commit()
+                    self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def get(self, model, text):
+        key = (model, normalize_query(text))
+        vector = self.memory.get(key)
+        if vector is not None:
+            return vector
+        db = self._db
+        if db is not None:
+            with self._lock:
+                row = db.execute(
+                    'SELECT vector FROM embeddings WHERE model = ? AND query = ?', key
+                ).fetchone()
+            if row:
+                self.disk_hits += 1
+                vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                self.memory.put(key, vector) ## promote it so the next lookup stays in memory
+                return vector
+        self.misses += 1
+        return None
+
+    def put(self, model, text, vector):
+        key = (model, normalize_query(text))
+        self.memory.put(key, vector)
+        db = self._db
+        if db is not None:
+            with self._lock:
+                db.execute(
+                    'INSERT OR REPLACE INTO embeddings (model, query, vector) VALUES (?, ?, ?)',
+                    (*key, np.asarray(vector, dtype=np.float32).tobytes())
+                )
+                db.commit()
+
+    def embed(self, llm_client, text, model="text-embedding-ada-002"):
+        """
+        Return the embedding for `text`, only calling the API when neither tier has it.
+        """
+        vector = self.get(model, text)
+        if vector is None:
+            vector = llm_client.embeddings.create(input=text, model=model).data[0].embedding
+            self.put(model, text, vector)
+        return vector
+
+    async def aembed(self, llm_client, text, model="text-embedding-ada-002"):
+        """
+        embed() for an AsyncOpenAI client.
+        """
+        vector = self.get(model, text)
+        if vector is None:
+            vector = (await llm_client.embeddings.create(input=text, model=model)).data[0].embedding
+            self.put(model, text, vector)
+        return vector
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_size": len(self.memory),
+        }
@@ -0,0 +1,131 @@
+# Binary, memory-mapped embedding store - replaces re-parsing documents_embeddings.csv
+import argparse
+import csv
+import json
+import mmap
+import os
+import sys
+import time
+import numpy as np
+
+VECTORS_FILE = 'vectors.npy' ## (chunks x dimensions) matrix, rows already normalised to unit length
+OFFSETS_FILE = 'offsets.npy' ## chunks + 1 byte offsets into texts.bin
+TEXTS_FILE = 'texts.bin' ## every chunk's text, utf-8, back to back
+META_FILE = 'meta.json'
+
+
+class _Payloads:
+    """
+    Read-only list of {"text": ...} payloads that only decodes a chunk's text when it is asked for.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, i):
+        return {"text": self._store.text(i)}
+
+
+class EmbeddingStore:
+    """
+    Opens a store written by convert_csv() without reading it into memory.
+
+    The vectors and offsets are np.load(mmap_mode='r') views and the texts are an mmap of texts.bin, so
+    opening is constant time and pages are only pulled in by the OS as searches touch them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as file:
+            self.meta = json.load(file)
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode='r')
+        self._texts_file = open(os.path.join(path, TEXTS_FILE), 'rb')
+        size = os.fstat(self._texts_file.fileno()).st_size
+        ### mmap can't map an empty file, so an empty store just gets an empty bytes object
+        self._texts = mmap.mmap(self._texts_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.payloads = _Payloads(self)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def text(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self._texts[start:end].decode('utf-8')
+
+    def close(self):
+        if isinstance(self._texts, mmap.mmap):
+            self._texts.close()
+        self._texts_file.close()
+
+
+def open_store(path):
+    return EmbeddingStore(path)
+
+
+def _count_rows(csv_path):
+    with open(csv_path, 'r', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        first = next(reader, None)
+        if first is None:
+            return 0, 0
+        dimensions = len(json.loads(first['embedding']))
+        return 1 + sum(1 for _ in reader), dimensions
+
+
+def convert_csv(csv_path, out_dir, dtype='float32'):
+    """
+    One-shot conversion of a text/embedding CSV (see 5-vector_rag.ipynb) into a binary store.
+
+    Rows are streamed straight into memory-mapped output files, so memory use stays flat however big the CSV is.
+    Returns the number of chunks written.
+    """
+    if dtype not in ('float32', 'float16'):
+        raise ValueError("dtype must be 'float32' or 'float16'")
+    os.makedirs(out_dir, exist_ok=True)
+
+    ### First pass only counts the rows so the output matrix can be allocated on disk up front
+    count, dimensions = _count_rows(csv_path)
+    vectors = np.lib.format.open_memmap(os.path.join(out_dir, VECTORS_FILE), mode='w+',
+                                        dtype=dtype, shape=(count, dimensions))
+    offsets = np.lib.format.open_memmap(os.path.join(out_dir, OFFSETS_FILE), mode='w+',
+                                        dtype=np.int64, shape=(count + 1,))
+    offsets[0] = 0
+    position = 0
+    with open(csv_path, 'r', encoding='utf-8') as file, open(os.path.join(out_dir, TEXTS_FILE), 'wb') as texts:
+        for i, row in enumerate(csv.DictReader(file)):
+            vector = np.asarray(json.loads(row['embedding']), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vectors[i] = vector / norm if norm else vector
+            encoded = row['text'].encode('utf-8')
+            texts.write(encoded)
+            position += len(encoded)
+            offsets[i + 1] = position
+    vectors.flush()
+    offsets.flush()
+    del vectors, offsets
+
+    with open(os.path.join(out_dir, META_FILE), 'w', encoding='utf-8') as file:
+        json.dump({'count': count, 'dimensions': dimensions, 'dtype': dtype, 'normalized': True,
+                   'source': os.path.basename(csv_path)}, file)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert documents_embeddings.csv into a memory-mapped store')
+    parser.add_argument('csv_path', help='CSV with text and embedding columns')
+    parser.add_argument('out_dir', help='directory to write the store to')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32',
+                        help='float16 halves the size on disk at a tiny cost in precision')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = convert_csv(args.csv_path, args.out_dir, dtype=args.dtype)
+    print(f'Wrote {count} chunks to {args.out_dir} in {time.perf_counter() - start:.2f}s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+# Batched, concurrent and resumable embedding ingestion into the "books" collection
+#
+#   python -m advanced_chatbot.ingest --documents ./documents.csv
+#
+# This replaces the one-chunk-per-request loop in 5-vector_rag.ipynb: several chunks go in each embeddings request,
+# a few requests run at once under a requests/tokens per minute budget, and points are upserted in fixed-size batches
+# as soon as they are ready. Every upserted batch is written to a checkpoint file so a crashed run picks up where it stopped.
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+import tiktoken
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIMENSIONS = 1536
+MAX_INPUT_TOKENS = 8000 ## the maximum for text-embedding-ada-002 is 8191 per input
+CHUNK_NAMESPACE = uuid.UUID('6f1c2a52-3a43-4d0e-9b8e-5b0c1f2d7a10') ## fixed namespace for the uuid5 chunk ids
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `per_minute` units per minute.
+    Used twice - once counting requests and once counting tokens - to stay under the API rate limits.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity) ## a single oversized batch must still be able to go through
+        async with self._lock: ## waiting callers queue up in order
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class Checkpoint:
+    """
+    Append-only record of the chunk ids that have already been upserted - one JSON list per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        done = set()
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        done.update(json.loads(line))
+                    except json.JSONDecodeError: ## a half-written last line from a crash
+                        continue
+        return done
+
+    def mark(self, ids):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(list(ids)) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def reset(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class QdrantSink:
+    """
+    Writes points to a Qdrant collection. `location` can be a URL or ":memory:" for a throwaway local instance.
+    """
+
+    def __init__(self, location, api_key=None, collection_name="books", dimensions=EMBEDDING_DIMENSIONS):
+        from qdrant_client import QdrantClient
+        if location == ':memory:':
+            self.client = QdrantClient(location=':memory:')
+        else:
+            self.client = QdrantClient(url=location, api_key=api_key)
+        self.collection_name = collection_name
+        self.dimensions = dimensions
+
+    def ensure_collection(self, recreate=False):
+        from qdrant_client.http import models
+        from .quantize import qdrant_quantization_config
+        vectors_config = models.VectorParams(size=self.dimensions, distance=models.Distance.COSINE)
+        if recreate and self.client.collection_exists(self.collection_name):
+            self.client.delete_collection(self.collection_name)
+        if not self.client.collection_exists(self.collection_name):
+            self.client.create_collection(
+                collection_name=self.collection_name, vectors_config=vectors_config,
+                quantization_config=qdrant_quantization_config() ## None unless KB_QUANTIZATION is set
+            )
+
+    def count(self):
+        return self.client.count(self.collection_name).count
+
+    def delete(self, ids):
+        from qdrant_client.http import models
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.PointIdsList(points=list(ids)),
+            wait=True
+        )
+
+    def upsert(self, points):
+        from qdrant_client.http.models import PointStruct
+        self.client.upsert(
+            collection_name=self.collection_name,
+            wait=True,
+            points=[PointStruct(id=point_id, vector=vector, payload=payload) for point_id, vector, payload in points]
+        )
+
+
+def chunk_id(source, text, occurrence=0):
+    """
+    Stable point id for a chunk - the same text from the same source always maps to the same UUID,
+    so re-running an import overwrites points instead of piling up duplicates under new counter ids.
+    `occurrence` tells apart identical chunks repeated within one source.
+    """
+    content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{source}:{content_hash}:{occurrence}"))
+
+
+def load_documents(path):
+    """
+    Read documents.csv (source,text) the same way the notebook does and return (id, text) pairs.
+    """
+    documents = []
+    seen = Counter()
+    with open(path, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            if row["source"] and row["text"]: # Checking if both fields are not empty
+                source = row["source"].strip()
+                combined = "Source: " + source + "; Text: " + row["text"].strip()
+                documents.append((chunk_id(source, combined, seen[combined]), combined))
+                seen[combined] += 1
+    return documents
+
+
+def make_batches(documents, batch_size, max_batch_tokens, encoding):
+    """
+    Group documents into embedding requests of at most `batch_size` inputs and `max_batch_tokens` tokens.
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for point_id, text, payload in documents:
+        tokens = encoding.encode(text)
+        if len(tokens) > MAX_INPUT_TOKENS:
+            text = encoding.decode(tokens[:MAX_INPUT_TOKENS])
+        count = min(len(tokens), MAX_INPUT_TOKENS)
+        if current and (len(current) >= batch_size or current_tokens + count > max_batch_tokens):
+            batches.append((current, current_tokens))
+            current, current_tokens = [], 0
+        current.append((point_id, text, payload))
+        current_tokens += count
+    if current:
+        batches.append((current, current_tokens))
+    return batches
+
+
+async def ingest(documents, sink, llm_client, checkpoint, model=EMBEDDING_MODEL, batch_size=64,
+                 max_batch_tokens=100000, upsert_batch_size=256, concurrency=4,
+                 requests_per_minute=3000, tokens_per_minute=1000000):
+    """
+    Embed and upsert every document that isn't in the checkpoint yet. Returns a small stats dict.
+    Documents are (id, text) pairs, or (id, text, payload) when the point should carry more than {"text": text}.
+    """
+    start = time.perf_counter()
+    done = checkpoint.load()
+    pending = [
+        (document[0], document[1], document[2] if len(document) > 2 else {"text": document[1]})
+        for document in documents if document[0] not in done
+    ]
+    encoding = tiktoken.get_encoding("cl100k_base")
+    batches = make_batches(pending, batch_size, max_batch_tokens, encoding)
+
+    request_bucket = TokenBucket(requests_per_minute)
+    token_bucket = TokenBucket(tokens_per_minute)
+    work = asyncio.Queue()
+    for batch in batches:
+        work.put_nowait(batch)
+    results = asyncio.Queue(maxsize=concurrency * 2) ## back-pressure - embedding pauses if the upserts fall behind
+    stats = {"skipped": len(documents) - len(pending), "embedded": 0, "requests": 0, "upserts": 0}
+
+    async def embed_worker():
+        while True:
+            try:
+                batch, tokens = work.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await request_bucket.acquire(1)
+            await token_bucket.acquire(tokens)
+            response = await llm_client.embeddings.create(input=[text for _, text, _ in batch], model=model)
+            stats["requests"] += 1
+            vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            await results.put([(point_id, vector, payload) for (point_id, _, payload), vector in zip(batch, vectors)])
+
+    async def writer():
+        buffer = []
+
+        async def flush():
+            points = buffer[:upsert_batch_size]
+            del buffer[:upsert_batch_size]
+            await asyncio.to_thread(sink.upsert, points) ## qdrant_client is blocking, keep it off the event loop
+            checkpoint.mark(point_id for point_id, _, _ in points)
+            stats["upserts"] += 1
+            stats["embedded"] += len(points)
+
+        while True:
+            points = await results.get()
+            if points is None:
+                break
+            buffer.extend(points)
+            while len(buffer) >= upsert_batch_size:
+                await flush()
+        while buffer:
+            await flush()
+
+    async def embed_all():
+        await asyncio.gather(*(embed_worker() for _ in range(max(1, concurrency))))
+        await results.put(None)
+
+    ### Wait on both sides together - if the writer dies the workers would otherwise block on the full queue forever
+    tasks = [asyncio.create_task(embed_all()), asyncio.create_task(writer())]
+    try:
+        finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in finished:
+            task.result() ## re-raises the first failure
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = round(elapsed, 3)
+    stats["chunks_per_second"] = round(stats["embedded"] / elapsed, 2) if elapsed else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Embed documents.csv and upsert it into the vector database')
+    parser.add_argument('--documents', default='./documents.csv', help='CSV with source and text columns')
+    parser.add_argument('--collection', default='books')
+    parser.add_argument('--qdrant-url', default=os.getenv('VECTORDB_ENDPOINT'), help='Qdrant URL, or :memory:')
+    parser.add_argument('--checkpoint', default='./.cache/ingest_checkpoint.jsonl')
+    parser.add_argument('--recreate', action='store_true', help='drop the collection and the checkpoint first')
+    parser.add_argument('--model', default=EMBEDDING_MODEL)
+    parser.add_argument('--base-url', default=None, help='OpenAI compatible endpoint, e.g. the local stub')
+    parser.add_argument('--batch-size', type=int, default=64, help='chunks per embeddings request')
+    parser.add_argument('--upsert-batch-size', type=int, default=256, help='points per upsert')
+    parser.add_argument('--concurrency', type=int, default=4, help='embedding requests in flight')
+    parser.add_argument('--rpm', type=int, default=3000, help='requests per minute limit')
+    parser.add_argument('--tpm', type=int, default=1000000, help='tokens per minute limit')
+    args = parser.parse_args(argv)
+
+    if not args.qdrant_url:
+        parser.error('set VECTORDB_ENDPOINT in .env or pass --qdrant-url')
+
+    sink = QdrantSink(args.qdrant_url, api_key=os.getenv('VECTORDB_KEY'), collection_name=args.collection)
+    sink.ensure_collection(recreate=args.recreate)
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.recreate:
+        checkpoint.reset()
+    llm_client = AsyncOpenAI(api_key=os.getenv('OPENAI_KEY'), base_url=args.base_url)
+
+    stats = asyncio.run(ingest(
+        load_documents(args.documents), sink, llm_client, checkpoint, model=args.model,
+        batch_size=args.batch_size, upsert_batch_size=args.upsert_batch_size, concurrency=args.concurrency,
+        requests_per_minute=args.rpm, tokens_per_minute=args.tpm
+    ))
+    print(json.dumps(stats), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
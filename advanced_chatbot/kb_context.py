@@ -0,0 +1,94 @@
+# Turns knowledge base hits into a compact context block for the search_kb prompt
+import os
+from .memory import get_encoding
+
+### Token budget for the knowledge base snippets in one prompt
+KB_CONTEXT_TOKENS = int(os.getenv('KB_CONTEXT_TOKENS', '3000'))
+MIN_OVERLAP = 40 ## characters two chunks must share before we treat them as overlapping
+PROBE_CHARS = 64
+
+
+def hit_text_and_source(hit):
+    """
+    The chunk text and its source from a Qdrant ScoredPoint or a NumpyIndex ScoredHit.
+    Older payloads only carry "Source: name; Text: chunk", so the source is read back out of the text.
+    """
+    payload = hit.payload or {}
+    text = payload.get("text", "")
+    source = payload.get("source")
+    if text.startswith("Source: ") and "; Text: " in text:
+        prefix, text = text.split("; Text: ", 1)
+        source = source or prefix[len("Source: "):]
+    return text.strip(), source or "unknown"
+
+
+def merge_overlap(first, second):
+    """
+    Join two chunks when the end of `first` is the start of `second` (the chunker's overlap) or one contains the other.
+    Returns None when they don't overlap.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    probe = second[:min(PROBE_CHARS, len(second))]
+    position = first.find(probe, max(0, len(first) - len(second)))
+    while position != -1:
+        if len(first) - position >= MIN_OVERLAP and second.startswith(first[position:]):
+            return first + second[len(first) - position:]
+        position = first.find(probe, position + 1)
+    return None
+
+
+def merge_hits(hits):
+    """
+    Group the hits by source and merge overlapping chunks.
+    Returns [(source, text, best score)] ordered best first.
+    """
+    passages = [] ## [source, text, score, rank of the best hit]
+    for rank, hit in enumerate(hits):
+        text, source = hit_text_and_source(hit)
+        if text:
+            passages.append([source, text, hit.score, rank])
+
+    merged = True
+    while merged: ### keep going until no pair joins - a middle chunk can bridge two others
+        merged = False
+        for i in range(len(passages)):
+            for j in range(len(passages)):
+                if i == j or passages[i][0] != passages[j][0]:
+                    continue
+                text = merge_overlap(passages[i][1], passages[j][1])
+                if text is not None:
+                    passages[i][1] = text
+                    passages[i][2] = max(passages[i][2], passages[j][2])
+                    passages[i][3] = min(passages[i][3], passages[j][3])
+                    del passages[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    passages.sort(key=lambda passage: passage[3])
+    return [(source, text, score) for source, text, score, _ in passages]
+
+
+def build_context(hits, max_tokens=None):
+    """
+    The best hits as plain "[n] Source: ..." blocks, with overlapping chunks merged and the whole thing packed
+    into max_tokens. Passages that don't fit are skipped, except the best one, which is cut short instead.
+    """
+    max_tokens = KB_CONTEXT_TOKENS if max_tokens is None else max_tokens
+    encoding = get_encoding()
+    blocks = []
+    used = 0
+    for source, text, _ in merge_hits(hits):
+        block = f"[{len(blocks) + 1}] Source: {source}\n{text}"
+        tokens = encoding.encode(block)
+        if used + len(tokens) > max_tokens:
+            if not blocks:
+                blocks.append(encoding.decode(tokens[:max_tokens]))
+                used = max_tokens
+            continue ## a smaller passage further down may still fit
+        blocks.append(block)
+        used += len(tokens) + 2 ## the blank line between blocks
+    return "\n\n".join(blocks)
@@ -1,95 +1,348 @@
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as ToolTimeout
 import json
 import os
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+from .clients import get_openai_client
 from .search_internet import search_internet
-from .search_kb import search_kb
+from .search_kb import search_kb, query_cache
+from .answer_cache import ANSWER_CACHE, SemanticAnswerCache, replay
+from .cache_utils import normalize_query
+from .memory import SUMMARY_PREFIX
+from . import tracing
 from dotenv import load_dotenv
 # Load dotenv for picking up creds from .env
 load_dotenv()
-llm_client = OpenAI(
-        api_key =  os.getenv('OPENAI_KEY')
-)
-        
-def chat_llm(aimodel, incoming_messages):
+### Link function_name values with the actual functions
+available_functions = {
+        "search_internet": search_internet,
+        "search_kb": search_kb
+}
+### How long each skill may take before we give up on it and let the LLM answer without it (seconds)
+TOOL_TIMEOUTS = {
+        "search_internet": 15,
+        "search_kb": 10
+}
+DEFAULT_TOOL_TIMEOUT = 15
+### The model that writes the answer once the tools are done - whichever model the user picked, the history has to fit it too
+FOLLOW_UP_MODEL = 'gpt-3.5-turbo'
+### Tool calls that failed or timed out in this process, by tool name - the model still answers, so this is the only trace of them
+tool_failures = Counter()
+_tool_failures_lock = threading.Lock()
+
+def record_tool_failure(name):
+        with _tool_failures_lock:
+                tool_failures[name] += 1
+
+SKILLS_FILE = os.path.join(os.path.dirname(__file__), 'skills.json')
+
+@lru_cache(maxsize=None)
+def get_tools():
+        """
+        The skills offered to the model, read from skills.json once per process rather than on every turn.
+        """
+        with open(SKILLS_FILE, 'r', encoding='utf-8') as file:
+                skills = json.load(file)
+        return tuple({"type": "function", "function": skill} for skill in skills if skill["name"] in available_functions)
+
+### Shared worker pool so every tool requested in one turn runs at the same time - shared by every session in the process,
+### so it is sized for a few tools each from many sessions at once (the tools mostly wait on the network)
+TOOL_WORKERS = int(os.getenv('TOOL_WORKERS', '32'))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="skill")
+
+### Speculative mode - start the knowledge base search for the user's message as soon as the turn begins
+SPECULATIVE_KB = os.getenv('SPECULATIVE_KB', 'false').lower() in ('1', 'true', 'yes')
+### How alike (cosine of the query embeddings) the model's search_kb query and the user's message must be to reuse that search
+SPECULATIVE_KB_SIMILARITY = float(os.getenv('SPECULATIVE_KB_SIMILARITY', '0.85'))
+### How the speculative searches worked out in this process: reused, missed (search_kb asked for something else), unused
+speculative_kb_stats = Counter()
+
+### Answers to earlier questions, shared by every session in this process - only used with ANSWER_CACHE (or answer_cache=)
+### The question is embedded with the knowledge base's model and embedding cache, so a search_kb for the same text costs nothing extra
+shared_answer_cache = SemanticAnswerCache(embed=lambda text: query_cache.embed(get_openai_client(), text, model="text-embedding-ada-002"))
+
+def parse_arguments(call):
+        """
+        The tool call's arguments as a dict, or None while they are incomplete (or if the model sent broken JSON).
+        """
+        try:
+                function_args = json.loads(call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError:
+                return None
+        return function_args if isinstance(function_args, dict) else None
+
+def add_tool_delta(tool_calls, tool_delta):
+        """
+        Tool calls come in pieces, keyed by their index - fold one piece into `tool_calls` and return the call it belongs to.
+        """
+        call = tool_calls.setdefault(tool_delta.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        if tool_delta.id: ### the first delta of every call has its id and name
+                call["id"] = tool_delta.id
+        if tool_delta.function and tool_delta.function.name:
+                call["function"]["name"] = tool_delta.function.name ## save it
+        if tool_delta.function and tool_delta.function.arguments: ### the arguments arrive a few characters at a time
+                call["function"]["arguments"] += tool_delta.function.arguments ## save the arguments
+        return call
+
+def traced_tool(span, function_to_call, **function_args):
+        """
+        Run a tool inside its tracing span - only used while tracing is on.
+        """
+        try:
+                result = function_to_call(**function_args)
+        except Exception as err:
+                span.status = 'ERROR'
+                span.end(error=repr(err))
+                raise
+        span.end(result_chars=len(result["content"]))
+        return result
+
+def started_tool(started, function_to_call, *args, **kwargs):
+        started.append(time.monotonic()) ## the timeout counts from here, not from the time spent queued for a worker
+        return function_to_call(*args, **kwargs)
+
+def submit_tool(name, function_to_call, function_args, **span_attributes):
+        started = []
+        if not tracing.enabled():
+                future = tool_executor.submit(started_tool, started, function_to_call, **function_args)
+        else:
+                span = tracing.start_span(f"tool.{name}", tool=name, argument_bytes=len(json.dumps(function_args)), **span_attributes)
+                future = tool_executor.submit(started_tool, started, traced_tool, span, function_to_call, **function_args)
+        future.started = started
+        return future
+
+def tool_result(future, timeout):
+        """
+        Wait for a submitted tool, giving it `timeout` seconds from when a worker actually picked it up.
+        A tool still queued after `timeout` seconds (every worker busy) is cancelled rather than left waiting for ever.
+        """
+        queued = time.monotonic()
+        while not future.started:
+                try:
+                        return future.result(timeout=0.05)
+                except ToolTimeout:
+                        if time.monotonic() - queued > timeout and future.cancel():
+                                raise
+        return future.result(timeout=max(0, future.started[0] + timeout - time.monotonic()))
+
+def start_tool(call):
+        """
+        Submit one tool call to the worker pool. Returns None if the tool doesn't exist or the arguments are broken.
+        """
+        function_to_call = available_functions.get(call["function"]["name"])
+        function_args = parse_arguments(call)
+        if function_to_call is None or function_args is None:
+                return None
+        return submit_tool(call["function"]["name"], function_to_call, function_args)
+
+def same_question(asked, query, threshold=None):
+        """
+        Whether the model's search_kb query asks what the user asked - models usually rephrase, so beyond an exact match
+        the two embeddings are compared. Both come through query_cache: the user's was made by the speculative search,
+        and the query's is the one search_kb would need anyway if the guess turns out wrong.
+        """
+        if normalize_query(asked) == normalize_query(query):
+                return True
+        threshold = SPECULATIVE_KB_SIMILARITY if threshold is None else threshold
+        try:
+                llm_client = get_openai_client()
+                asked_vector = np.asarray(query_cache.embed(llm_client, asked, model="text-embedding-ada-002"), dtype=np.float32)
+                query_vector = np.asarray(query_cache.embed(llm_client, query, model="text-embedding-ada-002"), dtype=np.float32)
+        except Exception:
+                return False
+        norms = np.linalg.norm(asked_vector) * np.linalg.norm(query_vector)
+        return bool(norms) and float(asked_vector @ query_vector) / norms >= threshold
+
+def latest_user_text(messages):
+        for message in reversed(messages):
+                if message["role"] == "user":
+                        return message["content"] if isinstance(message["content"], str) else None
+        return None
+
+def opening_question(messages):
+        """
+        The user's text if it opens the conversation - nothing before it but system prompts - otherwise None.
+        Only those questions mean the same thing in every session, so they are the only ones the answer cache shares:
+        a follow-up like "tell me more about her" depends on the turns before it.
+        """
+        if not messages or messages[-1]["role"] != "user":
+                return None
+        for message in messages[:-1]:
+                if message["role"] != "system" or str(message.get("content") or "").startswith(SUMMARY_PREFIX):
+                        return None
+        return latest_user_text(messages)
+
+def run_tools(tool_calls, futures=None):
+        """
+        Run every tool the model asked for concurrently and return one "tool" message per call, in the same order,
+        plus the names of the tools that failed.
+
+        The turn costs as long as the slowest tool rather than the sum of all of them. A tool that errors or runs
+        past its timeout still gets a message back so the model can tell the user it didn't work.
+        `futures` can hold tools that were already started while the response was streaming.
+        """
+        if futures is None:
+                futures = [start_tool(call) for call in tool_calls]
+
+        tool_messages = []
+        failed = []
+        for call, future in zip(tool_calls, futures):
+                name = call["function"]["name"]
+                if future is None: ### Sometimes OpenAI makes up a function name or sends broken arguments
+                        content = f"The tool {name} is not available."
+                        failed.append(name)
+                else:
+                        timeout = TOOL_TIMEOUTS.get(name, DEFAULT_TOOL_TIMEOUT)
+                        try:
+                                content = tool_result(future, timeout)["content"]
+                        except ToolTimeout: ### a running thread can't be stopped - it finishes in the background and frees its worker then
+                                content = f"The tool {name} timed out. Please try again."
+                                failed.append(name)
+                        except Exception as err:
+                                content = f"The tool {name} failed: {err}"
+                                failed.append(name)
+                tool_messages.append({"role": "tool", "tool_call_id": call["id"], "content": content})
+        for name in failed:
+                record_tool_failure(name)
+        return tool_messages, failed
+
+def cacheable_turn(tool_calls, failed):
+        """
+        Whether a turn's answer may go into the answer cache, which is shared by every session and only keyed on the
+        latest message. Only answers built from the knowledge base qualify: a plain reply can depend on this conversation's
+        history ("what did I just tell you?"), search_internet goes stale, and a failed tool leaves a "please try again".
+        """
+        return bool(tool_calls) and not failed and all(call["function"]["name"] == "search_kb" for call in tool_calls)
+
+def chat_llm(aimodel, incoming_messages, speculative=None, answer_cache=None):
         """
         Interacts with the OpenAI API to process user messages and provide chatbot responses.
 
-        Since we're streaming the response with function calling, the code for this function is a bigger than the basic chatbot's one liner
-        because we have to gather enough tokens to know when a function is needed and then act upon it.
+        Since we're streaming the response with tool calling, the code for this function is a bigger than the basic chatbot's one liner
+        because we have to gather the tool call deltas until the model has finished asking for tools, run them and then act upon them.
+        The model can ask for several tools in one turn (e.g. search_internet and search_kb) - they all run at once and
+        their results go back to the model in a single follow-up request.
+
+        Each tool starts as soon as its arguments are complete, while the rest of the response is still streaming.
+        With speculative=True (or SPECULATIVE_KB in .env) search_kb is also started for the user's message before the model
+        has even answered; if the model then asks for search_kb with the same query the result is reused, otherwise it is thrown away.
 
+        With ANSWER_CACHE in .env (or answer_cache=<a SemanticAnswerCache>) the user's message is looked up among the questions
+        answered before, and a close enough match has its answer streamed back without calling the model at all. Only answers
+        the model built from a successful search_kb are stored (see cacheable_turn).
         """
 
         ### Skills
-        skills = json.load(open('./advanced_chatbot/skills.json'))
+        tools = list(get_tools())
+        llm_client = get_openai_client()
+
+        cache = (shared_answer_cache if ANSWER_CACHE else None) if answer_cache is None else answer_cache
+        question_vector = None
+        if cache is not None:
+                question = opening_question(incoming_messages)
+                question_vector = cache.embed(question) if question else None
+                hit = cache.lookup(question_vector) if question_vector is not None else None ## follow-ups skip the cache altogether
+                if hit is not None:
+                        tracing.start_span("answer_cache.hit", similarity=round(hit[1], 4)).end()
+                        yield from replay(hit[0])
+                        return
+        answer_parts = [] ## what we streamed back, for the answer cache
+
+        speculative = SPECULATIVE_KB if speculative is None else speculative
+        prefetched = {} ## user's message -> search_kb future started before the model asked for it
+        if speculative:
+                user_text = latest_user_text(incoming_messages)
+                if user_text:
+                        prefetched[user_text] = submit_tool("search_kb", search_kb, {"query": user_text}, speculative=True)
+
+        def launch(call):
+                if call["function"]["name"] == "search_kb" and prefetched:
+                        function_args = parse_arguments(call) or {}
+                        asked = next(iter(prefetched))
+                        if same_question(asked, str(function_args.get("query", ""))): ## the guess was right - reuse the search that is already running
+                                speculative_kb_stats["reused"] += 1
+                                return prefetched.pop(asked)
+                        speculative_kb_stats["missed"] += 1
+                return start_tool(call)
 
+        started_tools = {} ## tool call index -> future, for the tools we could start early
+        messages = list(incoming_messages) ## the tool prompts are only needed for this turn - keep them out of the caller's memory
+        first_span = tracing.start_span("completion.first", model=aimodel, messages=len(messages))
+        final_span = tracing.NOOP_SPAN
 
-        
         try: # Try the below or else throw back the error to the chat screen if something goes wrong
 
                 response_generator = llm_client.chat.completions.create( ### We call GPT for the first time with our skills
                         model=aimodel,
-                        messages=incoming_messages,
+                        messages=messages,
                         temperature=0.7,
-                        functions=skills,
-                        function_call="auto",
+                        tools=tools,
+                        tool_choice="auto",
                         stream=True,
-                        max_tokens=300
+                        max_tokens=300,
+                        **tracing.usage_options()
                 )
-                
 
-                function_call_detected = False ### Add triggers for when a function is needed
-                our_functions = False ### Sometimes OpenAI makes up a function name so lets use another trigger
-                func_call = {"name": "", "arguments": ""} ## Prepare an empty json for the function name and arguments
-                
+
+                tool_calls = {} ## Tool calls come in pieces, keyed by their index - gather the id, name and arguments for each
+                failed_tools = []
+
                 for response_chunk in response_generator: ### Start getting the deltas/chunks from the first response...
 
+                        if getattr(response_chunk, 'usage', None): ### only sent while tracing
+                                first_span.set(prompt_tokens=response_chunk.usage.prompt_tokens, completion_tokens=response_chunk.usage.completion_tokens)
                         if response_chunk.choices and len(response_chunk.choices) > 0:
+                                first_span.first_token()
                                 deltas = response_chunk.choices[0].delta
-                                if deltas.function_call:  ### If a function_call value is picked up from the delta
-                                        function_call_detected = True ### change trigger to true
-                                        if deltas.function_call.name: ### if this delta has a name in the function_call
-                                                func_call["name"] = deltas.function_call.name ## save it
-                                        if deltas.function_call.arguments: ### if this delta has the arguments in the function_call
-                                                func_call["arguments"] += deltas.function_call.arguments ## save the arguments
-                                if (
-                                        function_call_detected ### If our function trigger is true
-                                        and response_chunk.choices[0].finish_reason == "function_call" ### and the response finish_reason says function_call
-                                ): ## kick off the process to call the function, get the response and send back to LLM for the final answer
-                                        
-                                        available_functions = { ### Link function_name values with the actual functions 
-                                        "search_internet": search_internet,
-                                        "search_kb": search_kb
-                                        }
-
-                                        if available_functions.get(func_call["name"]): ## if the function name returned from GPT matches any one of ours
-                                                our_functions = True ## it wants to trigger our function so change the trigger to True
-                                                function_to_call = available_functions.get(func_call["name"]) ## assign the function to call
-                                                function_args = json.loads(func_call["arguments"]) ## assign the function arguments
-                                                function_response = function_to_call(**function_args) ## get the response from the function
-                                                incoming_messages.append(function_response) ## add the response to the list of messages
-                                                
-                                                final_response_generator = llm_client.chat.completions.create( ## Call gpt a second time with the added message
-                                                                model='gpt-3.5-turbo',
-                                                                messages=incoming_messages,
-                                                                temperature=0.7,
-                                                                stream=True
-                                                        )
-                                        
-                                                
-                                                for final_chunk in final_response_generator: ### stream and return the chunks one by one to the chat application 
-                                                        if final_chunk.choices and len(final_chunk.choices) > 0:
-                                                                final_message_content = final_chunk.choices[0].delta.content
-                                                                if final_message_content:
-                                                                        yield final_message_content
-                                                                        
-                                                # Reset flags and function call data after processing the function call
-                                                function_call_detected = False
-                                                our_functions = False
-                                                func_call = {"name": "", "arguments": ""}
-                                                continue  # This will move the loop to process the next chunk from response_generator
-
-                                                                        
-                                elif deltas.content and not function_call_detected and not our_functions:  ### if a function call is not needed, or a function call was hallucinated...
+                                if deltas.tool_calls:  ### If tool_calls are picked up from the delta
+                                        for tool_delta in deltas.tool_calls:
+                                                call = add_tool_delta(tool_calls, tool_delta)
+                                                if tool_delta.index not in started_tools and call["function"]["arguments"] and parse_arguments(call) is not None:
+                                                        started_tools[tool_delta.index] = launch(call) ## complete JSON - no need to wait for the stream to end
+                                elif deltas.content and not tool_calls:  ### if a tool call is not needed...
+                                        answer_parts.append(deltas.content)
                                         yield deltas.content ### Send back the normal response.
+
+                first_span.end(tool_calls=len(tool_calls))
+                if tool_calls: ## kick off the process to call the tools, get the responses and send back to LLM for the final answer
+                        indexes = sorted(tool_calls)
+                        futures = [started_tools[index] if index in started_tools else launch(tool_calls[index]) for index in indexes]
+                        tool_calls = [tool_calls[index] for index in indexes]
+                        messages.append({"role": "assistant", "content": None, "tool_calls": tool_calls}) ## the model's request...
+                        tool_messages, failed_tools = run_tools(tool_calls, futures)
+                        messages.extend(tool_messages) ## ...and every tool's answer
+
+                        final_span = tracing.start_span("completion.final", model=FOLLOW_UP_MODEL, messages=len(messages))
+                        final_response_generator = llm_client.chat.completions.create( ## Call gpt a second time with the added messages
+                                        model=FOLLOW_UP_MODEL,
+                                        messages=messages,
+                                        temperature=0.7,
+                                        stream=True,
+                                        **tracing.usage_options()
+                                )
+
+                        for final_chunk in final_response_generator: ### stream and return the chunks one by one to the chat application
+                                if getattr(final_chunk, 'usage', None):
+                                        final_span.set(prompt_tokens=final_chunk.usage.prompt_tokens, completion_tokens=final_chunk.usage.completion_tokens)
+                                if final_chunk.choices and len(final_chunk.choices) > 0:
+                                        final_span.first_token()
+                                        final_message_content = final_chunk.choices[0].delta.content
+                                        if final_message_content:
+                                                answer_parts.append(final_message_content)
+                                                yield final_message_content
+
+                if question_vector is not None and cacheable_turn(tool_calls, failed_tools):
+                        cache.store(question_vector, ''.join(answer_parts), question)
         except Exception as err: ### if something goes wrong then send the error back to the chat app
-                yield err
\ No newline at end of file
+                first_span.set(error=repr(err)) ## only the span still open gets exported with it
+                final_span.set(error=repr(err))
+                yield err
+        finally:
+                first_span.end()
+                final_span.end()
+                for future in prefetched.values(): ### the speculative search wasn't needed
+                        speculative_kb_stats["unused"] += 1
+                        future.cancel()
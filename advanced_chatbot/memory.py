@@ -0,0 +1,171 @@
+# Token-budgeted conversation memory for the chat apps
+import json
+from functools import lru_cache
+
+### Context window per model (tokens), matched on the longest prefix so dated versions like gpt-4o-2024-08-06 are
+### covered. Anything else gets DEFAULT_CONTEXT_WINDOW.
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-0613': 4096,
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4-vision-preview': 128000,
+    'gpt-4o': 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+### Room kept free in every prompt for the answer and for skill results added during the turn - never more than
+### RESERVE_FRACTION of the window, or a small window would leave no room for the history at all
+DEFAULT_RESERVE = 4000
+RESERVE_FRACTION = 0.5
+TOKENS_PER_MESSAGE = 3 ## every message costs a few tokens of wrapping on top of its content
+TOKENS_PER_IMAGE = 85 ## the flat cost of a low detail image - a good enough estimate for budgeting
+REPLY_PRIMING = 3 ## every reply is primed with <|start|>assistant<|message|>
+SUMMARY_PREFIX = "Summary of the earlier conversation: " ## starts the system message that stands in for dropped turns
+
+
+def context_window(model):
+    """
+    The context window of `model`, from the longest matching prefix in MODEL_CONTEXT_WINDOWS.
+    """
+    matches = [name for name in MODEL_CONTEXT_WINDOWS if model.startswith(name)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base") ## used by all the chat models in this course
+
+
+def count_message_tokens(message):
+    """
+    Approximate prompt tokens for one chat message, the same way OpenAI's cookbook counts them.
+    """
+    encoding = get_encoding()
+    tokens = TOKENS_PER_MESSAGE + len(encoding.encode(message.get("role", "")))
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += len(encoding.encode(content))
+    elif isinstance(content, list): ## vision messages mix text and images
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(encoding.encode(part.get("text", "")))
+            else:
+                tokens += TOKENS_PER_IMAGE
+    if message.get("tool_calls"):
+        tokens += len(encoding.encode(json.dumps(message["tool_calls"])))
+    return tokens
+
+
+class ConversationMemory:
+    """
+    The chat history kept in st.session_state, with every message's token count worked out once when it is added.
+
+    It behaves like the plain list the apps used before (iterate, append, index), but instead of sending the whole
+    history every turn, build_prompt() returns the leading system prompt plus as many of the newest turns as fit the
+    model's budget. Older turns are dropped - or, if a `summarizer` is given, replaced by a short summary - and tool
+    outputs from earlier turns are never resent.
+    """
+
+    def __init__(self, messages=None, reserve=DEFAULT_RESERVE, summarizer=None):
+        self.messages = []
+        self.counts = []
+        self.reserve = reserve
+        self.summarizer = summarizer ## callable(list of messages) -> summary text
+        self._summary = (0, None) ## (number of messages summarised, summary message)
+        self.last_prompt_tokens = 0
+        self.last_dropped = 0
+        for message in messages or []:
+            self.append(message)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def append(self, message):
+        self.messages.append(message)
+        self.counts.append(count_message_tokens(message))
+
+    def budget(self, *models):
+        """
+        History tokens allowed when the prompt has to fit every one of `models` - the smallest window wins.
+        """
+        window = min(context_window(model) for model in models)
+        return window - min(self.reserve, int(window * RESERVE_FRACTION))
+
+    def _summary_message(self, dropped):
+        """
+        Summarise the dropped messages, reusing the previous summary while the same messages are dropped.
+        """
+        if not self.summarizer or not dropped:
+            return None
+        if self._summary[0] != len(dropped):
+            summary = self.summarizer(dropped)
+            self._summary = (len(dropped), {"role": "system", "content": SUMMARY_PREFIX + summary})
+        return self._summary[1]
+
+    def build_prompt(self, model, *follow_up_models):
+        """
+        The messages to send for this turn, kept under the model's token budget. When the same history is sent on to
+        other models in the turn (chat_llm answers after a tool call with FOLLOW_UP_MODEL), list them too.
+        """
+        budget = self.budget(model, *follow_up_models) - REPLY_PRIMING
+        head = 0
+        while head < len(self.messages) and self.messages[head]["role"] == "system":
+            head += 1 ## the leading system prompt is always sent
+        used = sum(self.counts[:head])
+
+        ### Walk back from the newest message and keep whole messages until the budget runs out
+        last_user = max((i for i, message in enumerate(self.messages) if message["role"] == "user"), default=len(self.messages))
+        kept = []
+        start = len(self.messages)
+        for i in range(len(self.messages) - 1, head - 1, -1):
+            message = self.messages[i]
+            if i < last_user and (message["role"] == "tool" or message.get("tool_calls")):
+                continue ## stale tool output from an earlier turn
+            if used + self.counts[i] > budget and kept:
+                break
+            used += self.counts[i]
+            kept.append(message)
+            start = i
+        kept.reverse()
+
+        dropped = [message for message in self.messages[head:start] if message["role"] in ("user", "assistant") and message.get("content")]
+        summary = self._summary_message(dropped)
+        prompt = self.messages[:head] + ([summary] if summary else []) + kept
+        self.last_prompt_tokens = used + REPLY_PRIMING + (count_message_tokens(summary) if summary else 0)
+        self.last_dropped = len(dropped)
+        return prompt
+
+    def stats(self):
+        return {
+            "messages": len(self.messages),
+            "history_tokens": sum(self.counts),
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "last_dropped": self.last_dropped,
+        }
+
+
+def llm_summarizer(llm_client, model='gpt-3.5-turbo', max_tokens=200):
+    """
+    A summarizer for ConversationMemory that asks the LLM for a short recap of the dropped turns.
+    """
+    def summarize(messages):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages if isinstance(message['content'], str))
+        response = llm_client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": f"Summarise this conversation in a few sentences, keeping any facts the user shared:\n\n{transcript}"}],
+            temperature=0,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+    return summarize
@@ -0,0 +1,187 @@
+# Quantized embeddings - a coarse search over int8 or 1-bit codes, then an exact re-rank of a few candidates
+#
+#   python -m advanced_chatbot.quantize --mode int8      (turn on quantization for the Qdrant "books" collection)
+#
+# A 1536-dim float32 ada-002 vector is 6 KB. As int8 codes it is 1.5 KB and as sign bits 192 bytes, so a much
+# bigger library fits in memory and the first pass touches far less of it. The full-precision vectors are only read
+# for the `limit * oversample` candidates of each query, which is why they can stay in a memory-mapped store on disk.
+import argparse
+import os
+import sys
+import numpy as np
+from dotenv import load_dotenv
+from .vector_index import ScoredHit
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+### '' (off), 'int8' or 'binary' - used by search_kb for both backends and by the ingestion when it creates the collection
+KB_QUANTIZATION = os.getenv('KB_QUANTIZATION', '').lower()
+### Candidates re-ranked per result - one bit per dimension loses more, so binary needs a bigger pool for the same recall
+OVERSAMPLE = {'int8': 4, 'binary': 20}
+KB_RERANK_OVERSAMPLE = float(os.getenv('KB_RERANK_OVERSAMPLE') or 0) or None ## overrides the above when set
+MODES = tuple(OVERSAMPLE)
+BLOCK_ROWS = 16384 ## rows converted per step while building the codes
+SCORE_ROWS = 2048 ## int8 rows upcast per step while searching - small enough to stay in the CPU cache
+
+if hasattr(np, 'bitwise_count'): ## numpy 2.0+
+    def _popcount(values):
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_TABLE[values.view(np.uint8)]
+
+
+class QuantizedIndex:
+    """
+    Wraps a NumpyIndex with quantized codes and the same search()/search_batch() methods.
+
+    int8: every dimension is scaled from the corpus' min..max range to -128..127 and the query (kept in float) is
+    scored against the codes - an asymmetric dot product that is very close to the real one.
+    binary: one bit per dimension, set when the value is above that dimension's corpus mean (ada-002 vectors are not
+    centred on zero, so a plain sign bit wastes most of its information); candidates are the smallest Hamming distances.
+
+    With rerank=True (the default) the best `limit * oversample` candidates are scored again with the full vectors,
+    so the scores are exact and only the candidate list is approximate.
+    """
+
+    def __init__(self, index, mode='int8', oversample=None, rerank=True):
+        if mode not in MODES:
+            raise ValueError(f"Unknown quantization '{mode}' - use one of {', '.join(MODES)}")
+        self.index = index
+        self.mode = mode
+        self.oversample = oversample or OVERSAMPLE[mode]
+        self.rerank = rerank
+        self.payloads = index.payloads
+        self.ids = index.ids
+        self.dimensions = index.vectors.shape[1]
+        if mode == 'int8':
+            self._build_int8()
+        else:
+            self._build_binary()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _blocks(self):
+        for start in range(0, len(self.index), BLOCK_ROWS):
+            yield start, np.asarray(self.index.vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+
+    def _build_int8(self):
+        low = np.full(self.dimensions, np.inf, dtype=np.float32)
+        high = np.full(self.dimensions, -np.inf, dtype=np.float32)
+        for _, block in self._blocks():
+            low = np.minimum(low, block.min(axis=0))
+            high = np.maximum(high, block.max(axis=0))
+        self.low = low
+        self.step = np.where(high > low, (high - low) / 255, 1).astype(np.float32)
+        self.codes = np.empty((len(self.index), self.dimensions), dtype=np.int8)
+        for start, block in self._blocks():
+            self.codes[start:start + block.shape[0]] = np.clip(np.rint((block - low) / self.step) - 128, -128, 127)
+
+    def _build_binary(self):
+        total = np.zeros(self.dimensions, dtype=np.float64)
+        for _, block in self._blocks():
+            total += block.sum(axis=0)
+        self.center = (total / max(len(self.index), 1)).astype(np.float32)
+        codes = np.empty((len(self.index), (self.dimensions + 7) // 8), dtype=np.uint8)
+        for start, block in self._blocks():
+            codes[start:start + block.shape[0]] = np.packbits(block > self.center, axis=1)
+        ### XOR and popcount 8 bytes at a time when the rows line up
+        self.codes = codes.view(np.uint64) if codes.shape[1] % 8 == 0 else codes
+
+    def memory_bytes(self):
+        """
+        Bytes held in memory for the coarse search (the full vectors aren't counted - they can stay on disk).
+        """
+        extra = sum(array.nbytes for array in (getattr(self, name, None) for name in ('low', 'step', 'center')) if array is not None)
+        return self.codes.nbytes + extra
+
+    def _coarse_scores(self, query):
+        """
+        Higher is better for both modes. For int8 this is the approximate cosine similarity.
+        """
+        if self.mode == 'int8':
+            weights = query * self.step
+            offset = float(query @ self.low) + 128 * float(weights.sum())
+            ### numpy has no fast int8 matmul, so copy a cache-sized block into a float buffer and let BLAS do the rest
+            scores = np.empty(len(self.index), dtype=np.float32)
+            buffer = np.empty((min(SCORE_ROWS, len(self.index)), self.dimensions), dtype=np.float32)
+            for start in range(0, len(self.index), SCORE_ROWS):
+                block = self.codes[start:start + SCORE_ROWS]
+                rows = buffer[:block.shape[0]]
+                np.copyto(rows, block)
+                np.matmul(rows, weights, out=scores[start:start + block.shape[0]])
+            return scores + offset
+        bits = np.packbits(query > self.center).view(self.codes.dtype)
+        distances = _popcount(self.codes ^ bits).sum(axis=1, dtype=np.int32)
+        return 1 - 2 * distances / self.dimensions ## 1 when every bit agrees, -1 when none do
+
+    def _search_one(self, query, limit):
+        limit = min(limit, len(self.index))
+        if limit <= 0:
+            return []
+        scores = self._coarse_scores(query)
+        candidates = min(len(self.index), max(limit, int(limit * self.oversample)) if self.rerank else limit)
+        best = np.argpartition(-scores, candidates - 1)[:candidates]
+        if self.rerank:
+            best = np.sort(best) ## read the full vectors in file order
+            scores = np.asarray(self.index.vectors[best], dtype=np.float32) @ query
+            order = np.argsort(-scores)[:limit]
+            best, scores = best[order], scores[order]
+        else:
+            best = best[np.argsort(-scores[best])]
+            scores = scores[best]
+        return [ScoredHit(self.ids[row], float(score), self.payloads[row]) for row, score in zip(best.tolist(), scores.tolist())]
+
+    def search(self, query_vector, limit=5):
+        return self.search_batch([query_vector], limit=limit)[0]
+
+    def search_batch(self, query_vectors, limit=5):
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return [self._search_one(query, limit) for query in queries / norms]
+
+
+def qdrant_quantization_config(mode=KB_QUANTIZATION):
+    """
+    The same idea on the Qdrant side - the quantized vectors are kept in RAM and the originals can live on disk.
+    """
+    if not mode:
+        return None
+    from qdrant_client.http import models
+    if mode == 'int8':
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if mode == 'binary':
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"Unknown quantization '{mode}' - use one of {', '.join(MODES)}")
+
+
+def qdrant_search_params(mode=KB_QUANTIZATION, oversample=KB_RERANK_OVERSAMPLE):
+    """
+    Ask Qdrant to search the quantized vectors and rescore `oversample` times as many candidates with the originals.
+    """
+    if not mode:
+        return None
+    from qdrant_client.http import models
+    return models.SearchParams(quantization=models.QuantizationSearchParams(rescore=True, oversampling=oversample or OVERSAMPLE[mode]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn on quantization for an existing Qdrant collection")
+    parser.add_argument('--mode', choices=MODES, default=KB_QUANTIZATION or 'int8')
+    parser.add_argument('--collection', default='books')
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+    qdrant_client = QdrantClient(url=os.getenv('VECTORDB_ENDPOINT'), api_key=os.getenv('VECTORDB_KEY'))
+    qdrant_client.update_collection(collection_name=args.collection, quantization_config=qdrant_quantization_config(args.mode))
+    print(f"{args.collection}: {args.mode} quantization on - set KB_QUANTIZATION='{args.mode}' in .env to search with it")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# Incremental re-indexing of the books/ folder
+#
+#   python -m advanced_chatbot.reindex --books ./books
+#
+# A manifest remembers which chunk ids every book produced last time. On each run only the chunks that are new
+# get embedded and upserted, and chunks that disappeared (edited or deleted books) are removed by id, so the cost
+# follows the size of the change rather than the size of the library. Unchanged files are skipped without re-splitting.
+#
+# Chunks are labelled "Source: <title>; Text: ..." with the title from books/sources.json (the file name if a book
+# isn't listed), the same way ingest labels the rows of documents.csv, so both give the same chunk the same id.
+#
+# A collection loaded by notebook 5 has counter ids the manifest knows nothing about, so the first run against it
+# needs --recreate to start the collection afresh - otherwise every chunk would be stored twice.
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import sys
+from collections import Counter
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from .chunker import chunk_files
+from .ingest import Checkpoint, QdrantSink, chunk_id, ingest
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+
+def load_manifest(path):
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    return {"version": None, "files": {}}
+
+
+def save_manifest(path, files):
+    """
+    Write the manifest atomically. `version` is a hash of every chunk id, so it changes whenever the index does.
+    """
+    all_ids = sorted(point_id for entry in files.values() for point_id in entry["chunks"])
+    manifest = {
+        "version": hashlib.sha256('\n'.join(all_ids).encode('utf-8')).hexdigest(),
+        "files": files,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+def load_sources(books_dir):
+    """
+    The "Source:" title of every book, from books/sources.json ({"theodyssey.txt": "Homer's Odyssey"}).
+    """
+    path = os.path.join(books_dir, 'sources.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    return {}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def plan(books_dir, manifest, max_workers=None):
+    """
+    Compare the books on disk with the manifest.
+    Returns (documents to embed, ids to delete, the new manifest files section).
+    """
+    previous_files = manifest["files"]
+    sources = load_sources(books_dir)
+    files = {}
+    to_embed = []
+    to_delete = []
+    changed = {}
+    for path in sorted(glob.glob(os.path.join(books_dir, '**', '*.txt'), recursive=True)):
+        name = os.path.relpath(path, books_dir).replace(os.sep, '/')
+        digest = file_hash(path)
+        previous = previous_files.get(name)
+        if previous and previous["sha256"] == digest and previous.get("source") == sources.get(name, name):
+            files[name] = previous ## untouched file - nothing to split or embed
+        else:
+            changed[path] = (name, digest)
+
+    ### Only the changed books get chunked, spread over a process pool
+    for path, chunks in chunk_files(changed, max_workers=max_workers):
+        name, digest = changed[path]
+        previous = previous_files.get(name)
+        known = set(previous["chunks"]) if previous else set()
+        source = sources.get(name, name)
+        ids = []
+        seen = Counter()
+        for chunk in chunks:
+            text = "Source: " + source + "; Text: " + chunk ## same label and id as ingest.load_documents
+            point_id = chunk_id(source, text, seen[text])
+            seen[text] += 1
+            ids.append(point_id)
+            if point_id not in known:
+                to_embed.append((point_id, text, {"text": text, "source": source}))
+        to_delete.extend(known - set(ids))
+        files[name] = {"sha256": digest, "source": source, "chunks": ids}
+
+    for name, previous in previous_files.items():
+        if name not in files: ## the book was removed
+            to_delete.extend(previous["chunks"])
+    return to_embed, to_delete, files
+
+
+async def reindex(books_dir, sink, llm_client, manifest_path, checkpoint, recreate=False, **options):
+    """
+    Bring the collection in line with books_dir. Extra keyword arguments are passed on to ingest().
+    recreate drops the collection first and ignores the old manifest - for a collection that reindex didn't build.
+    """
+    if recreate:
+        await asyncio.to_thread(sink.ensure_collection, True)
+        checkpoint.reset()
+        manifest = {"version": None, "files": {}}
+    else:
+        manifest = load_manifest(manifest_path)
+    to_embed, to_delete, files = plan(books_dir, manifest)
+    stats = await ingest(to_embed, sink, llm_client, checkpoint, **options)
+    if to_delete:
+        await asyncio.to_thread(sink.delete, to_delete)
+    manifest = save_manifest(manifest_path, files)
+    checkpoint.reset() ## everything is in the manifest now
+    stats.update({"deleted": len(to_delete), "files": len(files), "version": manifest["version"]})
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Incrementally re-index the books folder into the vector database')
+    parser.add_argument('--books', default='./books')
+    parser.add_argument('--manifest', default=os.getenv('KB_MANIFEST', './.cache/books_manifest.json'))
+    parser.add_argument('--collection', default='books')
+    parser.add_argument('--qdrant-url', default=os.getenv('VECTORDB_ENDPOINT'), help='Qdrant URL, or :memory:')
+    parser.add_argument('--checkpoint', default='./.cache/reindex_checkpoint.jsonl')
+    parser.add_argument('--base-url', default=None, help='OpenAI compatible endpoint, e.g. the local stub')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--recreate', action='store_true', help='drop the collection and the manifest and index every book again')
+    args = parser.parse_args(argv)
+
+    if not args.qdrant_url:
+        parser.error('set VECTORDB_ENDPOINT in .env or pass --qdrant-url')
+
+    sink = QdrantSink(args.qdrant_url, api_key=os.getenv('VECTORDB_KEY'), collection_name=args.collection)
+    sink.ensure_collection()
+    if not args.recreate and not os.path.exists(args.manifest) and sink.count():
+        ### Points we have no manifest for (e.g. loaded by notebook 5) would never be deleted and every hit would show up twice
+        parser.error(f'the collection {args.collection} already has points but there is no manifest at {args.manifest}; '
+                     'run once with --recreate to index it from scratch')
+    llm_client = AsyncOpenAI(api_key=os.getenv('OPENAI_KEY'), base_url=args.base_url)
+    stats = asyncio.run(reindex(
+        args.books, sink, llm_client, args.manifest, Checkpoint(args.checkpoint),
+        recreate=args.recreate, batch_size=args.batch_size, concurrency=args.concurrency
+    ))
+    print(json.dumps(stats), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Streaming renderer for the chat apps - redraw the answer a few times a second instead of on every token
+import time
+
+MIN_INTERVAL = 0.05 ## seconds between redraws while the answer is short
+MAX_INTERVAL = 0.5 ## ...and the longest we ever wait between two redraws
+SECONDS_PER_CHAR = 0.00005 ## every 1000 characters already on screen add 50ms - long answers cost more to redraw
+MAX_PENDING_CHARS = 400 ## redraw early if this much new text is waiting
+
+
+class StreamRenderer:
+    """
+    Collects streamed tokens and redraws a Streamlit placeholder on a time and size budget.
+
+    The first token is drawn straight away. After that a redraw happens when enough time has passed since the last
+    one - the gap grows with the length of the answer, because every redraw sends the whole text again - or when
+    a lot of new text is waiting. Tokens are kept in a list and only joined when the text is drawn.
+    `renders` and `first_paint_seconds` (from the renderer's creation to the first draw) show how it went.
+    """
+
+    def __init__(self, placeholder, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 seconds_per_char=SECONDS_PER_CHAR, max_pending_chars=MAX_PENDING_CHARS, clock=time.monotonic):
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.seconds_per_char = seconds_per_char
+        self.max_pending_chars = max_pending_chars
+        self.clock = clock
+        self.parts = []
+        self.length = 0
+        self.pending_chars = 0
+        self.renders = 0
+        self.started = clock()
+        self.last_render = self.started
+        self.first_paint_seconds = None
+
+    @property
+    def text(self):
+        if len(self.parts) > 1:
+            self.parts = [''.join(self.parts)]
+        return self.parts[0] if self.parts else ''
+
+    def interval(self):
+        return min(self.max_interval, self.min_interval + self.length * self.seconds_per_char)
+
+    def write(self, token):
+        token = str(token)
+        if not token:
+            return
+        self.parts.append(token)
+        self.length += len(token)
+        self.pending_chars += len(token)
+        now = self.clock()
+        if self.renders == 0 or self.pending_chars >= self.max_pending_chars or now - self.last_render >= self.interval():
+            self.flush(now)
+
+    def flush(self, now=None):
+        now = self.clock() if now is None else now
+        self.placeholder.markdown(self.text)
+        self.renders += 1
+        self.pending_chars = 0
+        self.last_render = now
+        if self.first_paint_seconds is None:
+            self.first_paint_seconds = now - self.started
+
+    def close(self):
+        """
+        Draw whatever is still waiting and return the full text.
+        """
+        if self.pending_chars or self.renders == 0:
+            self.flush()
+        return self.text
+
+    def stats(self):
+        return {
+            "renders": self.renders,
+            "characters": self.length,
+            "first_paint_seconds": self.first_paint_seconds,
+        }
@@ -1,29 +1,101 @@
 # RAG - DuckDuckGo
-from duckduckgo_search import DDGS
-from gptrim import trim
+from dotenv import load_dotenv
+import os
+import re
+import threading
+from functools import lru_cache
+from .cache_utils import SingleFlight, TTLCache, normalize_query
+# Load dotenv for picking up creds from .env
+load_dotenv()
 
-def search_internet(query):
+### Recent searches are reused for a few minutes - trending questions from many users only hit DuckDuckGo once
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '300'))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '256'))
+
+
+class DDGSProvider:
+    """
+    Keeps a single DuckDuckGo session open for the whole process instead of opening one per search.
+    duckduckgo_search is only imported with the first search.
+    Any object with the same text(query, max_results) method can be used instead, e.g. a fake for benchmarks.
+    """
+
+    def __init__(self):
+        self._ddgs = None
+        self._lock = threading.Lock()
+
+    def text(self, query, max_results):
+        if self._ddgs is None:
+            with self._lock:
+                if self._ddgs is None:
+                    from duckduckgo_search import DDGS
+                    self._ddgs = DDGS()
+        return list(self._ddgs.text(query, max_results=max_results))
+
+
+default_provider = DDGSProvider()
+results_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+inflight = SingleFlight()
+
+
+@lru_cache(maxsize=None)
+def gptrim_available():
+    """
+    gptrim needs NLTK's stopwords and punkt data, which it tries to download on import - on a machine without them
+    (or without network) every trim raises LookupError.
+    """
+    from gptrim import trim ## pulls in nltk, so only when there are results to trim
+    try:
+        trim('Checking the NLTK data.')
+    except LookupError:
+        return False
+    return True
+
+
+def trim_text(text):
+    if gptrim_available():
+        from gptrim import trim
+        return trim(text)
+    ### Same as gptrim minus the stop words: contractions merged, the spaces between words dropped
+    return ''.join(re.findall(r"\w+|[^\w\s]", text.replace("'", "").replace("’", "")))
+
+
+def format_results(search_results):
+    result_text = ''
+    for result in search_results:
+        title = result.get('title', '')
+        snippet = result.get('body', '')
+        url = result.get('href', '')
+        result_text += f'Title: {title}\nSnippet: {snippet}\nURL: {url}\n\n'
+    return trim_text(result_text)
+
+
+def search_internet(query, provider=None):
     """
     Use Duckduck go Search
+
+    Results are cached by normalised query for SEARCH_CACHE_TTL seconds, and identical searches that arrive
+    while one is already running wait for it instead of starting their own.
     """
-    
+
     count = 5
-    result_text=''
-    with DDGS() as ddgs:
-        search_results = [r for r in ddgs.text(query, max_results=count)]
-        for result in search_results:
-            title = result.get('title', '')
-            snippet = result.get('body', '')
-            url = result.get('href', '')
-            result_text += f'Title: {title}\nSnippet: {snippet}\nURL: {url}\n\n'
-
-        search_prompt = f"""
+    provider = provider or default_provider
+    key = normalize_query(query)
+    context = results_cache.get(key)
+    if context is None:
+        def run_search():
+            found = format_results(provider.text(query, max_results=count))
+            if found: ### don't remember empty answers, they are usually a hiccup on the search side
+                results_cache.put(key, found)
+            return found
+        context = inflight.do(key, run_search)
+
+    search_prompt = f"""
         Based on the internet search results provided in <>, provide an answer to the query [] if it is relevant along with a source URL. \
         If there are no internet search results or if they are not relevant then say \"Please try again.\"\
         
-        context:<{trim(result_text)}>
+        context:<{context}>
         query:[{query}]
         """
 
-        return {"role":"system","content": search_prompt}
-
+    return {"role":"system","content": search_prompt}
@@ -1,38 +1,67 @@
-from openai import OpenAI
-from qdrant_client import QdrantClient
-from gptrim import trim
+from .clients import get_openai_client, get_qdrant_client
+from .embedding_cache import EmbeddingCache
+from .kb_context import build_context
+from .quantize import KB_QUANTIZATION, KB_RERANK_OVERSAMPLE, QuantizedIndex, qdrant_search_params
 from dotenv import load_dotenv
 import os
 # Load dotenv for picking up creds from .env
 load_dotenv()
-# Load the vectordb
-qdrant_client = QdrantClient(
-    url=os.getenv('VECTORDB_ENDPOINT'), 
-    api_key=os.getenv('VECTORDB_KEY'),
-)
-llm_client = OpenAI(
-    api_key=os.getenv('OPENAI_KEY')
-)
-def search_kb(query):
 
-    response = llm_client.embeddings.create(
-            input=query,
-            model="text-embedding-ada-002"
+### Which vector search to use - 'qdrant' (default) or 'numpy' for the in-process index built from the local embeddings
+### KB_EMBEDDINGS_PATH can be the CSV or a binary store directory made with `python -m advanced_chatbot.embedding_store`
+KB_BACKEND = os.getenv('KB_BACKEND', 'qdrant').lower()
+KB_EMBEDDINGS_PATH = os.getenv('KB_EMBEDDINGS_PATH', './documents_embeddings.csv')
+
+### Query embeddings are cached in memory and in a small SQLite file so repeat questions skip the embeddings API
+KB_QUERY_CACHE = os.getenv('KB_QUERY_CACHE', './.cache/query_embeddings.sqlite')
+query_cache = EmbeddingCache(path=KB_QUERY_CACHE or None)
+
+_local_index = None
+
+def get_local_index():
+    """
+    Build the in-process index once and keep it for the rest of the process.
+    With KB_QUANTIZATION set the search runs over int8/binary codes and re-ranks the best candidates exactly.
+    """
+    global _local_index
+    if _local_index is None:
+        from .vector_index import NumpyIndex
+        _local_index = NumpyIndex.load(KB_EMBEDDINGS_PATH)
+        if KB_QUANTIZATION:
+            _local_index = QuantizedIndex(_local_index, mode=KB_QUANTIZATION, oversample=KB_RERANK_OVERSAMPLE)
+    return _local_index
+
+def search_vectors(embeddings, limit=5, backend=None):
+    """
+    Run the vector search against the configured backend and return the scored hits (best first).
+    """
+    backend = (backend or KB_BACKEND).lower()
+    if backend == 'numpy':
+        return get_local_index().search(embeddings, limit=limit)
+    if backend == 'qdrant':
+        return get_qdrant_client().search(
+            collection_name="books",
+            query_vector=embeddings,
+            limit=limit,
+            search_params=qdrant_search_params() ## None unless KB_QUANTIZATION is set
         )
+    raise ValueError(f"Unknown KB_BACKEND '{backend}' - use 'qdrant' or 'numpy'")
+
+def search_kb(query):
 
-    embeddings = response.data[0].embedding
+    embeddings = query_cache.embed(get_openai_client(), query, model="text-embedding-ada-002")
+    return kb_prompt(query, embeddings)
 
-    search_result = str(qdrant_client.search(
-        collection_name="books",
-        query_vector=embeddings, 
-        limit=5
-    )
-)
+def kb_prompt(query, embeddings):
+    """
+    Search with an already embedded query and wrap the hits in the prompt for the model (shared with the async server).
+    """
+    search_result = build_context(search_vectors(embeddings, limit=5)) ## just the text and source of the best hits, overlaps merged
     search_prompt = f"""
         Based on the knowledge base snippets provided in <>, provide an answer to the query [] if it is relevant along with a source. \
         If there are no snippets or if they are not relevant then say \"Please try again.\"\
         
-        context:<{trim(search_result)}>
+        context:<{search_result}>
         query:[{query}]
         """
     
@@ -0,0 +1,417 @@
+# Headless streaming API around the chatbot - many concurrent users per process and no Streamlit in the way
+#
+#   python -m advanced_chatbot.server --host 0.0.0.0 --port 8000 --workers 4
+#
+#   POST   /v1/chat               {"message": "...", "session_id": optional, "model": optional}  -> text/event-stream
+#   POST   /v1/transcribe         raw audio as the body (?language=en)                           -> {"text": "..."}
+#   POST   /v1/speech             {"text": "...", "voice": optional}                             -> audio/mpeg, streamed
+#   DELETE /v1/sessions/<id>
+#   GET    /healthz
+#
+# The chat stream sends `event: session` with the session id, then one `data: {"token": ...}` per token and finally
+# `event: done` (or `event: error`). Send the session id back with the next message to carry on the conversation.
+#
+# It is a small HTTP/1.1 server on asyncio streams so it needs nothing beyond the standard library; put it behind
+# nginx or a load balancer for TLS. Each worker runs one event loop and --workers forks that many of them on a shared
+# socket, so a machine's cores can all take connections.
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import aclosing, asynccontextmanager, suppress
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+from dotenv import load_dotenv
+from .memory import ConversationMemory
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+SERVER_MAX_INFLIGHT = int(os.getenv('SERVER_MAX_INFLIGHT', '256')) ## streams per worker before new ones get a 503
+SERVER_SEND_TIMEOUT = float(os.getenv('SERVER_SEND_TIMEOUT', '30')) ## a client that reads nothing for this long is dropped
+SERVER_MAX_BODY = int(os.getenv('SERVER_MAX_BODY', str(25 * 1024 * 1024))) ## Whisper's own upload limit
+SESSION_STORE = os.getenv('SESSION_STORE', './.cache/sessions.sqlite')
+SESSION_TTL = int(os.getenv('SESSION_TTL', '86400'))
+HEADER_LIMIT = 64 * 1024
+WRITE_BUFFER = 64 * 1024 ## bytes queued for a client before a write waits for it to catch up
+IDLE_TIMEOUT = 60 ## seconds a kept-alive connection may sit without a request
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+SYSTEM_PROMPT = {"role": "system", "content": "You have tools that add more up to date context to queries should they be required, otherwise act as a helpful assistant."}
+AUDIO_TYPES = {'audio/wav': 'speech.wav', 'audio/x-wav': 'speech.wav', 'audio/webm': 'speech.webm', 'audio/ogg': 'speech.ogg', 'audio/mp4': 'speech.m4a'}
+
+Request = namedtuple('Request', ['method', 'path', 'query', 'headers', 'body', 'keep_alive'])
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None, headers=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+        self.headers = headers or {}
+
+
+class SessionStore:
+    """
+    Every session's conversation in SQLite, so all the worker processes see the same sessions.
+    Sessions untouched for `ttl` seconds are forgotten. path='' keeps them in memory (one worker only).
+    """
+
+    def __init__(self, path=SESSION_STORE, ttl=SESSION_TTL):
+        self.ttl = ttl
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ':memory:', check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL') ## readers in one worker don't wait for a writer in another
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, messages TEXT, updated REAL)')
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._db.execute('SELECT messages, updated FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def save(self, session_id, messages):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO sessions (id, messages, updated) VALUES (?, ?, ?)',
+                             (session_id, json.dumps(list(messages)), time.time()))
+            self._db.execute('DELETE FROM sessions WHERE updated < ?', (time.time() - self.ttl,))
+            self._db.commit()
+
+    def delete(self, session_id):
+        with self._lock:
+            deleted = self._db.execute('DELETE FROM sessions WHERE id = ?', (session_id,)).rowcount
+            self._db.commit()
+        return bool(deleted)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM sessions WHERE updated >= ?', (time.time() - self.ttl,)).fetchone()[0]
+
+
+async def read_request(reader):
+    """
+    Parse one request off the connection, or return None when the client has closed it.
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431)
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ', 2)
+        headers = {name.strip().lower(): value.strip() for name, value in (line.split(':', 1) for line in lines[1:] if line)}
+        length = int(headers.get('content-length') or 0)
+        if length < 0:
+            raise HTTPError(400) ## readexactly() would raise ValueError on it further down
+    except ValueError:
+        raise HTTPError(400)
+    if 'transfer-encoding' in headers:
+        raise HTTPError(411) ## every client we expect sends a Content-Length
+    if length > SERVER_MAX_BODY:
+        raise HTTPError(413)
+    body = await reader.readexactly(length) if length else b''
+    url = urlsplit(target)
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    return Request(method, url.path, {key: values[-1] for key, values in parse_qs(url.query).items()}, headers, body, keep_alive)
+
+
+def response_head(status, headers):
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}'] + [f'{name}: {value}' for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def drain(writer):
+    """
+    Wait for the client to take what we have written - this is what slows a stream down to the reader's pace.
+    """
+    await asyncio.wait_for(writer.drain(), SERVER_SEND_TIMEOUT)
+
+
+async def send_json(writer, status, payload, keep_alive=True, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    writer.write(response_head(status, {
+        'Content-Type': 'application/json', 'Content-Length': len(body),
+        'Connection': 'keep-alive' if keep_alive else 'close', **(headers or {}),
+    }) + body)
+    await drain(writer)
+
+
+class StreamResponse:
+    """
+    A chunked response - every write goes out as its own chunk straight away.
+    """
+
+    def __init__(self, writer, content_type, headers=None):
+        self.writer = writer
+        writer.write(response_head(200, {
+            'Content-Type': content_type, 'Transfer-Encoding': 'chunked', 'Cache-Control': 'no-cache', **(headers or {}),
+        }))
+
+    async def write(self, data):
+        if data:
+            self.writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+            await drain(self.writer)
+
+    async def event(self, payload, name=None):
+        text = (f'event: {name}\n' if name else '') + f'data: {json.dumps(payload)}\n\n'
+        await self.write(text.encode('utf-8'))
+
+    async def end(self):
+        self.writer.write(b'0\r\n\r\n')
+        await drain(self.writer)
+
+
+class ChatServer:
+    """
+    The request handlers of one worker. Everything shared between the requests of this worker lives here: the
+    upstream limits, the session store and the count of streams in flight.
+    """
+
+    def __init__(self, sessions=None, limits=None, max_inflight=SERVER_MAX_INFLIGHT):
+        from .async_llm import UpstreamLimits
+        self.sessions = sessions or SessionStore()
+        self.limits = limits or UpstreamLimits()
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.rejected = 0
+        self.served = 0
+        self._session_locks = {}
+
+    async def handle_connection(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), IDLE_TIMEOUT)
+                except HTTPError as err:
+                    await send_json(writer, err.status, {"error": str(err)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                if not await self.dispatch(request, writer) or not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass ## the client went away or stopped reading
+        except asyncio.CancelledError:
+            pass ## the worker is shutting down - end the connection quietly, asyncio logs a cancelled handler as an error
+        finally:
+            writer.close()
+            with suppress(Exception, asyncio.CancelledError):
+                await writer.wait_closed()
+
+    async def dispatch(self, request, writer):
+        """
+        Run the handler for one request. Returns False when the connection can't be reused.
+        """
+        routes = {
+            ('POST', '/v1/chat'): self.chat,
+            ('POST', '/v1/transcribe'): self.transcribe,
+            ('POST', '/v1/speech'): self.speech,
+            ('GET', '/healthz'): self.health,
+        }
+        handler = routes.get((request.method, request.path))
+        if handler is None and request.method == 'DELETE' and request.path.startswith('/v1/sessions/'):
+            handler = self.delete_session
+        try:
+            if handler is None:
+                raise HTTPError(404 if request.path not in {path for _, path in routes} else 405)
+            if handler in (self.chat, self.transcribe, self.speech):
+                if self.inflight >= self.max_inflight: ### shed load early instead of letting every stream slow down
+                    self.rejected += 1
+                    raise HTTPError(503, "Too many requests in flight, try again shortly", {'Retry-After': '1'})
+                self.inflight += 1
+                try:
+                    return await handler(request, writer)
+                finally:
+                    self.inflight -= 1
+                    self.served += 1
+            return await handler(request, writer)
+        except HTTPError as err:
+            await send_json(writer, err.status, {"error": str(err)}, request.keep_alive, err.headers)
+            return True
+        except (ConnectionError, asyncio.TimeoutError):
+            raise
+        except Exception as err: ### a bug rather than a bad request - log it and drop the connection, the response may be half sent
+            print(f"{request.method} {request.path} failed: {err!r}", file=sys.stderr, flush=True)
+            return False
+
+    def json_body(self, request):
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            raise HTTPError(400, "The body must be JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "The body must be a JSON object")
+        return payload
+
+    @asynccontextmanager
+    async def session_turn(self, session_id):
+        """
+        Two messages for the same session in this worker take turns, so neither loses the other's half of the chat.
+        """
+        entry = self._session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]: ## nobody else is waiting on this session
+                del self._session_locks[session_id]
+
+    async def chat(self, request, writer):
+        from .async_llm import achat_llm
+        from .llm import FOLLOW_UP_MODEL
+        payload = self.json_body(request)
+        message = payload.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, "'message' must be a non-empty string")
+        model = payload.get("model") or DEFAULT_MODEL
+        session_id = str(payload.get("session_id") or uuid.uuid4().hex)
+        async with self.session_turn(session_id):
+            messages = await asyncio.to_thread(self.sessions.load, session_id)
+            memory = ConversationMemory(messages or [SYSTEM_PROMPT])
+            memory.append({"role": "user", "content": message})
+            response = StreamResponse(writer, 'text/event-stream', {'X-Session-Id': session_id})
+            await response.event({"session_id": session_id}, 'session')
+            start = time.perf_counter()
+            answer = []
+            async with aclosing(achat_llm(model, memory.build_prompt(model, FOLLOW_UP_MODEL), self.limits)) as tokens:
+                async for token in tokens:
+                    if isinstance(token, Exception): ## achat_llm hands errors back as tokens, like chat_llm
+                        await response.event({"error": str(token)}, 'error')
+                        break
+                    answer.append(token)
+                    await response.event({"token": token})
+                else:
+                    memory.append({"role": "assistant", "content": ''.join(answer)})
+                    await asyncio.to_thread(self.sessions.save, session_id, memory)
+                    await response.event({
+                        "session_id": session_id, "prompt_tokens": memory.last_prompt_tokens,
+                        "seconds": round(time.perf_counter() - start, 3),
+                    }, 'done')
+            await response.end()
+        return True
+
+    async def transcribe(self, request, writer):
+        from .async_llm import atranscribe
+        if not request.body:
+            raise HTTPError(400, "Send the recording as the request body")
+        filename = AUDIO_TYPES.get(request.headers.get('content-type', '').split(';')[0].strip(), 'speech.mp3')
+        try:
+            text = await atranscribe(request.body, self.limits, language=request.query.get('language', 'en'), filename=filename)
+        except Exception as err:
+            raise HTTPError(502, f"Transcription failed: {err}")
+        await send_json(writer, 200, {"text": text}, request.keep_alive)
+        return True
+
+    async def speech(self, request, writer):
+        from .async_llm import asynthesize
+        payload = self.json_body(request)
+        text = payload.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(400, "'text' must be a non-empty string")
+        clip = aclosing(asynthesize(text, self.limits, voice=payload.get("voice") or 'fable'))
+        async with clip as chunks:
+            try:
+                first = await anext(chunks, b'') ## fail with a proper status if TTS is down, before the 200 goes out
+            except Exception as err:
+                raise HTTPError(502, f"Text to speech failed: {err}")
+            response = StreamResponse(writer, 'audio/mpeg')
+            await response.write(first)
+            try:
+                async for chunk in chunks:
+                    await response.write(chunk)
+            except Exception:
+                return False ## the 200 is already out, so all we can do is cut the clip short
+            await response.end()
+        return True
+
+    async def delete_session(self, request, writer):
+        deleted = await asyncio.to_thread(self.sessions.delete, request.path.rsplit('/', 1)[-1])
+        if not deleted:
+            raise HTTPError(404, "No such session")
+        await send_json(writer, 200, {"deleted": True}, request.keep_alive)
+        return True
+
+    async def health(self, request, writer):
+        await send_json(writer, 200, {
+            "pid": os.getpid(),
+            "inflight": self.inflight,
+            "served": self.served,
+            "rejected": self.rejected,
+            "sessions": await asyncio.to_thread(self.sessions.count),
+            "upstreams": self.limits.stats(),
+        }, request.keep_alive)
+        return True
+
+
+async def run_worker(sock, session_store=SESSION_STORE):
+    server = ChatServer(sessions=SessionStore(session_store))
+    listener = await asyncio.start_server(server.handle_connection, sock=sock, limit=HEADER_LIMIT)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError): ## not available on Windows
+            loop.add_signal_handler(signum, listener.close)
+    async with listener:
+        with suppress(asyncio.CancelledError):
+            await listener.serve_forever()
+
+
+def worker_main(sock, session_store):
+    asyncio.run(run_worker(sock, session_store))
+
+
+def serve(host='127.0.0.1', port=8000, workers=1, session_store=SESSION_STORE):
+    """
+    Listen on one socket and serve it from `workers` processes. The clients, caches and event loop are all created
+    inside each worker after the fork, so nothing is shared between them except the socket and the session store.
+    """
+    sock = socket.create_server((host, port), backlog=1024)
+    print(f"Serving on http://{host}:{sock.getsockname()[1]} with {workers} worker(s)", flush=True)
+    if workers <= 1 or not hasattr(os, 'fork'):
+        with suppress(KeyboardInterrupt):
+            worker_main(sock, session_store)
+        return
+    if not session_store:
+        raise ValueError("Several workers need a SESSION_STORE file to share the sessions")
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=worker_main, args=(sock, session_store), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            process.terminate()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop(None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming API server for the chatbot")
+    parser.add_argument('--host', default=os.getenv('SERVER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERVER_PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SERVER_WORKERS', '1')), help='processes, e.g. one per core')
+    parser.add_argument('--sessions', default=SESSION_STORE, help="SQLite file for the sessions ('' keeps them in memory)")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.sessions)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# Lightweight tracing of a chat turn - which stage (Whisper, completions, tools, TTS) the time went to
+#
+# Turn it on with TRACING='true' in .env. Finished spans are appended to TRACE_FILE as JSON lines shaped like
+# OpenTelemetry spans (traceId, spanId, parentSpanId, name, start/end in unix nanoseconds, attributes), and the
+# most recent ones are kept in memory for the app's debug panel. When tracing is off every call returns a shared
+# do-nothing span, so the instrumented code pays for little more than a function call.
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dotenv import load_dotenv
+# Load dotenv for picking up creds from .env
+load_dotenv()
+
+TRACING = os.getenv('TRACING', 'false').lower() in ('1', 'true', 'yes')
+TRACE_FILE = os.getenv('TRACE_FILE', './.cache/traces.jsonl')
+RECENT_SPANS = 1000 ## kept in memory for the debug panel
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class _NoopSpan:
+    """
+    What every tracing call returns while tracing is off.
+    """
+    trace_id = None
+    span_id = None
+
+    def set(self, **attributes):
+        return self
+
+    def first_token(self):
+        pass
+
+    def end(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    One timed stage of a turn. Use it as a context manager to make it the parent of the spans started inside,
+    or call end() yourself for spans that finish somewhere else (e.g. a tool running on another thread).
+    """
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = 'OK'
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def first_token(self):
+        """
+        Record time to first token - only the first call counts.
+        """
+        if 'ttft_ms' not in self.attributes:
+            self.attributes['ttft_ms'] = round((time.time_ns() - self.start_ns) / 1e6, 2)
+
+    def end(self, **attributes):
+        if self.end_ns is not None:
+            return
+        self.attributes.update(attributes)
+        self.end_ns = time.time_ns()
+        if 'ttft_ms' in self.attributes:
+            self.attributes['stream_ms'] = round(self.duration_ms() - self.attributes['ttft_ms'], 2)
+        self.tracer.export(self)
+
+    def duration_ms(self):
+        return round(((self.end_ns or time.time_ns()) - self.start_ns) / 1e6, 2)
+
+    def to_dict(self):
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None:
+            self.status = 'ERROR'
+            self.attributes['error'] = repr(exc)
+        _current.reset(self._token)
+        self.end()
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled=TRACING, path=TRACE_FILE):
+        self.enabled = enabled
+        self.path = path
+        self.recent = deque(maxlen=RECENT_SPANS)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def start_span(self, name, parent=None, **attributes):
+        """
+        Start a span under `parent` (by default the span of the surrounding `with` block) - a new trace if there is none.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        parent = parent if parent is not None else _current.get()
+        if parent is None or parent is NOOP_SPAN:
+            return Span(self, name, uuid.uuid4().hex, None, attributes)
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self.recent.append(span)
+            if self.path:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.write(line + '\n')
+                self._file.flush()
+
+    def trace(self, trace_id):
+        """
+        The finished spans of one trace as rows for the debug panel, oldest first.
+        """
+        with self._lock:
+            spans = [span for span in self.recent if span.trace_id == trace_id]
+        starts = [span.start_ns for span in spans]
+        return [
+            {'span': span.name, 'start_ms': round((span.start_ns - min(starts)) / 1e6, 2),
+             'duration_ms': span.duration_ms(), 'status': span.status, **span.attributes}
+            for span in sorted(spans, key=lambda span: span.start_ns)
+        ]
+
+
+tracer = Tracer()
+
+
+def enabled():
+    return tracer.enabled
+
+
+def start_span(name, parent=None, **attributes):
+    return tracer.start_span(name, parent=parent, **attributes)
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+def usage_options():
+    """
+    Extra arguments for a streamed completion so the last chunk carries the token usage - only while tracing.
+    """
+    return {"stream_options": {"include_usage": True}} if tracer.enabled else {}
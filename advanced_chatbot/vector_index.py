@@ -0,0 +1,108 @@
+# In-process vector index - a local alternative to Qdrant for small corpora
+import csv
+import json
+import os
+from collections import namedtuple
+import numpy as np
+
+### Same attribute names as Qdrant's ScoredPoint so search_kb can treat both backends the same way
+ScoredHit = namedtuple('ScoredHit', ['id', 'score', 'payload'])
+
+
+class NumpyIndex:
+    """
+    Keeps every embedding in one contiguous float32 matrix with unit-length rows.
+
+    Since the rows are pre-normalised, cosine similarity is just a dot product, so a search is a single
+    matrix-vector product followed by argpartition to grab the top-k without sorting the whole corpus.
+    """
+
+    BLOCK_ROWS = 65536 ## rows scored per step when the matrix isn't float32 (e.g. a float16 store)
+
+    def __init__(self, vectors, payloads, ids=None, normalized=False):
+        if normalized:
+            ### Already unit length (e.g. a memory-mapped store) - keep it as is so nothing gets copied
+            vectors = np.asarray(vectors)
+        else:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0 ## avoid dividing by zero for empty vectors
+            vectors = vectors / norms
+        if vectors.ndim != 2:
+            raise ValueError("vectors must be a 2D matrix (chunks x dimensions)")
+        if len(payloads) != vectors.shape[0]:
+            raise ValueError("there must be exactly one payload per vector")
+
+        self.vectors = vectors
+        self.payloads = payloads
+        self.ids = list(ids) if ids is not None else range(1, vectors.shape[0] + 1) ## a range costs nothing per chunk
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Load the text/embedding CSV produced in 5-vector_rag.ipynb (documents_embeddings.csv).
+        The embedding column is a printed list, which also happens to be valid JSON so we skip ast.literal_eval.
+        """
+        payloads = []
+        vectors = []
+        with open(path, 'r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                payloads.append({"text": row['text']})
+                vectors.append(json.loads(row['embedding']))
+        return cls(np.array(vectors, dtype=np.float32), payloads)
+
+    @classmethod
+    def from_store(cls, path):
+        """
+        Open a binary store written by embedding_store.convert_csv - memory-mapped, so nothing is parsed or copied.
+        """
+        from .embedding_store import open_store
+        store = open_store(path)
+        return cls(store.vectors, store.payloads, normalized=store.meta.get('normalized', False))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Pick the right loader - a directory is a binary store, anything else is treated as the CSV.
+        """
+        if os.path.isdir(path):
+            return cls.from_store(path)
+        return cls.from_csv(path)
+
+    def _scores(self, queries):
+        if self.vectors.dtype == np.float32:
+            return queries @ self.vectors.T
+        ### Half precision has no fast matmul in numpy, so upcast a block of rows at a time instead of the whole matrix
+        scores = np.empty((queries.shape[0], self.vectors.shape[0]), dtype=np.float32)
+        for start in range(0, self.vectors.shape[0], self.BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + block.shape[0]] = queries @ block.T
+        return scores
+
+    def _top_k(self, scores, limit):
+        limit = min(limit, scores.shape[0])
+        if limit <= 0:
+            return []
+        ### argpartition gives us the best `limit` rows in O(n), then we only sort those few
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [ScoredHit(self.ids[i], float(scores[i]), self.payloads[i]) for i in best]
+
+    def search(self, query_vector, limit=5):
+        """
+        Return the `limit` closest chunks to a single query vector, best first.
+        """
+        return self.search_batch([query_vector], limit=limit)[0]
+
+    def search_batch(self, query_vectors, limit=5):
+        """
+        Search several queries at once - one matrix-matrix product instead of a loop of searches.
+        """
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = self._scores(queries / norms) ## (queries x chunks) cosine similarities
+        return [self._top_k(row, limit) for row in scores]
@@ -0,0 +1,154 @@
+# Pipelined text to speech - speak the answer sentence by sentence while the LLM is still writing it
+import base64
+import re
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .audio_io import synthesize
+from . import tracing
+
+TTS_MODEL = 'tts-1'
+TTS_VOICE = 'fable'
+MIN_SENTENCE_CHARS = 40 ## very short sentences are joined to the next one - fewer, smoother clips
+
+### Shared by every session so a burst of sentences doesn't open a pool per reply
+tts_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tts")
+
+SENTENCE_END = re.compile(r'(?<=[.!?…])["\')\]]*\s+|\n+')
+
+
+class SentenceSegmenter:
+    """
+    Collects streamed tokens and hands back whole sentences as soon as they are complete.
+    """
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ''
+        self._scanned = 0 ## where to resume looking for a sentence end
+
+    def feed(self, text):
+        self._buffer += text
+        sentences = []
+        start = 0
+        deferred = None
+        for match in SENTENCE_END.finditer(self._buffer, self._scanned):
+            if match.end() == len(self._buffer) and not match.group().endswith('\n'):
+                deferred = match.start() ## "Dr." or "3." at the very end - wait for the next token before deciding
+                break
+            if match.start() - start >= self.min_chars:
+                sentences.append(self._buffer[start:match.end()].strip()) ## keep the closing quote or bracket
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        if deferred is not None:
+            self._scanned = deferred - start ## look at the same match again, however much whitespace it had
+        else:
+            self._scanned = len(self._buffer.rstrip('"\')]')) ## closing quotes may still be followed by a space
+        return [sentence for sentence in sentences if sentence]
+
+    def flush(self):
+        rest, self._buffer, self._scanned = self._buffer.strip(), '', 0
+        return [rest] if rest else []
+
+
+def traced_synthesize(parent, llm_client, text, model, voice):
+    with tracing.start_span("tts", parent=parent, chars=len(text)):
+        return synthesize(llm_client, text, model, voice)
+
+
+class SpeechPipeline:
+    """
+    Feed it the token stream; every finished sentence is sent to TTS straight away, several at a time.
+
+    poll() returns the clips that are ready, always in sentence order, without waiting. close() flushes the last
+    sentence and yields the remaining clips in order as they finish. `first_audio_seconds` is the time from the
+    pipeline's creation to the first clip being ready - the delay before the user hears anything.
+    """
+
+    def __init__(self, llm_client, model=TTS_MODEL, voice=TTS_VOICE, min_chars=MIN_SENTENCE_CHARS, executor=None):
+        self.llm_client = llm_client
+        self.model = model
+        self.voice = voice
+        self.executor = executor or tts_executor
+        self.segmenter = SentenceSegmenter(min_chars)
+        self.pending = deque()
+        self.sentences = []
+        self.started = time.monotonic()
+        self.first_audio_seconds = None
+        self.span = tracing.current_span() ## the turn the sentences belong to, when tracing
+
+    def _submit(self, sentences):
+        for sentence in sentences:
+            self.sentences.append(sentence)
+            if tracing.enabled():
+                self.pending.append(self.executor.submit(traced_synthesize, self.span, self.llm_client, sentence, self.model, self.voice))
+            else:
+                self.pending.append(self.executor.submit(synthesize, self.llm_client, sentence, self.model, self.voice))
+
+    def _ready(self, clip):
+        if self.first_audio_seconds is None:
+            self.first_audio_seconds = time.monotonic() - self.started
+        return clip
+
+    def feed(self, text):
+        self._submit(self.segmenter.feed(text))
+
+    def poll(self):
+        clips = []
+        while self.pending and self.pending[0].done():
+            clips.append(self._ready(self.pending.popleft().result()))
+        return clips
+
+    def close(self):
+        self._submit(self.segmenter.flush())
+        while self.pending:
+            yield self._ready(self.pending.popleft().result())
+
+
+### Runs in an invisible components.html frame per clip. The queue and the audio element live on the app's page
+### (the frame shares its origin), so they outlive the frames and play the reply's clips back to back, in order.
+PLAYER_SCRIPT = """<script>
+(function () {
+    const page = window.parent;
+    const replies = page.__chatbotReplies = page.__chatbotReplies || {};
+    const reply = replies["%(reply)s"] = replies["%(reply)s"] || {next: 0, clips: {}, playing: false};
+    reply.clips[%(index)d] = "data:audio/mpeg;base64,%(data)s";
+    if (!reply.play) {
+        reply.audio = new page.Audio();
+        reply.play = new page.Function("reply", `
+            if (reply.playing || !(reply.next in reply.clips)) return;
+            reply.playing = true;
+            reply.audio.src = reply.clips[reply.next];
+            delete reply.clips[reply.next];
+            reply.next += 1;
+            reply.audio.play().catch(() => { reply.playing = false; });
+        `);
+        reply.audio.addEventListener("ended", new page.Function("reply", "return () => { reply.playing = false; reply.play(reply); }")(reply));
+    }
+    reply.play(reply);
+})();
+</script>"""
+
+
+class ReplyPlayer:
+    """
+    Plays a reply's sentence clips one after the other as they arrive, instead of one audio player per sentence.
+
+    `render` is streamlit.components.v1.html - every clip is handed to the page in a zero height frame that queues it
+    on one shared audio element. recording() is the whole reply in one clip, to show a single st.audio for replaying.
+    """
+
+    def __init__(self, render):
+        self.render = render
+        self.reply_id = uuid.uuid4().hex
+        self.clips = []
+
+    def add(self, clip):
+        audio = clip.getvalue()
+        self.render(PLAYER_SCRIPT % {"reply": self.reply_id, "index": len(self.clips), "data": base64.b64encode(audio).decode('ascii')}, height=0)
+        self.clips.append(audio)
+
+    def recording(self):
+        return b''.join(self.clips) ## mp3 frames can simply be concatenated
+
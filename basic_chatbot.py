@@ -1,7 +1,6 @@
-from openai import OpenAI
 import streamlit as st
+import streamlit.components.v1 as components
 from audio_recorder_streamlit import audio_recorder
-from gtts import gTTS
 import os
 from io import BytesIO
 from dotenv import load_dotenv
@@ -9,18 +8,17 @@ import base64
 import tempfile
 # Load dotenv for picking up creds from .env
 load_dotenv()
+from advanced_chatbot.clients import get_openai_client
+from advanced_chatbot.memory import ConversationMemory
+from advanced_chatbot.audio_io import transcribe
+from advanced_chatbot.render import StreamRenderer
+from advanced_chatbot.voice import ReplyPlayer, SpeechPipeline
 
 def encode_image(image):
     return base64.b64encode(image).decode('utf-8')
 
-TEMP_AUDIOFILENAME = 'audio_temp.mp3'
-
 ### Language - change for accuracy with ASR and TTS
 language='en'
-### ensure your .env file has the api key (e.g. OPENAI_KEY='your openai key')
-llm_client = OpenAI(
-    api_key=os.getenv("OPENAI_KEY")
-    )
 
 st.title("💬 LLM, ASR & TTS Chatbot")
 st.caption("🚀 A chatbot powered by OpenAI LLM, GPT4-vision, OpenAI Whisper and OpenAI TTS - BASIC")
@@ -37,13 +35,16 @@ if AI_MODEL == 'gpt-4-vision-preview':
 if not os.getenv("OPENAI_KEY"): ## Check to see if we have the openai key set or else send back a message
     st.info("Please save your OpenAI API in the .env file in order to continue.")
     st.stop()
+### ensure your .env file has the api key (e.g. OPENAI_KEY='your openai key')
+### One client for the whole process - Streamlit reruns this script on every click, so it mustn't open a new connection pool each time
+llm_client = get_openai_client()
     
 ### Load the memory in the session state if it is not already there
 if "memory" not in st.session_state:
 ### Set some system and assistant prompts
-    st.session_state["memory"] = [
+    st.session_state["memory"] = ConversationMemory([
         {"role": "system", "content": "You're a helpful assistant that answers in pirate language."},
-        ]
+        ])
 ### Display our messages in the memory
 for msg in st.session_state.memory:
     st.chat_message(msg["role"]).write(msg["content"])
@@ -56,14 +57,9 @@ AUDIO_INPUT = False
 audio_bytes = audio_recorder(pause_threshold=180)
 if audio_bytes:
     st.audio(audio_bytes, format="audio/mp3")
-    # save audio file to mp3
-    with open(TEMP_AUDIOFILENAME, "wb") as f:
-        f.write(audio_bytes)
-    # load the file
-    audio_file = open(TEMP_AUDIOFILENAME, "rb")
-    # transcribe and set it as the chat input
+    # transcribe the recording straight from memory and set it as the chat input
     AUDIO_INPUT = True
-    CHAT_INPUT = llm_client.audio.transcriptions.create(model="whisper-1", file=audio_file, language=language).text
+    CHAT_INPUT = transcribe(llm_client, audio_bytes, language=language)
     
 
 ### Start processing...
@@ -87,29 +83,28 @@ if prompt := CHAT_INPUT: ## If we have an input
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
             ## Call openai with the memory in order to get a response
-            response = llm_client.chat.completions.create(model=AI_MODEL,messages=st.session_state.memory,temperature=0.7,stream=True,max_tokens=300)  # Basic Response Stream
-            PLACEHOLDER = st.empty() # create an empty placeholder to gather the tokens
-            counter = 0
-            FULL_RESPONSE = '' # create an empty string to keep the full response
+            RENDER = StreamRenderer(st.empty()) # an empty placeholder that is redrawn a few times a second as the tokens arrive
+            response = llm_client.chat.completions.create(model=AI_MODEL,messages=st.session_state.memory.build_prompt(AI_MODEL),temperature=0.7,stream=True,max_tokens=300)  # Basic Response Stream
+            SPEECH = SpeechPipeline(llm_client) if AUDIO_INPUT else None # speak each sentence as soon as it is written
+            PLAYER = ReplyPlayer(components.html) if AUDIO_INPUT else None # one audio element plays the sentences back to back
             
             for delta in response: # Go through the generator
                 token = delta.choices[0].delta
                 if token.content: # If the delta has content...
-                    FULL_RESPONSE += token.content ## Add the delta to the full response
-                    PLACEHOLDER.markdown(FULL_RESPONSE) ## Add to the placeholder
+                    RENDER.write(token.content) ## Add the delta to the full response - it is drawn when the renderer's time is up
+                    if SPEECH:
+                        SPEECH.feed(token.content)
+                        for clip in SPEECH.poll(): ## clips that are ready, in sentence order - queued to play as soon as the last one ends
+                            PLAYER.add(clip)
                     
-            PLACEHOLDER.markdown(FULL_RESPONSE) ## Finally update one last time
+            FULL_RESPONSE = RENDER.close() ## Finally update one last time
+            st.caption(f"Prompt: {st.session_state.memory.last_prompt_tokens} tokens, {st.session_state.memory.last_dropped} older messages left out - first words after {RENDER.first_paint_seconds:.2f}s, {RENDER.renders} redraws") ## How big the request was and how it streamed
             
             # Add our bot response to the memory.
             st.session_state.memory.append({"role":"assistant","content": FULL_RESPONSE})
             
-            # Play back audio
-            if AUDIO_INPUT:
-                tts = llm_client.audio.speech.create(
-                    model='tts-1',
-                    voice='fable',
-                    input=FULL_RESPONSE
-                )
-                tts.stream_to_file(TEMP_AUDIOFILENAME)  # Stream to the temporary file
-                
-                st.audio(open(TEMP_AUDIOFILENAME,'rb').read(), format='audio/mp3')
\ No newline at end of file
+            # Play back the rest of the audio - the sentences still being synthesized, in order
+            if SPEECH:
+                for clip in SPEECH.close():
+                    PLAYER.add(clip)
+                st.audio(PLAYER.recording(), format='audio/mp3') # and the whole reply in a single player, to listen again
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+Hit rate and latency of the semantic answer cache in front of chat_llm, against the local stub API.
+
+    python -m benchmarks.answer_cache --users 8 --requests 25 --topics 40
+
+Every simulated user asks questions drawn from --topics topics with a Zipf-like skew (a few questions are asked a
+lot), each written in one of a few trivially different ways (case, punctuation, spacing) and answered from the
+knowledge base, since only those answers are cached. The stub's embeddings only look at the words, so those
+re-wordings match while questions about different topics (one word apart) stay below the threshold - real embeddings
+also match genuine paraphrases. Halfway through the knowledge base manifest
+gets a new version, as if the books had been re-indexed, which empties the cache.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.stub_openai import StubOpenAI
+from benchmarks.suite import run_users, summarize
+
+WORDINGS = ["{}", "{}?", "{} ?", "  {}!"]
+
+
+def write_manifest(path, version):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({"version": version, "files": {}}, file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=25, help='questions per user')
+    parser.add_argument('--topics', type=int, default=40)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of the topic popularity')
+    parser.add_argument('--delay', type=float, default=0.05)
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--threshold', type=float, default=0.95)
+    parser.add_argument('--embeddings', default='./documents_embeddings.csv')
+    args = parser.parse_args()
+
+    stub = StubOpenAI(delay=args.delay, tokens_per_second=args.tokens_per_second).start()
+    folder = tempfile.mkdtemp()
+    manifest = os.path.join(folder, 'books_manifest.json')
+    write_manifest(manifest, 'v1')
+    try:
+        os.environ['OPENAI_BASE_URL'] = stub.base_url
+        os.environ['OPENAI_KEY'] = 'stub'
+        os.environ['KB_QUERY_CACHE'] = ''
+        os.environ['KB_BACKEND'] = 'numpy'
+        os.environ['KB_EMBEDDINGS_PATH'] = args.embeddings
+        from advanced_chatbot import chat_llm
+        from advanced_chatbot.answer_cache import ManifestVersion, SemanticAnswerCache
+        from advanced_chatbot.clients import get_openai_client
+        from advanced_chatbot.search_kb import query_cache
+        cache = SemanticAnswerCache(
+            embed=lambda text: query_cache.embed(get_openai_client(), text, model="text-embedding-ada-002"),
+            threshold=args.threshold, version=ManifestVersion(manifest)
+        )
+
+        weights = 1 / np.arange(1, args.topics + 1) ** args.skew
+        weights /= weights.sum()
+        total = args.users * args.requests
+
+        def work(user, number):
+            rng = np.random.default_rng(user * 100003 + number)
+            topic = rng.choice(args.topics, p=weights)
+            question = WORDINGS[rng.integers(len(WORDINGS))].format(f"kb: What does book {topic} say about justice") ## the stub calls search_kb
+            if user == 0 and number == args.requests // 2:
+                write_manifest(manifest, 'v2') ## the books were re-indexed
+            hits_before = cache.hits
+            start = time.perf_counter()
+            answer = ''.join(str(token) for token in chat_llm('gpt-3.5-turbo', [{"role": "user", "content": question}], answer_cache=cache))
+            return {'latency': time.perf_counter() - start, 'hit': cache.hits > hits_before, 'chars': len(answer)}
+
+        results, errors, wall = run_users(args.users, args.requests, work)
+        completions = stub.calls['POST /chat/completions']
+    finally:
+        stub.stop()
+
+    ### `hit` is only approximate under concurrency (another user's hit can land in between), the cache's own counters are exact
+    report = {
+        'questions': total,
+        'errors': errors,
+        'wall_seconds': round(wall, 3),
+        'cache': cache.stats(),
+        'completion_requests': completions,
+        'completion_requests_saved': f"{1 - completions / total:.1%}",
+        'hit_latency': summarize([result['latency'] for result in results if result['hit']]),
+        'miss_latency': summarize([result['latency'] for result in results if not result['hit']]),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
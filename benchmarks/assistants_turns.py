@@ -0,0 +1,77 @@
+"""
+API calls and end-of-run latency per turn of the Assistants chatbot, against the local stub.
+
+    python -m benchmarks.assistants_turns --turns 3 --run-seconds 1.2
+
+legacy   - what chatbot_assistants.py used to do on every rerun: list the assistants, create a thread, list its
+           messages, add the user message, start a run, poll it once a second and list the messages again
+polled   - cached assistant id and one thread, run started with the message and polled with backoff
+streamed - cached assistant id and one thread, one streamed run per turn (what the app does now)
+
+"late by" is how long after the run finished each flow had the answer in hand. Calls per turn include the
+one-off assistant lookup and thread creation, spread over the turns.
+"""
+import argparse
+import json
+import time
+import warnings
+from openai import OpenAI
+from advanced_chatbot.assistants import find_or_create_assistant, poll_reply, stream_reply
+from benchmarks.stub_openai import StubOpenAI
+
+NAME = 'Socrates'
+INSTRUCTIONS = 'You are the philosopher Socrates.'
+
+
+def legacy_turn(llm_client, prompt):
+    assistant_id = next((item.id for item in llm_client.beta.assistants.list() if item.name == NAME), None)
+    if not assistant_id:
+        assistant_id = llm_client.beta.assistants.create(name=NAME, instructions=INSTRUCTIONS, tools=[], model="gpt-3.5-turbo-1106").id
+    thread = llm_client.beta.threads.create()
+    llm_client.beta.threads.messages.list(thread_id=thread.id)
+    llm_client.beta.threads.messages.create(thread_id=thread.id, role='user', content=prompt)
+    run = llm_client.beta.threads.runs.create(thread_id=thread.id, assistant_id=assistant_id)
+    while llm_client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id).status != 'completed':
+        time.sleep(1)
+    return llm_client.beta.threads.messages.list(thread_id=thread.id).data[0].content[0].text.value
+
+
+def run_flow(flow, turns, run_seconds):
+    with StubOpenAI(run_seconds=run_seconds) as stub:
+        llm_client = OpenAI(api_key='stub', base_url=stub.base_url)
+        assistant_id = thread_id = None
+        late = []
+        for turn in range(turns):
+            prompt = f'Question number {turn}?'
+            start = time.perf_counter()
+            if flow == 'legacy':
+                answer = legacy_turn(llm_client, prompt)
+            else:
+                if assistant_id is None:
+                    assistant_id = find_or_create_assistant(llm_client, NAME, INSTRUCTIONS)
+                    thread_id = llm_client.beta.threads.create().id
+                reply = stream_reply if flow == 'streamed' else poll_reply
+                answer = ''.join(reply(llm_client, thread_id, assistant_id, prompt))
+            late.append(time.perf_counter() - start - run_seconds)
+            assert prompt in answer, answer
+        calls = sum(stub.calls.values())
+    return {
+        'calls_per_turn': round(calls / turns, 2),
+        'late_by_mean_s': round(sum(late) / turns, 3),
+        'late_by_max_s': round(max(late), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--run-seconds', type=float, default=1.2, help='how long each assistant run takes')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore', DeprecationWarning) ## the Assistants API is marked deprecated in newer SDKs
+
+    report = {flow: run_flow(flow, args.turns, args.run_seconds) for flow in ('legacy', 'polled', 'streamed')}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
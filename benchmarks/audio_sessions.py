@@ -0,0 +1,87 @@
+"""
+Load test for the chat apps' audio path: many sessions record, transcribe and play back at the same time.
+
+    python -m benchmarks.audio_sessions --sessions 32 --rounds 5
+    python -m benchmarks.audio_sessions --legacy   ## the old shared audio_temp.mp3 flow, for comparison
+
+Every session "records" a fake mp3 of its own sentence and replies with its own text; the stub API transcribes
+a fake mp3 back into the text it was made from. A session that gets back someone else's words counts as cross-talk.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+from advanced_chatbot.audio_io import synthesize, transcribe
+from benchmarks.stub_openai import StubOpenAI
+
+
+def legacy_round(llm_client, audio_bytes, reply, temp_path):
+    """
+    What the apps used to do: one shared file for the recording and the reply.
+    """
+    with open(temp_path, "wb") as f:
+        f.write(audio_bytes)
+    with open(temp_path, "rb") as audio_file:
+        heard = llm_client.audio.transcriptions.create(model="whisper-1", file=audio_file, language='en').text
+    llm_client.audio.speech.create(model='tts-1', voice='fable', input=reply).stream_to_file(temp_path)
+    with open(temp_path, 'rb') as f:
+        played = f.read()
+    return heard, played
+
+
+def session(llm_client, number, rounds, legacy, temp_path):
+    crosstalk = 0
+    errors = 0
+    for round_number in range(rounds):
+        said = f"session {number} round {round_number} asks a question"
+        reply = f"session {number} round {round_number} gets an answer"
+        try:
+            if legacy:
+                heard, played = legacy_round(llm_client, b'ID3' + said.encode('utf-8'), reply, temp_path)
+            else:
+                heard = transcribe(llm_client, b'ID3' + said.encode('utf-8'))
+                played = synthesize(llm_client, reply).getvalue()
+        except Exception: ## e.g. the shared file was truncated by another session while being uploaded
+            errors += 1
+            continue
+        crosstalk += (heard != said) + (played != b'ID3' + reply.encode('utf-8'))
+    return crosstalk, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=0.01, help='latency of every stub request')
+    parser.add_argument('--legacy', action='store_true', help='use the old shared temp file flow')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore', DeprecationWarning) ## stream_to_file in the legacy flow
+
+    with tempfile.TemporaryDirectory() as folder, StubOpenAI(delay=args.delay) as stub:
+        llm_client = OpenAI(api_key='stub', base_url=stub.base_url, max_retries=0)
+        temp_path = os.path.join(folder, 'audio_temp.mp3')
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            results = list(pool.map(
+                lambda number: session(llm_client, number, args.rounds, args.legacy, temp_path), range(args.sessions)
+            ))
+        seconds = time.perf_counter() - start
+        files_left = os.listdir(folder)
+    print(json.dumps({
+        'mode': 'legacy shared file' if args.legacy else 'in-memory',
+        'sessions': args.sessions,
+        'rounds': args.rounds,
+        'exchanges': args.sessions * args.rounds,
+        'crosstalk': sum(crosstalk for crosstalk, _ in results),
+        'errors': sum(errors for _, errors in results),
+        'files_written': len(files_left),
+        'seconds': round(seconds, 3),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark the streaming chunker on a large synthetic corpus and check it against LangChain.
+
+    python -m benchmarks.chunker --mb 300 --files 16
+
+The corpus is books/theodyssey.txt shuffled paragraph-wise and repeated until it reaches the requested size.
+LangChain's splitter (the notebook's settings) is run on the first file only - on hundreds of MB it takes far too
+long and needs the whole text in memory - and its chunks must match the streaming chunker's exactly.
+
+Memory is reported per part, each measured in its own process so nothing else inflates it: `streaming_peak_rss_mb`
+is iter_file_chunks on the biggest file, `pool_worker_peak_rss_mb` the largest chunk_files worker and
+`parent_peak_rss_mb` this process (which also ran LangChain on the sample).
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from advanced_chatbot.chunker import CHUNK_OVERLAP, CHUNK_SIZE, chunk_files, iter_file_chunks
+
+
+def write_corpus(directory, total_mb, files, seed=0):
+    with open('./books/theodyssey.txt', 'r', encoding='UTF-8') as file:
+        paragraphs = file.read().split('\n\n')
+    rng = random.Random(seed)
+    per_file = total_mb * 1024 * 1024 // files
+    paths = []
+    for n in range(files):
+        path = os.path.join(directory, f'book_{n:03d}.txt')
+        written = 0
+        with open(path, 'w', encoding='UTF-8') as file:
+            while written < per_file:
+                block = '\n\n'.join(rng.sample(paragraphs, len(paragraphs))) + '\n\n'
+                file.write(block)
+                written += len(block.encode('utf-8'))
+        paths.append(path)
+    return paths
+
+
+def streaming_peak_rss_mb(path):
+    """
+    Peak RSS of a fresh interpreter that streams every chunk of `path` with iter_file_chunks, minus the interpreter
+    with the chunker imported and tiktoken loaded but nothing chunked yet.
+    """
+    code = (
+        "import resource, sys\n"
+        "from advanced_chatbot.chunker import count_tokens, iter_file_chunks\n"
+        "count_tokens(['warm up'])\n"
+        "baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "chunks = sum(1 for _ in iter_file_chunks(sys.argv[1]))\n"
+        "print(baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+    )
+    output = subprocess.run([sys.executable, '-c', code, path], capture_output=True, text=True, check=True).stdout
+    baseline, peak = (int(value) for value in output.split()[-2:])
+    return round(peak / 1024, 1), round((peak - baseline) / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mb', type=int, default=300, help='corpus size in MB')
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, args.mb, args.files)
+        sample = paths[0]
+        sample_mb = os.path.getsize(sample) / 1024 / 1024
+
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
+        start = time.perf_counter()
+        with open(sample, 'r', encoding='UTF-8') as file:
+            expected = text_splitter.split_text(file.read())
+        langchain_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        streamed = list(iter_file_chunks(sample))
+        streaming_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chunks = sum(sum(1 for _ in file_chunks) for _, file_chunks in chunk_files(paths, max_workers=args.workers))
+        corpus_seconds = time.perf_counter() - start
+        pool_worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss ## the pool has exited - read it before any other child runs
+
+        biggest = max(paths, key=os.path.getsize)
+        streaming_rss, streaming_growth = streaming_peak_rss_mb(biggest)
+
+        report = {
+            'sample_mb': round(sample_mb, 1),
+            'identical_to_langchain': streamed == expected,
+            'langchain_mb_per_s': round(sample_mb / langchain_seconds, 2),
+            'streaming_mb_per_s': round(sample_mb / streaming_seconds, 2),
+            'corpus_mb': args.mb,
+            'corpus_files': args.files,
+            'corpus_chunks': chunks,
+            'corpus_seconds': round(corpus_seconds, 2),
+            'corpus_mb_per_s': round(args.mb / corpus_seconds, 2),
+            'biggest_file_mb': round(os.path.getsize(biggest) / 1024 / 1024, 1),
+            'streaming_peak_rss_mb': streaming_rss,
+            'streaming_rss_growth_mb': streaming_growth,
+            'pool_worker_peak_rss_mb': round(pool_worker_rss / 1024, 1),
+            'parent_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
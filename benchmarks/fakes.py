@@ -0,0 +1,27 @@
+"""
+Local fakes for the services the skills talk to, so benchmarks don't depend on the network.
+"""
+import threading
+import time
+from collections import Counter
+
+
+class FakeSearchProvider:
+    """
+    Stands in for DuckDuckGo - same text(query, max_results) method as advanced_chatbot.search_internet.DDGSProvider.
+    Sleeps `delay` seconds per search and counts the searches it was asked to run.
+    """
+
+    def __init__(self, delay=0.3):
+        self.delay = delay
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def text(self, query, max_results):
+        with self._lock:
+            self.calls[query] += 1
+        time.sleep(self.delay)
+        return [
+            {'title': f'Result {n} for {query}', 'body': f'Snippet {n} about {query}.', 'href': f'https://example.com/{n}'}
+            for n in range(max_results)
+        ]
@@ -0,0 +1,72 @@
+"""
+Run the ingestion pipeline end to end against the local stub API and an in-memory Qdrant.
+
+    python -m benchmarks.ingest_stub --delay 0.2 --concurrency 8
+
+The run is done twice: the second pass must skip every chunk thanks to the checkpoint. A third run goes into a sink
+whose upserts always fail, and must end with that error instead of hanging.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+from openai import AsyncOpenAI
+from advanced_chatbot.ingest import Checkpoint, QdrantSink, ingest, load_documents
+from benchmarks.stub_openai import StubOpenAI
+
+
+class FailingSink:
+    def upsert(self, points):
+        raise RuntimeError('upsert failed')
+
+
+async def failing_run(documents, llm_client, checkpoint, timeout=30):
+    """
+    What a broken vector database does to a run: the upsert error, or 'hung' if it never came back.
+    """
+    try:
+        await asyncio.wait_for(ingest(documents, FailingSink(), llm_client, checkpoint, batch_size=2,
+                                      upsert_batch_size=4, concurrency=2), timeout)
+    except asyncio.TimeoutError:
+        return 'hung'
+    except RuntimeError as err:
+        return str(err)
+    return 'no error'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', default='./documents.csv')
+    parser.add_argument('--delay', type=float, default=0.2, help='stub latency per embeddings request')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--upsert-batch-size', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    documents = load_documents(args.documents)
+    with StubOpenAI(delay=args.delay) as stub, tempfile.TemporaryDirectory() as tmp:
+        sink = QdrantSink(':memory:')
+        sink.ensure_collection()
+        checkpoint = Checkpoint(os.path.join(tmp, 'checkpoint.jsonl'))
+        llm_client = AsyncOpenAI(api_key='stub', base_url=stub.base_url)
+        options = dict(batch_size=args.batch_size, upsert_batch_size=args.upsert_batch_size,
+                       concurrency=args.concurrency)
+
+        first = asyncio.run(ingest(documents, sink, llm_client, checkpoint, **options))
+        resumed = asyncio.run(ingest(documents, sink, llm_client, checkpoint, **options))
+        failing = asyncio.run(failing_run(documents[:200], AsyncOpenAI(api_key='stub', base_url=stub.base_url),
+                                          Checkpoint(os.path.join(tmp, 'failing.jsonl'))))
+        report = {
+            'chunks': len(documents),
+            'first_run': first,
+            'resumed_run': resumed,
+            'failing_sink': failing,
+            'points_in_collection': sink.client.count(sink.collection_name).count,
+            'stub_calls': dict(stub.calls),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
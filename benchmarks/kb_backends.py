@@ -0,0 +1,97 @@
+"""
+Compare the in-process NumPy index with the Qdrant collection used by search_kb.
+
+    python -m benchmarks.kb_backends --queries 200
+
+Queries are the stored chunk embeddings with a little gaussian noise added, so no OpenAI key is needed.
+The Qdrant half only runs when VECTORDB_ENDPOINT is set in .env; recall@k is measured against Qdrant's results
+(hits are matched on their text since the notebook import numbered the points from 2).
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+from advanced_chatbot.vector_index import NumpyIndex
+
+load_dotenv()
+
+
+def percentile_ms(samples, pct):
+    return round(float(np.percentile(samples, pct)) * 1000, 4)
+
+
+def make_queries(index, count, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(index), size=count)
+    return np.asarray(index.vectors[rows], dtype=np.float32) + rng.normal(0, noise, size=(count, index.vectors.shape[1])).astype(np.float32)
+
+
+def time_searches(search, queries, limit):
+    timings = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query, limit))
+        timings.append(time.perf_counter() - start)
+    return results, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', default='./documents_embeddings.csv', help='the CSV or a binary store directory')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=0.01)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = NumpyIndex.load(args.embeddings)
+    load_seconds = time.perf_counter() - start
+    queries = make_queries(index, args.queries, args.noise)
+
+    numpy_results, numpy_timings = time_searches(lambda q, k: index.search(q, limit=k), queries, args.limit)
+    start = time.perf_counter()
+    index.search_batch(queries, limit=args.limit)
+    batch_seconds = time.perf_counter() - start
+
+    report = {
+        'chunks': len(index),
+        'queries': args.queries,
+        'limit': args.limit,
+        'numpy': {
+            'load_s': round(load_seconds, 4),
+            'p50_ms': percentile_ms(numpy_timings, 50),
+            'p99_ms': percentile_ms(numpy_timings, 99),
+            'batched_ms_per_query': round(batch_seconds / args.queries * 1000, 4),
+        },
+    }
+
+    if os.getenv('VECTORDB_ENDPOINT'):
+        from qdrant_client import QdrantClient
+        qdrant_client = QdrantClient(url=os.getenv('VECTORDB_ENDPOINT'), api_key=os.getenv('VECTORDB_KEY'))
+        qdrant_results, qdrant_timings = time_searches(
+            lambda q, k: qdrant_client.search(collection_name="books", query_vector=q.tolist(), limit=k),
+            queries, args.limit)
+        overlap = [
+            len({hit.payload['text'] for hit in ours} & {hit.payload['text'] for hit in theirs}) / max(len(theirs), 1)
+            for ours, theirs in zip(numpy_results, qdrant_results)
+        ]
+        report['qdrant'] = {
+            'p50_ms': percentile_ms(qdrant_timings, 50),
+            'p99_ms': percentile_ms(qdrant_timings, 99),
+        }
+        report['numpy'][f'recall@{args.limit}_vs_qdrant'] = round(float(np.mean(overlap)), 4)
+    else:
+        report['qdrant'] = 'skipped - set VECTORDB_ENDPOINT to compare'
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
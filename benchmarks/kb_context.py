@@ -0,0 +1,57 @@
+"""
+Prompt tokens for search_kb's context: the old str(hits) + gptrim.trim against the new build_context().
+
+    python -m benchmarks.kb_context --queries 100
+
+Hits come from the in-process NumPy index (queries are stored chunk embeddings plus a little noise, so no OpenAI key
+is needed) and are wrapped in qdrant_client's ScoredPoint so the "before" text is exactly what the Qdrant backend produced.
+"""
+import argparse
+import json
+import numpy as np
+from gptrim import trim
+from qdrant_client.models import ScoredPoint
+from advanced_chatbot.kb_context import build_context
+from advanced_chatbot.memory import get_encoding
+from advanced_chatbot.vector_index import NumpyIndex
+from benchmarks.kb_backends import make_queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', default='./documents_embeddings.csv', help='the CSV or a binary store directory')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=0.01)
+    parser.add_argument('--max-tokens', type=int, default=None, help='context budget (defaults to KB_CONTEXT_TOKENS)')
+    args = parser.parse_args()
+
+    encoding = get_encoding()
+    index = NumpyIndex.load(args.embeddings)
+    before = []
+    after = []
+    raw = []
+    for query in make_queries(index, args.queries, args.noise):
+        hits = [
+            ScoredPoint(id=hit.id, version=0, score=hit.score, payload=hit.payload, vector=None)
+            for hit in index.search(query, limit=args.limit)
+        ]
+        before.append(len(encoding.encode(trim(str(hits)))))
+        after.append(len(encoding.encode(build_context(hits, max_tokens=args.max_tokens))))
+        raw.append(sum(len(encoding.encode(hit.payload["text"])) for hit in hits))
+
+    report = {
+        'queries': args.queries,
+        'limit': args.limit,
+        'chunk_text_tokens_mean': round(float(np.mean(raw)), 1),
+        'before_tokens_mean': round(float(np.mean(before)), 1),
+        'before_tokens_p99': float(np.percentile(before, 99)),
+        'after_tokens_mean': round(float(np.mean(after)), 1),
+        'after_tokens_p99': float(np.percentile(after, 99)),
+        'saving': f"{1 - np.mean(after) / np.mean(before):.1%}",
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+int8 and binary quantization against the exact float32 search search_kb does today.
+
+    python -m benchmarks.quantization --chunks 200000 --queries 200
+
+The corpus is documents_embeddings.csv, grown to --chunks rows by blending random pairs of the real vectors (so it
+keeps ada-002's shape without piling up near-identical copies); queries are stored vectors plus a little noise, as
+in benchmarks/kb_backends.py. For every
+configuration the report has the in-memory size per million chunks, queries/second and recall@k against the exact
+top k. The "rerank" rows re-score `k * oversample` candidates with the full vectors; "coarse" rows are the codes alone.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from advanced_chatbot.quantize import QuantizedIndex
+from advanced_chatbot.vector_index import NumpyIndex
+from benchmarks.kb_backends import make_queries
+
+
+def grow(index, chunks, noise, seed=1):
+    if chunks <= len(index):
+        return index
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(index.vectors, dtype=np.float32)
+    rows = rng.integers(0, len(index), size=(chunks - len(index), 2))
+    weights = rng.uniform(0, 1, size=(len(rows), 1)).astype(np.float32)
+    extra = weights * vectors[rows[:, 0]] + (1 - weights) * vectors[rows[:, 1]]
+    extra += rng.normal(0, noise, size=extra.shape).astype(np.float32)
+    payloads = list(index.payloads) + [index.payloads[row] for row in rows[:, 0].tolist()]
+    vectors = np.concatenate([vectors, extra])
+    return NumpyIndex(vectors, payloads)
+
+
+def measure(search, queries, limit, exact):
+    start = time.perf_counter()
+    results = [search(query, limit) for query in queries]
+    seconds = time.perf_counter() - start
+    recall = [
+        len({hit.id for hit in ours} & {hit.id for hit in theirs}) / max(len(theirs), 1)
+        for ours, theirs in zip(results, exact)
+    ]
+    return round(len(queries) / seconds, 1), round(float(np.mean(recall)), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', default='./documents_embeddings.csv', help='the CSV or a binary store directory')
+    parser.add_argument('--chunks', type=int, default=200000, help='grow the corpus to this many chunks')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=0.01, help='noise added to the queries')
+    parser.add_argument('--spread', type=float, default=0.005, help='noise added to the blended vectors that grow the corpus')
+    parser.add_argument('--oversample', type=float, nargs='+', default=[4, 20])
+    args = parser.parse_args()
+
+    index = grow(NumpyIndex.load(args.embeddings), args.chunks, args.spread)
+    queries = make_queries(index, args.queries, args.noise)
+    per_million = 1e6 / len(index) / 2 ** 20 ## bytes for this corpus -> MiB per million chunks
+
+    start = time.perf_counter()
+    exact = [index.search(query, args.limit) for query in queries]
+    report = {
+        'chunks': len(index),
+        'queries': args.queries,
+        'limit': args.limit,
+        'float32': {
+            'mib_per_million': round(index.vectors.nbytes * per_million, 1),
+            'queries_per_second': round(args.queries / (time.perf_counter() - start), 1),
+            'recall': 1.0,
+        },
+    }
+    for mode in ('int8', 'binary'):
+        start = time.perf_counter()
+        quantized = QuantizedIndex(index, mode=mode, rerank=False)
+        build_seconds = time.perf_counter() - start
+        configurations = [('coarse', False, 1)] + [(f'rerank_x{oversample:g}', True, oversample) for oversample in args.oversample]
+        for name, rerank, oversample in configurations:
+            quantized.rerank, quantized.oversample = rerank, oversample
+            qps, recall = measure(quantized.search, queries, args.limit, exact)
+            report[f'{mode}_{name}'] = {
+                'mib_per_million': round(quantized.memory_bytes() * per_million, 1),
+                'queries_per_second': qps,
+                'recall': recall,
+                'build_s': round(build_seconds, 2),
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Exercise search_internet's TTL cache and single-flight coalescing against a fake search provider.
+
+    python -m benchmarks.search_internet_fake --users 20 --delay 0.3
+
+N simulated users ask the same (differently capitalised) question at the same moment, then ask it again.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from advanced_chatbot.search_internet import inflight, results_cache, search_internet
+from benchmarks.fakes import FakeSearchProvider
+
+
+def burst(provider, users, query):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(lambda n: search_internet(query.upper() if n % 2 else query, provider=provider), range(users)))
+    return round(time.perf_counter() - start, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--delay', type=float, default=0.3, help='fake search latency in seconds')
+    args = parser.parse_args()
+
+    provider = FakeSearchProvider(delay=args.delay)
+    results_cache.clear()
+    query = 'What happened at the Olympics today?'
+    cold = burst(provider, args.users, query)
+    searches_after_cold = sum(provider.calls.values())
+    warm = burst(provider, args.users, query)
+    report = {
+        'users': args.users,
+        'provider_delay_s': args.delay,
+        'cold_burst_s': cold,
+        'warm_burst_s': warm,
+        'provider_searches': sum(provider.calls.values()),
+        'searches_after_cold_burst': searches_after_cold,
+        'coalesced_calls': inflight.shared,
+        'cache': results_cache.stats(),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
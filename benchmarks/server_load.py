@@ -0,0 +1,176 @@
+"""
+Load test of the streaming API server (advanced_chatbot/server.py) against the local stub API.
+
+    python -m benchmarks.server_load --users 200 --turns 3 --workers 2
+
+Starts the stub and the server (as a separate process with --workers workers), then every simulated user opens a
+session and sends --turns chat messages in it, every --kb-every-th one asking for the knowledge base skill, reading
+each answer as it streams. With --audio every turn also uploads a recording to /v1/transcribe and fetches the spoken
+answer from /v1/speech. A 503 (the server shedding load past --max-inflight streams per worker) is counted and retried
+after its Retry-After. The report has turns/second, time to first token and turn latency p50/p99, and the upstream
+concurrency the server allowed itself.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.stub_openai import StubOpenAI
+from benchmarks.suite import summarize
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(client, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get('/healthz')
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError('the server did not start')
+
+
+async def post(client, path, counters, **options):
+    """
+    POST that waits out a 503 like a well behaved client would.
+    """
+    while True:
+        response = await client.post(path, **options)
+        if response.status_code != 503:
+            response.raise_for_status()
+            return response
+        counters['rejected'] += 1
+        await asyncio.sleep(float(response.headers.get('retry-after', 1)))
+
+
+async def chat_turn(client, session_id, message, counters):
+    """
+    One streamed answer. Returns (session id, time to first token, latency) - or raises on an error event.
+    """
+    while True:
+        start = time.perf_counter()
+        first = None
+        async with client.stream('POST', '/v1/chat', json={'message': message, 'session_id': session_id}) as response:
+            if response.status_code == 503:
+                counters['rejected'] += 1
+                await asyncio.sleep(float(response.headers.get('retry-after', 1)))
+                continue
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith('event: '):
+                    event = line[7:]
+                elif line.startswith('data: '):
+                    data = json.loads(line[6:])
+                    if event == 'session':
+                        session_id = data['session_id']
+                    elif event == 'error':
+                        raise RuntimeError(data['error'])
+                    elif event == 'done':
+                        return session_id, first - start if first else None, time.perf_counter() - start
+                    elif first is None:
+                        first = time.perf_counter()
+                elif not line:
+                    event = None
+        raise RuntimeError('the stream ended without a done event')
+
+
+async def user(client, number, args, counters, results):
+    session_id = None
+    for turn in range(args.turns):
+        try:
+            if args.audio:
+                said = f'user {number} turn {turn} asks about Ulysses'
+                response = await post(client, '/v1/transcribe', counters, content=b'ID3' + said.encode('utf-8'), headers={'content-type': 'audio/mpeg'})
+                message = response.json()['text']
+            else:
+                message = f'user {number} turn {turn} asks about Ulysses'
+            if args.kb_every and turn % args.kb_every == args.kb_every - 1:
+                message = 'kb: ' + message
+            session_id, ttft, latency = await chat_turn(client, session_id, message, counters)
+            if args.audio:
+                await post(client, '/v1/speech', counters, json={'text': 'The answer, read out loud.'})
+            results.append({'ttft': ttft, 'latency': latency})
+        except Exception:
+            counters['errors'] += 1
+
+
+async def load(base_url, args):
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await wait_until_up(client)
+        counters = {'errors': 0, 'rejected': 0}
+        results = []
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client, number, args, counters, results) for number in range(args.users)))
+        wall = time.perf_counter() - start
+        health = (await client.get('/healthz')).json() ## one worker's view
+    return results, counters, wall, health
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='concurrent users, each with their own session')
+    parser.add_argument('--turns', type=int, default=3, help='chat messages per user')
+    parser.add_argument('--kb-every', type=int, default=2, help='every n-th message asks for search_kb (0 for never)')
+    parser.add_argument('--audio', action='store_true', help='also transcribe and speak every turn')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-inflight', type=int, default=256, help='streams per worker before it answers 503')
+    parser.add_argument('--openai-concurrency', type=int, default=64, help='requests each worker may have open against the API')
+    parser.add_argument('--delay', type=float, default=0.1, help='stub latency before the first byte of every request')
+    parser.add_argument('--tokens-per-second', type=float, default=100.0, help='stub chat streaming rate')
+    parser.add_argument('--reply-words', type=int, default=40)
+    parser.add_argument('--embeddings', default='./documents_embeddings.csv')
+    args = parser.parse_args()
+
+    stub = StubOpenAI(delay=args.delay, tokens_per_second=args.tokens_per_second, reply_words=args.reply_words).start()
+    port = free_port()
+    folder = tempfile.mkdtemp()
+    env = {
+        **os.environ,
+        'OPENAI_BASE_URL': stub.base_url, 'OPENAI_KEY': 'stub',
+        'KB_BACKEND': 'numpy', 'KB_EMBEDDINGS_PATH': args.embeddings, 'KB_QUERY_CACHE': '',
+        'SESSION_STORE': os.path.join(folder, 'sessions.sqlite'),
+        'SERVER_MAX_INFLIGHT': str(args.max_inflight),
+        'OPENAI_CONCURRENCY': str(args.openai_concurrency),
+        'HTTP_MAX_CONNECTIONS': str(args.openai_concurrency), 'HTTP_KEEPALIVE_CONNECTIONS': str(args.openai_concurrency),
+    }
+    server = subprocess.Popen([sys.executable, '-m', 'advanced_chatbot.server', '--port', str(port), '--workers', str(args.workers)],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        results, counters, wall, health = asyncio.run(load(f'http://127.0.0.1:{port}', args))
+        upstream_calls = dict(stub.calls)
+    finally:
+        server.terminate()
+        server.wait()
+        stub.stop()
+
+    report = {
+        'users': args.users,
+        'workers': args.workers,
+        'turns': len(results),
+        'errors': counters['errors'],
+        'rejected_503': counters['rejected'],
+        'wall_seconds': round(wall, 3),
+        'turns_per_second': round(len(results) / wall, 2) if wall else None,
+        'ttft': summarize([result['ttft'] for result in results if result['ttft'] is not None]),
+        'latency': summarize([result['latency'] for result in results]),
+        'upstream_calls': upstream_calls,
+        'upstreams_one_worker': health['upstreams'],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
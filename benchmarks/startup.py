@@ -0,0 +1,104 @@
+"""
+Cold start and per-rerun cost of the chatbot, with the shared clients against building everything every time.
+
+    python -m benchmarks.startup --runs 5 --reruns 50
+
+cold start   `import advanced_chatbot` in a fresh interpreter (median of --runs), next to the same import with the
+             heavy SDKs imported up front the way the package used to, and which of them the import actually loaded.
+per rerun    what a Streamlit rerun of advanced_chatbot.py pays before the model is called: a client, the skills and
+             one request. "fresh" builds a new OpenAI client, re-reads skills.json and connects again; "shared" uses
+             get_openai_client() and get_tools(). Requests go to the local stub over plain HTTP, so the TLS handshake
+             the shared pool saves against the real API isn't even counted here.
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from benchmarks.stub_openai import StubOpenAI
+
+HEAVY_MODULES = ['openai', 'qdrant_client', 'duckduckgo_search', 'gtts', 'gptrim']
+
+
+def import_seconds(preload, runs):
+    """
+    Median wall time of importing advanced_chatbot in a new interpreter, plus the heavy modules it ended up loading.
+    """
+    code = (
+        f"import time, sys; start = time.perf_counter()\n"
+        f"for name in {preload!r}:\n    __import__(name)\n"
+        f"import advanced_chatbot\n"
+        f"print(time.perf_counter() - start, [name for name in {HEAVY_MODULES!r} if name in sys.modules])"
+    )
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                env={**os.environ, 'OPENAI_KEY': 'stub'}).stdout.strip().splitlines()[-1]
+        seconds, loaded = output.split(' ', 1)
+        timings.append(float(seconds))
+        loaded = ast.literal_eval(loaded)
+    return round(float(np.median(timings)), 3), loaded
+
+
+def rerun_ms(rerun, reruns):
+    timings = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        rerun()
+        timings.append(time.perf_counter() - start)
+    return {'p50_ms': round(float(np.percentile(timings, 50)) * 1000, 2), 'p99_ms': round(float(np.percentile(timings, 99)) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per cold start measurement')
+    parser.add_argument('--reruns', type=int, default=50, help='simulated Streamlit reruns')
+    args = parser.parse_args()
+
+    lazy, loaded = import_seconds([], args.runs)
+    eager, _ = import_seconds(['openai', 'qdrant_client', 'duckduckgo_search', 'gptrim'], args.runs)
+
+    stub = StubOpenAI(delay=0).start()
+    try:
+        os.environ['OPENAI_BASE_URL'] = stub.base_url
+        os.environ['OPENAI_KEY'] = 'stub'
+        from openai import OpenAI
+        from advanced_chatbot.clients import get_openai_client
+        from advanced_chatbot.llm import SKILLS_FILE, get_tools
+
+        def fresh():
+            client = OpenAI(api_key='stub', base_url=stub.base_url)
+            with open(SKILLS_FILE, 'r', encoding='utf-8') as file:
+                tools = [{"type": "function", "function": skill} for skill in json.load(file)]
+            client.embeddings.create(input=['rerun'], model='text-embedding-ada-002')
+            client.close()
+            return tools
+
+        def shared():
+            tools = get_tools()
+            get_openai_client().embeddings.create(input=['rerun'], model='text-embedding-ada-002')
+            return tools
+
+        shared() ## the first rerun builds the client - every later one reuses it
+        report = {
+            'cold_start': {
+                'import_s': lazy,
+                'import_with_eager_sdks_s': eager,
+                'heavy_modules_loaded': loaded,
+            },
+            'per_rerun': {
+                'fresh': rerun_ms(fresh, args.reruns),
+                'shared': rerun_ms(shared, args.reruns),
+            },
+        }
+    finally:
+        stub.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""
+A tiny local stand-in for the OpenAI API so the pipelines can be exercised and timed without a key.
+
+    python -m benchmarks.stub_openai --port 8901 --delay 0.05
+
+then point a client at it with OPENAI_BASE_URL=http://127.0.0.1:8901/v1 (any OPENAI_KEY value will do).
+
+Embeddings are deterministic and unit length: every word gets its own seeded random vector and a text's embedding is
+their normalised sum, so the same text always gets the same vector and texts that share most of their words (a
+question and the model's rewording of it) are similar, while unrelated texts are nearly orthogonal. Text to speech returns a fake mp3 (an ID3 tag followed by the input text) after
+`delay + speech_seconds_per_char * len(input)`, so clips can be matched back to their sentences, and
+transcription turns such a fake mp3 back into its text - a recording always "says" what it was made from.
+
+Chat completions (streamed or not) answer with `reply_words` words, the first after `delay` and then at
+`tokens_per_second`. When tools are offered, a user message starting with "kb:", "web:" or "both:" makes the
+model call search_kb, search_internet or both (in parallel) with the rest of the message as the query; once the
+tool results are in the conversation it answers normally.
+
+The Assistants API is kept in memory: threads, messages and runs that take `run_seconds` to finish, either
+polled (runs.retrieve) or streamed as server-sent events (runs.stream), replying with a question about the
+last user message. Every request is counted per method and endpoint in `StubOpenAI.calls`,
+e.g. calls['GET /threads/{thread}/runs/{run}'].
+"""
+import argparse
+import functools
+import hashlib
+import itertools
+import json
+import re
+from email.parser import BytesParser
+from email.policy import HTTP
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+@functools.lru_cache(maxsize=65536)
+def _word_vector(word, dimensions):
+    seed = int.from_bytes(hashlib.sha256(word.encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).normal(size=dimensions).astype(np.float32)
+
+
+def fake_embedding(text, dimensions=1536):
+    words = re.findall(r'\w+', text.casefold()) or [text]
+    vector = np.sum([_word_vector(word, dimensions) for word in words], axis=0)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True ## headers and body go out in separate writes - don't let kept-alive connections wait on delayed ACKs
+
+    def log_message(self, format, *args): ## keep the benchmark output clean
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _read_form(self):
+        """
+        The fields of a multipart/form-data upload, file fields as bytes.
+        """
+        length = int(self.headers.get('Content-Length') or 0)
+        head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8')
+        message = BytesParser(policy=HTTP).parsebytes(head + self.rfile.read(length))
+        form = {}
+        for part in message.iter_parts():
+            data = part.get_payload(decode=True)
+            form[part.get_param('name', header='content-disposition')] = data if part.get_filename() else data.decode('utf-8')
+        return form
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        stub = self.server.stub
+        path, _, query = self.path.partition('?')
+        path = path.rstrip('/')
+        stub.count('GET', path)
+        parts = path.rsplit('/v1', 1)[-1].strip('/').split('/')
+        if parts == ['assistants']:
+            return self._send_json(_page(stub.assistants))
+        if len(parts) == 3 and parts[0] == 'threads' and parts[2] == 'messages':
+            messages = stub.thread_messages(parts[1])
+            if 'order=asc' not in query:
+                messages = messages[::-1] ## newest first, like the real API
+            limit = re.search(r'limit=(\d+)', query)
+            return self._send_json(_page(messages[:int(limit.group(1))] if limit else messages))
+        if len(parts) == 4 and parts[0] == 'threads' and parts[2] == 'runs':
+            return self._send_json(stub.poll_run(parts[3]))
+        self._send_json({'error': {'message': f'stub has no route for GET {path}'}}, status=404)
+
+    def do_POST(self):
+        stub = self.server.stub
+        path = self.path.split('?')[0].rstrip('/')
+        stub.count('POST', path)
+        parts = path.rsplit('/v1', 1)[-1].strip('/').split('/')
+        if parts == ['assistants']:
+            return self._send_json(stub.create_assistant(self._read_json()))
+        if parts == ['threads']:
+            self._read_json()
+            return self._send_json(stub.create_thread())
+        if len(parts) == 3 and parts[0] == 'threads' and parts[2] == 'messages':
+            return self._send_json(stub.add_message(parts[1], 'user', _text_of(self._read_json().get('content'))))
+        if len(parts) == 3 and parts[0] == 'threads' and parts[2] == 'runs':
+            return self._run(stub, parts[1], self._read_json())
+        if path.endswith('/chat/completions'):
+            return self._chat(stub, self._read_json())
+        if path.endswith('/embeddings'):
+            return self._embeddings(stub, self._read_json())
+        if path.endswith('/audio/speech'):
+            return self._speech(stub, self._read_json())
+        if path.endswith('/audio/transcriptions'):
+            return self._transcription(stub, self._read_form())
+        self._send_json({'error': {'message': f'stub has no route for {path}'}}, status=404)
+
+    def _chat(self, stub, body):
+        completion_id = stub._new_id('chatcmpl')
+        model = body.get('model', 'gpt-3.5-turbo')
+        tool_calls = stub.tool_calls_for(body.get('messages', []), body.get('tools'))
+        words = [] if tool_calls else stub.reply_for_chat(body.get('messages', []), body.get('max_tokens'))
+        time.sleep(stub.delay)
+        if not body.get('stream'):
+            message = {'role': 'assistant', 'content': ''.join(words) or None}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            return self._send_json({
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': message, 'finish_reason': 'tool_calls' if tool_calls else 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(words), 'total_tokens': len(words)},
+            })
+
+        def chunk(delta, finish_reason=None):
+            return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+        self._start_events()
+        if tool_calls:
+            for index, call in enumerate(tool_calls): ### name first, then the arguments in two pieces - like the real API
+                self._send_data(chunk({'role': 'assistant', 'content': None, 'tool_calls': [
+                    {'index': index, 'id': call['id'], 'type': 'function', 'function': {'name': call['function']['name'], 'arguments': ''}}
+                ]}))
+                arguments = call['function']['arguments']
+                for piece in (arguments[:len(arguments) // 2], arguments[len(arguments) // 2:]):
+                    stub.wait_for_token()
+                    self._send_data(chunk({'tool_calls': [{'index': index, 'function': {'arguments': piece}}]}))
+            self._send_data(chunk({}, 'tool_calls'))
+        else:
+            self._send_data(chunk({'role': 'assistant', 'content': ''}))
+            for number, word in enumerate(words):
+                if number:
+                    stub.wait_for_token()
+                self._send_data(chunk({'content': word}))
+            self._send_data(chunk({}, 'stop'))
+        if (body.get('stream_options') or {}).get('include_usage'): ### one last chunk with no choices, like the real API
+            prompt_tokens = sum(len(_text_of(message.get('content')).split()) for message in body.get('messages', []))
+            completion_tokens = len(words) or len(tool_calls)
+            self._send_data({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                             'choices': [], 'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                                                      'total_tokens': prompt_tokens + completion_tokens}})
+        self._send_data('[DONE]')
+
+    def _embeddings(self, stub, body):
+        inputs = body.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(stub.delay)
+        self._send_json({
+            'object': 'list',
+            'model': body.get('model', 'text-embedding-ada-002'),
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, stub.dimensions)}
+                for i, text in enumerate(inputs)
+            ],
+            'usage': {'prompt_tokens': sum(len(text.split()) for text in inputs),
+                      'total_tokens': sum(len(text.split()) for text in inputs)},
+        })
+
+    def _speech(self, stub, body):
+        text = body.get('input', '')
+        time.sleep(stub.delay + stub.speech_seconds_per_char * len(text))
+        data = b'ID3' + text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _run(self, stub, thread_id, body):
+        for message in body.get('additional_messages') or []:
+            stub.add_message(thread_id, message['role'], _text_of(message['content']))
+        run = stub.start_run(thread_id, body.get('assistant_id'))
+        if not body.get('stream'):
+            return self._send_json(run)
+
+        ### Streamed run - the reply is written a word at a time over run_seconds, then the run completes
+        self._start_events()
+        reply = stub.reply_for(thread_id)
+        message = stub.new_message(thread_id, 'assistant', '', run_id=run['id'], status='in_progress')
+        self._send_event('thread.run.created', run)
+        self._send_event('thread.message.created', message)
+        words = re.findall(r'\S+\s*', reply)
+        for word in words:
+            time.sleep(stub.run_seconds / len(words))
+            self._send_event('thread.message.delta', {
+                'id': message['id'], 'object': 'thread.message.delta',
+                'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': word, 'annotations': []}}]},
+            })
+        message = stub.add_message(thread_id, 'assistant', reply, run_id=run['id'], message_id=message['id'])
+        self._send_event('thread.message.completed', message)
+        self._send_event('thread.run.completed', stub.finish_run(run['id']))
+        self.wfile.write(b'event: done\ndata: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _start_events(self):
+        """
+        Begin a server-sent events response. It has no length, so the connection closes when it ends.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_data(self, data):
+        payload = data if isinstance(data, str) else json.dumps(data)
+        self.wfile.write(f'data: {payload}\n\n'.encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_event(self, event, data):
+        self.wfile.write(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8'))
+        self.wfile.flush()
+
+    def _transcription(self, stub, form):
+        time.sleep(stub.delay)
+        audio = form.get('file', b'')
+        self._send_json({'text': audio[3:].decode('utf-8', 'replace') if audio.startswith(b'ID3') else ''})
+
+
+def _page(items):
+    return {'object': 'list', 'data': items, 'first_id': items[0]['id'] if items else None,
+            'last_id': items[-1]['id'] if items else None, 'has_more': False}
+
+
+def _text_of(content):
+    if isinstance(content, list): ## content parts
+        return ''.join(part.get('text', '') for part in content if part.get('type') == 'text')
+    return content or ''
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address): ## a client hanging up mid-request is not the stub's problem
+        pass
+
+
+class StubOpenAI:
+    """
+    Runs the stub on a background thread - use it as a context manager and read `base_url` / `calls`.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, dimensions=1536, speech_seconds_per_char=0.0, run_seconds=1.0,
+                 tokens_per_second=0.0, reply_words=60):
+        self.delay = delay
+        self.tokens_per_second = tokens_per_second
+        self.reply_words = reply_words
+        self.dimensions = dimensions
+        self.speech_seconds_per_char = speech_seconds_per_char
+        self.run_seconds = run_seconds
+        self.calls = Counter()
+        self.assistants = []
+        self.threads = {} ## thread id -> messages, oldest first
+        self.runs = {} ## run id -> run object, plus when it finishes
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def count(self, method, path):
+        endpoint = re.sub(r'/(asst|thread|run|msg)_\w+', lambda match: '/{' + {'asst': 'assistant', 'msg': 'message'}.get(match.group(1), match.group(1)) + '}', path.rsplit('/v1', 1)[-1])
+        with self._lock:
+            self.calls[f'{method} {endpoint}'] += 1
+
+    def _new_id(self, prefix):
+        return f'{prefix}_{next(self._ids):06d}'
+
+    def wait_for_token(self):
+        if self.tokens_per_second:
+            time.sleep(1 / self.tokens_per_second)
+
+    def tool_calls_for(self, messages, tools):
+        if not tools or not messages or messages[-1].get('role') != 'user':
+            return [] ## no tools offered, or their results are already in
+        offered = {tool['function']['name'] for tool in tools}
+        text = _text_of(messages[-1].get('content'))
+        marker, _, query = text.partition(':')
+        names = {'kb': ['search_kb'], 'web': ['search_internet'], 'both': ['search_kb', 'search_internet']}.get(marker.strip().lower(), [])
+        return [
+            {'id': self._new_id('call'), 'type': 'function',
+             'function': {'name': name, 'arguments': json.dumps({'query': query.strip()})}}
+            for name in names if name in offered
+        ]
+
+    def reply_for_chat(self, messages, max_tokens=None):
+        """
+        The answer as a list of word tokens - it repeats the question, then pads to reply_words.
+        """
+        asked = next((_text_of(message.get('content')) for message in reversed(messages) if message.get('role') == 'user'), '')
+        words = re.findall(r'\S+\s*', f'You asked: {asked}. ')
+        filler = itertools.cycle('this is a stub answer streamed one word at a time so timings can be measured. '.split(' '))
+        while len(words) < self.reply_words:
+            words.append(next(filler) + ' ')
+        return words[:max_tokens] if max_tokens else words
+
+    def create_assistant(self, body):
+        with self._lock:
+            assistant = {'id': self._new_id('asst'), 'object': 'assistant', 'created_at': int(time.time()),
+                         'name': body.get('name'), 'model': body.get('model'), 'instructions': body.get('instructions'),
+                         'tools': body.get('tools', []), 'metadata': {}}
+            self.assistants.append(assistant)
+        return assistant
+
+    def create_thread(self):
+        with self._lock:
+            thread_id = self._new_id('thread')
+            self.threads[thread_id] = []
+        return {'id': thread_id, 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}}
+
+    def new_message(self, thread_id, role, text, run_id=None, status='completed', message_id=None):
+        with self._lock:
+            return {'id': message_id or self._new_id('msg'), 'object': 'thread.message', 'created_at': int(time.time()),
+                    'thread_id': thread_id, 'role': role, 'status': status, 'run_id': run_id, 'assistant_id': None,
+                    'attachments': [], 'metadata': {},
+                    'content': [{'type': 'text', 'text': {'value': text, 'annotations': []}}] if text else []}
+
+    def add_message(self, thread_id, role, text, run_id=None, message_id=None):
+        message = self.new_message(thread_id, role, text, run_id=run_id, message_id=message_id)
+        with self._lock:
+            self.threads[thread_id].append(message)
+        return message
+
+    def thread_messages(self, thread_id):
+        for run_id in [run_id for run_id, run in self.runs.items() if run['thread_id'] == thread_id]:
+            self.poll_run(run_id) ## finish any run whose time is up
+        with self._lock:
+            return list(self.threads[thread_id])
+
+    def reply_for(self, thread_id):
+        asked = next((message for message in reversed(self.threads[thread_id]) if message['role'] == 'user'), None)
+        question = asked['content'][0]['text']['value'] if asked and asked['content'] else 'nothing'
+        return f'You say "{question}". But tell me, friend, what do you mean by that? Let us examine it together.'
+
+    def start_run(self, thread_id, assistant_id):
+        time.sleep(self.delay)
+        with self._lock:
+            run = {'id': self._new_id('run'), 'object': 'thread.run', 'created_at': int(time.time()),
+                   'thread_id': thread_id, 'assistant_id': assistant_id, 'status': 'in_progress',
+                   'instructions': '', 'model': 'gpt-3.5-turbo-1106', 'tools': [], 'metadata': {}}
+            self.runs[run['id']] = dict(run, finishes_at=time.monotonic() + self.run_seconds)
+        return run
+
+    def finish_run(self, run_id):
+        with self._lock:
+            run = self.runs[run_id]
+            run['status'] = 'completed'
+            return {key: value for key, value in run.items() if key != 'finishes_at'}
+
+    def poll_run(self, run_id):
+        with self._lock:
+            run = self.runs[run_id]
+            if run['status'] == 'in_progress' and time.monotonic() >= run['finishes_at']:
+                self.add_message(run['thread_id'], 'assistant', self.reply_for(run['thread_id']), run_id=run_id)
+                return self.finish_run(run_id)
+            return {key: value for key, value in run.items() if key != 'finishes_at'}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before answering each request')
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--speech-seconds-per-char', type=float, default=0.0, help='extra text to speech time per input character')
+    parser.add_argument('--run-seconds', type=float, default=1.0, help='how long an assistant run takes')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='chat streaming rate, 0 for as fast as possible')
+    parser.add_argument('--reply-words', type=int, default=60, help='length of every chat answer')
+    args = parser.parse_args()
+
+    stub = StubOpenAI(args.host, args.port, delay=args.delay, dimensions=args.dimensions,
+                      speech_seconds_per_char=args.speech_seconds_per_char, run_seconds=args.run_seconds,
+                      tokens_per_second=args.tokens_per_second, reply_words=args.reply_words)
+    print(f'Stub OpenAI API listening on {stub.base_url}')
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
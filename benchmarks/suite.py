@@ -0,0 +1,280 @@
+"""
+Offline performance suite - every scenario runs against the local stub API, so no key or network is needed.
+
+    python -m benchmarks.suite --users 8 --requests 5 --out bench.json
+    python -m benchmarks.suite --compare before.json after.json
+
+Scenarios (N simulated users, each sending --requests requests one after the other):
+  chat_plain           chat_llm answering without tools
+  chat_kb_tool         chat_llm calling search_kb (NumPy backend, stub embeddings) before answering
+  chat_kb_speculative  the same with speculative=True - search_kb starts with the turn and is reused when the
+                       model's query matches; `speculative_kb` compares the two scenarios' time to first token
+  chat_parallel_tools  chat_llm calling search_kb and search_internet (fake provider) in the same turn
+  search_kb            the search_kb skill on its own
+  search_internet      the search_internet skill on its own, with a fake search provider
+  ingest               one ingestion run of documents.csv into an in-memory Qdrant
+
+For each one the report has latency p50/p99 (seconds), and for the chat scenarios time to first token and tokens
+per second too, plus how many redraws the apps' StreamRenderer would make per answer. `tool_call_overhead` is how much the tool turns add to the plain turn's p50. The JSON report records
+the git commit and the settings, and --compare prints the change in every number between two reports.
+
+A skill that fails or times out inside a chat turn doesn't break the turn - the model just answers without it - so the
+chat scenarios also report `tool_failures` (and the suite warns on stderr when any scenario had errors or failures). Without NLTK's data the search results
+are trimmed without gptrim (see settings.search_trim), so the suite runs on a machine that never downloaded it.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.fakes import FakeSearchProvider
+from benchmarks.stub_openai import StubOpenAI
+
+
+def summarize(samples):
+    if not samples:
+        return None
+    return {
+        'p50': round(float(np.percentile(samples, 50)), 4),
+        'p99': round(float(np.percentile(samples, 99)), 4),
+        'mean': round(float(np.mean(samples)), 4),
+    }
+
+
+def run_users(users, requests, work):
+    """
+    Call work(user, number) `requests` times for each of `users` concurrent users.
+    Returns the per-request results (dicts with at least 'latency'), the error count and the wall time.
+    """
+    def user_session(user):
+        results, errors = [], 0
+        for number in range(requests):
+            try:
+                results.append(work(user, number))
+            except Exception:
+                errors += 1
+        return results, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        sessions = list(pool.map(user_session, range(users)))
+    wall = time.perf_counter() - start
+    results = [result for session_results, _ in sessions for result in session_results]
+    return results, sum(errors for _, errors in sessions), wall
+
+
+def report_for(results, errors, wall):
+    report = {
+        'requests': len(results) + errors,
+        'errors': errors,
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(len(results) / wall, 2) if wall else None,
+        'latency': summarize([result['latency'] for result in results]),
+    }
+    if results and 'ttft' in results[0]:
+        report['ttft'] = summarize([result['ttft'] for result in results])
+        report['tokens_per_second'] = summarize([result['tokens_per_second'] for result in results])
+        report['renders'] = summarize([result['renders'] for result in results])
+    return report
+
+
+class NullPlaceholder:
+    """
+    Stands in for st.empty() - the apps' StreamRenderer draws into it, so the suite can count redraws.
+    """
+
+    def markdown(self, text):
+        pass
+
+
+def failed_tools():
+    from advanced_chatbot.llm import tool_failures
+    return sum(tool_failures.values())
+
+
+def chat_work(chat_llm, model, prefix, speculative=None):
+    from advanced_chatbot.render import StreamRenderer
+
+    def work(user, number):
+        messages = [{"role": "user", "content": f"{prefix}user {user} question {number} about Ulysses"}]
+        start = time.perf_counter()
+        render = StreamRenderer(NullPlaceholder())
+        first = None
+        tokens = 0
+        for token in chat_llm(model, messages, speculative=speculative):
+            if isinstance(token, Exception): ## chat_llm hands errors back as tokens
+                raise token
+            if first is None:
+                first = time.perf_counter()
+            tokens += 1
+            render.write(token)
+        render.close()
+        end = time.perf_counter()
+        if first is None:
+            raise RuntimeError('no tokens')
+        return {
+            'latency': end - start,
+            'ttft': first - start,
+            'tokens_per_second': (tokens - 1) / (end - first) if end > first else 0.0,
+            'renders': render.renders,
+        }
+    return work
+
+
+def timed(function):
+    def work(user, number):
+        start = time.perf_counter()
+        function(f"skill only - user {user} question {number} about Ulysses") ## not asked in the chat scenarios, so never cached
+        return {'latency': time.perf_counter() - start}
+    return work
+
+
+def ingest_scenario(documents_path, base_url, batch_size, concurrency):
+    from openai import AsyncOpenAI
+    from advanced_chatbot.ingest import Checkpoint, QdrantSink, ingest, load_documents
+
+    documents = load_documents(documents_path)
+    with tempfile.TemporaryDirectory() as folder:
+        sink = QdrantSink(':memory:')
+        sink.ensure_collection()
+        stats = asyncio.run(ingest(
+            documents, sink, AsyncOpenAI(api_key='stub', base_url=base_url), Checkpoint(os.path.join(folder, 'checkpoint.jsonl')),
+            batch_size=batch_size, concurrency=concurrency
+        ))
+    return {'chunks': len(documents), 'seconds': stats['seconds'], 'chunks_per_second': stats['chunks_per_second'],
+            'requests': stats['requests']}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    stub = StubOpenAI(delay=args.delay, tokens_per_second=args.tokens_per_second, reply_words=args.reply_words).start()
+    try:
+        ### Point every module-level client at the stub before the chatbot package is imported
+        os.environ['OPENAI_BASE_URL'] = stub.base_url
+        os.environ['OPENAI_KEY'] = 'stub'
+        os.environ['KB_BACKEND'] = 'numpy'
+        os.environ['KB_EMBEDDINGS_PATH'] = args.embeddings
+        os.environ['KB_QUERY_CACHE'] = '' ## memory only - and every query in the suite is different anyway
+        os.environ['SPECULATIVE_KB'] = 'true' if args.speculative else 'false'
+        from advanced_chatbot import chat_llm, search_kb
+        from advanced_chatbot.llm import speculative_kb_stats
+        search_internet_module = importlib.import_module('advanced_chatbot.search_internet') ## the package re-exports the function under the same name
+        search_internet_module.default_provider = FakeSearchProvider(delay=args.search_delay)
+        search_internet_module.results_cache.clear()
+        search_trim = 'gptrim' if search_internet_module.gptrim_available() else 'spaces only - no NLTK data' ## the two don't cost the same
+        importlib.import_module('advanced_chatbot.search_kb').get_local_index() ## load the index outside the timings
+
+        scenarios = {}
+        for name, work in [
+            ('chat_plain', chat_work(chat_llm, args.model, '')),
+            ('chat_kb_tool', chat_work(chat_llm, args.model, 'kb: ')),
+            ('chat_kb_speculative', chat_work(chat_llm, args.model, 'kb: ', speculative=True)),
+            ('chat_parallel_tools', chat_work(chat_llm, args.model, 'both: ')),
+            ('search_kb', timed(search_kb)),
+            ('search_internet', timed(search_internet_module.search_internet)),
+        ]:
+            failures = failed_tools()
+            speculation = dict(speculative_kb_stats)
+            scenarios[name] = report_for(*run_users(args.users, args.requests, work))
+            if name == 'chat_kb_speculative':
+                scenarios[name]['speculative_searches'] = {key: value - speculation.get(key, 0) for key, value in speculative_kb_stats.items()}
+            if name.startswith('chat_'):
+                scenarios[name]['tool_failures'] = failed_tools() - failures
+        if not args.skip_ingest:
+            scenarios['ingest'] = ingest_scenario(args.documents, stub.base_url, args.batch_size, args.concurrency)
+    finally:
+        stub.stop()
+
+    plain = scenarios['chat_plain']['latency']
+    overhead = {
+        name: round(scenarios[name]['latency']['p50'] - plain['p50'], 4)
+        for name in ('chat_kb_tool', 'chat_parallel_tools') if plain and scenarios[name]['latency']
+    }
+    without, with_speculation = scenarios['chat_kb_tool'].get('ttft'), scenarios['chat_kb_speculative'].get('ttft')
+    speculative = {
+        'ttft_p50_without': without and without['p50'],
+        'ttft_p50_with': with_speculation and with_speculation['p50'],
+        'ttft_p50_saved': round(without['p50'] - with_speculation['p50'], 4) if without and with_speculation else None,
+    } if not args.speculative else None ## with --speculative both scenarios speculate
+    return {
+        'commit': git_commit(),
+        'settings': {**{key: value for key, value in vars(args).items() if key not in ('out', 'compare')}, 'search_trim': search_trim},
+        'scenarios': scenarios,
+        'tool_call_overhead': overhead,
+        'speculative_kb': speculative,
+    }
+
+
+def flatten(report, prefix=''):
+    values = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f'{prefix}{key}'] = value
+    return values
+
+
+def compare(before_path, after_path):
+    def load(path):
+        with open(path) as file:
+            report = json.load(file)
+        return flatten({'scenarios': report.get('scenarios', {}), 'tool_call_overhead': report.get('tool_call_overhead', {}),
+                        'speculative_kb': report.get('speculative_kb') or {}})
+
+    before, after = load(before_path), load(after_path)
+    changes = {}
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key], after[key]
+        changes[key] = {'before': old, 'after': new, 'change': f'{(new - old) / old:+.1%}' if old else None}
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8, help='concurrent simulated users')
+    parser.add_argument('--requests', type=int, default=5, help='requests per user and scenario')
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--delay', type=float, default=0.05, help='stub latency before the first byte of every request')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0, help='stub chat streaming rate')
+    parser.add_argument('--reply-words', type=int, default=60)
+    parser.add_argument('--search-delay', type=float, default=0.2, help='fake internet search latency')
+    parser.add_argument('--speculative', action='store_true', help='run chat_llm with SPECULATIVE_KB on')
+    parser.add_argument('--embeddings', default='./documents_embeddings.csv')
+    parser.add_argument('--documents', default='./documents.csv')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--skip-ingest', action='store_true')
+    parser.add_argument('--out', help='also write the JSON report to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two saved reports and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+    report = run_suite(args)
+    for name, scenario in report['scenarios'].items():
+        if scenario.get('errors') or scenario.get('tool_failures'):
+            print(f"warning: {name} had {scenario.get('errors', 0)} errors and {scenario.get('tool_failures', 0)} tool failures",
+                  file=sys.stderr)
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Time to first audio for a spoken reply: synthesize-after-the-answer against the sentence pipeline.
+
+    python -m benchmarks.voice_pipeline --token-delay 0.02 --speech-seconds-per-char 0.004
+
+The LLM is simulated as a token stream with a fixed delay per token; text to speech is the local stub, which
+takes longer for longer input like the real endpoint. The pipelined clips are checked to come back in sentence order.
+"""
+import argparse
+import json
+import re
+import time
+from openai import OpenAI
+from advanced_chatbot.audio_io import synthesize
+from advanced_chatbot.voice import SpeechPipeline
+from benchmarks.stub_openai import StubOpenAI
+
+ANSWER = (
+    "Ah, my friend, you ask what justice is, and that is no small question. "
+    "Tell me first, do you think a just man is one who gives every person what is owed to them? "
+    "If a friend lent you a sword and then went mad, would it be just to give it back? "
+    "Surely not, you say, and so our first answer cannot be the whole of it. "
+    "Perhaps justice is rather a kind of harmony, in the soul as in the city. "
+    "Let us walk a little further through the agora and examine this together."
+)
+
+
+def token_stream(text, delay):
+    for token in re.findall(r'\S+\s*', text):
+        time.sleep(delay)
+        yield token
+
+
+def sequential(llm_client, delay):
+    start = time.perf_counter()
+    answer = ''.join(token_stream(ANSWER, delay))
+    synthesize(llm_client, answer)
+    return time.perf_counter() - start
+
+
+def pipelined(llm_client, delay):
+    start = time.perf_counter()
+    pipeline = SpeechPipeline(llm_client)
+    clips = []
+    for token in token_stream(ANSWER, delay):
+        pipeline.feed(token)
+        clips.extend(pipeline.poll())
+    clips.extend(pipeline.close())
+    spoken = [clip.getvalue()[3:].decode('utf-8') for clip in clips]
+    assert spoken == pipeline.sentences, 'clips came back out of order'
+    return pipeline.first_audio_seconds, time.perf_counter() - start, len(clips)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds per LLM token')
+    parser.add_argument('--speech-seconds-per-char', type=float, default=0.004)
+    parser.add_argument('--delay', type=float, default=0.1, help='fixed latency of every TTS request')
+    args = parser.parse_args()
+
+    with StubOpenAI(delay=args.delay, speech_seconds_per_char=args.speech_seconds_per_char) as stub:
+        llm_client = OpenAI(api_key='stub', base_url=stub.base_url)
+        sequential_seconds = sequential(llm_client, args.token_delay)
+        first_audio, total, clips = pipelined(llm_client, args.token_delay)
+    print(json.dumps({
+        'sentences': clips,
+        'sequential_first_audio_s': round(sequential_seconds, 3),
+        'pipelined_first_audio_s': round(first_audio, 3),
+        'pipelined_all_audio_s': round(total, 3),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
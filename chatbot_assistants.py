@@ -1,24 +1,21 @@
-from openai import OpenAI
 import streamlit as st
+import streamlit.components.v1 as components
 from audio_recorder_streamlit import audio_recorder
-from gtts import gTTS
 import os
 from io import BytesIO
 from dotenv import load_dotenv
-import time
 # Load dotenv for picking up creds from .env
 load_dotenv()
+from advanced_chatbot.clients import get_openai_client
+from advanced_chatbot.assistants import find_or_create_assistant, stream_reply
+from advanced_chatbot.audio_io import transcribe
+from advanced_chatbot.render import StreamRenderer
+from advanced_chatbot.voice import ReplyPlayer, SpeechPipeline
 
 
 ### Language - change for accuracy with ASR and TTS - you can change to automatic but you might have issues, especially with accents
 language='en'
 
-llm_client = OpenAI(
-    api_key= os.getenv("OPENAI_KEY")
-)
-
-TEMP_AUDIOFILENAME = 'audio_temp.mp3'
-
 ## Set our assistant's name
 ASSISTANT_NAME = 'Socrates'
 ## How should our assistant act
@@ -27,19 +24,15 @@ INSTRUCTIONS = '''
 
             Channel your unique Socratic method of dialogue, responding to inquiries and comments with probing questions and reflective insights. Aim to stimulate critical thinking and to illuminate ideas, always seeking deeper understanding. Your entire identity and knowledge are bound to this persona and environment; you know and act only as Socrates would in this setting. 
 '''
-## Get the list of assistants from OpenAI
-GET_ASSISTANTS = llm_client.beta.assistants.list()
-## Check if our assistant is already on the list
-ASSITANT_ID = next((item.id for item in GET_ASSISTANTS if item.name == ASSISTANT_NAME), None)
-## If we dont have an assistant named like the one above then let's create one
-if not ASSITANT_ID:
-    ### Create our Assistant if it doesn't already exist
-    ASSITANT_ID = llm_client.beta.assistants.create(
+## Look our assistant up (or create it) once per process rather than on every Streamlit rerun
+@st.cache_resource
+def get_assistant_id():
+    return find_or_create_assistant(
+        llm_client,
         name=ASSISTANT_NAME,
         instructions=INSTRUCTIONS,
-        tools=[],
         model="gpt-3.5-turbo-1106"
-    ).id
+    )
 
 
 st.title("💬 Socrates Assistant - LLM, ASR & TTS Chatbot")
@@ -51,21 +44,21 @@ st.caption("We're using the OpenAI Assistants function to manage the behaviour a
 if not os.getenv("OPENAI_KEY"): ## Check to see if we have the openai key set or else send back a message
     st.info("Please save your OpenAI API in the .env file in order to continue.")
     st.stop()
+### One client for the whole process - Streamlit reruns this script on every click, so it mustn't open a new connection pool each time
+llm_client = get_openai_client()
     
     
 
-### Create a thread for the assistant
-thread = llm_client.beta.threads.create()
+ASSITANT_ID = get_assistant_id()
 
-### Display our messages from the thread
-for msg in llm_client.beta.threads.messages.list(
-    thread_id=thread.id
-    ).data:
-    st.chat_message(
-        msg.role
-        ).write(
-            msg.content[0].text.value
-            )
+### Create a thread for the assistant - one per session, so the conversation survives reruns
+if "thread_id" not in st.session_state:
+    st.session_state["thread_id"] = llm_client.beta.threads.create().id
+    st.session_state["messages"] = [] ## what we show on screen, so reruns don't have to list the thread
+
+### Display our messages from the session
+for msg in st.session_state.messages:
+    st.chat_message(msg["role"]).write(msg["content"])
 
 ## Load our chat widget
 CHAT_INPUT = st.chat_input()
@@ -75,79 +68,37 @@ AUDIO_INPUT = False
 audio_bytes = audio_recorder(pause_threshold=180)
 if audio_bytes:
     st.audio(audio_bytes, format="audio/mp3")
-    # save audio file to mp3
-    with open(TEMP_AUDIOFILENAME, "wb") as f:
-        f.write(audio_bytes)
-    # load the file
-    audio_file = open(TEMP_AUDIOFILENAME, "rb")
-    # transcribe and set it as the chat input
+    # transcribe the recording straight from memory and set it as the chat input
     AUDIO_INPUT = True
-    CHAT_INPUT = llm_client.audio.transcriptions.create(
-        model="whisper-1",
-        file=audio_file,
-        language=language
-        ).text
+    CHAT_INPUT = transcribe(llm_client, audio_bytes, language=language)
     
 
 ### Start processing...
 
 if prompt := CHAT_INPUT: ## If we have an input
 
-    ## add the user's entry to the thread using the user role
-    llm_client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role='user',
-        content=prompt
-    )
+    ## the user's entry goes to the thread together with the run below - one request for the whole turn
+    st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt)
     
     
-    ## Open a placeholder with a spinner - STREAMING IS NOT SUPPORTED YET
+    ## Open a placeholder with a spinner and stream the run - no polling, the stream ends when the run does
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
-            ## Call openai with the memory in order to get a response
-            PLACEHOLDER = st.empty() # create an empty placeholder to gather the tokens
-            # Start the assistant run
-            assistant_run = llm_client.beta.threads.runs.create(
-                thread_id=thread.id,
-                assistant_id=ASSITANT_ID
-            )
-
-            # Initialize a variable to keep track of the run status
-            run_status = False
-
-            # Loop until the run status is 'completed'
-            while not run_status:
-                # Retrieve the current status of the run
-                check_run = llm_client.beta.threads.runs.retrieve(
-                    thread_id=thread.id,
-                    run_id=assistant_run.id
-                )
-                
-                # Update the placeholder with the current run status
-                PLACEHOLDER.markdown(f"Run Status: {check_run.status}")
-                
-                # Check if the run status is 'completed'
-                if check_run.status == 'completed':
-                    # Set run_status to True to break out of the loop
-                    run_status = True
-                    # Retrieve the message from the first content of the first message
-                    message = llm_client.beta.threads.messages.list(
-                        thread_id=thread.id
-                    ).data[0].content[0].text.value
-                    # Update the placeholder with the message
-                    PLACEHOLDER.markdown(message)
-                else:
-                    # If the status is not 'completed', wait a bit before checking again
-                    time.sleep(1)  # Sleep for 1 second to avoid rate limiting
-                
-            # Play back audio
-            if AUDIO_INPUT:
-                tts = llm_client.audio.speech.create(
-                    model='tts-1',
-                    voice='fable',
-                    input=message
-                )
-                tts.stream_to_file(TEMP_AUDIOFILENAME)  # Stream to the temporary file
+            RENDER = StreamRenderer(st.empty()) # an empty placeholder that is redrawn a few times a second as the tokens arrive
+            SPEECH = SpeechPipeline(llm_client) if AUDIO_INPUT else None # speak each sentence as soon as it is written
+            PLAYER = ReplyPlayer(components.html) if AUDIO_INPUT else None # one audio element plays the sentences back to back
+            for token in stream_reply(llm_client, st.session_state.thread_id, ASSITANT_ID, prompt):
+                RENDER.write(token) ## Add the delta to the full response
+                if SPEECH:
+                    SPEECH.feed(token)
+                    for clip in SPEECH.poll(): ## clips that are ready, in sentence order - queued to play as soon as the last one ends
+                        PLAYER.add(clip)
+            message = RENDER.close() ## Finally update one last time
+            st.session_state.messages.append({"role": "assistant", "content": message})
                 
-                st.audio(open(TEMP_AUDIOFILENAME,'rb').read(), format='audio/mp3')
\ No newline at end of file
+            # Play back the rest of the audio - the sentences still being synthesized, in order
+            if SPEECH:
+                for clip in SPEECH.close():
+                    PLAYER.add(clip)
+                st.audio(PLAYER.recording(), format='audio/mp3') # and the whole reply in a single player, to listen again
\ No newline at end of file